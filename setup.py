@@ -21,5 +21,5 @@ setup(
         'yas_scenes',
         'yas_scenes.tests',
     ],
-    scripts=['scripts/scenes'],
+    scripts=['scripts/scenes', 'scripts/scenes-client'],
 )
@@ -2,11 +2,26 @@ import logging
 _log = logging.getLogger(__name__)
 
 import argparse
+import multiprocessing
+import sys
+from contextlib import contextmanager
 
-from yas_scenes.parser import parse_ion_sites, parse_sym_contacts
-from yas_scenes.tasks import ion_sites, symmetry_contacts
-from yas_scenes.utils import (delete_scene, is_valid_file, is_valid_pdbid,
-                              set_dir_log_wn, write_whynot)
+from yas_scenes import pipeline, profiling
+from yas_scenes.batch import BatchRunner
+from yas_scenes.descriptor import export_all
+from yas_scenes.index import ListIndex, get_index
+from yas_scenes.journal import Journal, resume
+from yas_scenes.lease import LeaseRunner, WorkDir
+from yas_scenes.pack import KINDS, SceneArchive
+from yas_scenes.query import Predicate, select_entries
+from yas_scenes.scenestore import evict_scenes, get_store_setting, \
+    remove_orphans
+from yas_scenes.settings import settings, settings_file
+from yas_scenes.tune import grid, sample_jobs, tune as tune_host, \
+    write_settings
+from yas_scenes.utils import is_valid_file, is_valid_pdbid, is_valid_structure
+from yas_scenes.watch import ChangeFeed, ListPoller, Watcher
+from yas_scenes.zygote import Zygote
 
 
 def ion(args):
@@ -22,24 +37,10 @@ def ion(args):
 
     SCENES_NAME is configured in scenes_settings
     and determines file names and WHY_NOT database name
-    """
-    scene_path, yas_log_path, wn_file, wn_db = set_dir_log_wn(args, 'iod')
-    ion_ligands = parse_ion_sites(iod=args.iod)
-
-    _log.info('Will try to create metal ion sites YASARA scene {} from {} '
-              'and {} for PDB ID {}'.format(scene_path, args.pdb_file_path,
-                                            args.iod, args.pdb_id))
-    success, msg = ion_sites(args.pdb_file_path, scene_path,
-                             ion_ligands, args.ypid, yas_log_path)
 
-    if not success:
-        _log.error('{}: {}'.format(args.pdb_id, msg))
-        # If the scene file is still present, delete it
-        delete_scene(scene_path)
-        # Create a WHY NOT entry
-        write_whynot(args.pdb_id, msg, wn_db, wn_file)
-    else:
-        _log.info('{}: {}'.format(args.pdb_id, msg))
+    Return True if the scene was created.
+    """
+    return pipeline.run(args)
 
 
 def ss2(args):
@@ -55,38 +56,56 @@ def ss2(args):
 
     SCENES_NAME is configured in scenes_settings
     and determines file names and WHY_NOT database name
+
+    Return True if the scene was created.
     """
-    scene_path, yas_log_path, wn_file, wn_db = set_dir_log_wn(args, 'ss2')
-    sym_contacts = parse_sym_contacts(ss2=args.ss2)
+    return pipeline.run(args)
+
+
+def add_profile_argument(parser):
+    """Add the --profile option to parser."""
+    parser.add_argument("--profile", metavar="DIR", help="profile all jobs, "
+                        "store the profiles in DIR (preferably empty) and "
+                        "report on all of them at the end")
+
 
-    _log.info('Will try to create crystal contacts YASARA scene {} from {} '
-              'and {} for PDB ID {}'.format(scene_path, args.pdb_file_path,
-                                            args.ss2, args.pdb_id))
-    success, msg = symmetry_contacts(args.pdb_file_path, scene_path,
-                                     sym_contacts, args.ypid, yas_log_path)
+def add_status_argument(parser):
+    """Add the --status option to parser."""
+    parser.add_argument("--status", metavar="FILE", help="write the progress "
+                        "of the run to FILE every STATUS_INTERVAL seconds "
+                        "(default: STATUS_FILE)")
 
-    if not success:
-        _log.error('{}: {}'.format(args.pdb_id, msg))
-        # If the scene file is still present, delete it
-        delete_scene(scene_path)
-        # Create a WHY NOT entry
-        write_whynot(args.pdb_id, msg, wn_db, wn_file)
-    else:
-        _log.info('{}: {}'.format(args.pdb_id, msg))
 
+@contextmanager
+def profiling_run(args):
+    """Profile the jobs run in the block if --profile was given, and report
+    on the profiles afterwards."""
+    if not args.profile:
+        yield
+        return
+    profiling.enable(args.profile)
+    try:
+        yield
+    finally:
+        profiling.report(args.profile)
 
-def main():
-    """Create YASARA scenes."""
 
+def build_parser():
+    """Return the parser for the command line arguments of a single run."""
     parser = argparse.ArgumentParser(description="Create a YASARA scene.",
                                      prog="scenes")
     parser.add_argument("-v", "--verbose", help="show verbose output",
                         action="store_true")
+    parser.add_argument("-t", "--threads", help="number of YASARA cpu "
+                        "threads (default: 1)", type=int, default=1)
+    add_profile_argument(parser)
     parser.add_argument("ypid", help="YASARA process id. Warning: specify a "
                         "different pid if multiple YASARA instances run on the"
                         " same machine", type=int)
-    parser.add_argument("pdb_file_path", help="PDB file location.",
-                        type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("pdb_file_path", help="PDB or mmCIF file location, "
+                        "optionally gzipped, e.g. pdb1crn.ent.gz or "
+                        "1crn.cif.gz",
+                        type=lambda x: is_valid_structure(parser, x))
     parser.add_argument("pdb_id", help="PDB accession code.",
                         type=lambda x: is_valid_pdbid(parser, x))
     parser.add_argument("source", choices=["PDB", "REDO"],
@@ -97,16 +116,468 @@ def main():
                                             " crystal contacts")
     p_ion = subparsers.add_parser("ion", description="Create a YASARA scene of"
                                   " metal ion sites")
+    p_ion.add_argument("--slim", help="delete hidden atoms from the scene, "
+                       "keeping only the ion sites", action="store_true")
     p_ion.add_argument("iod", help="WHAT IF list iod file (bzip2ed)",
                        type=lambda x: is_valid_file(parser, x))
-    p_ion.set_defaults(func=ion)
+    p_ion.set_defaults(func=ion, mode='iod')
     p_ss2 = subparsers.add_parser("symm", description="Create a YASARA scene"
                                   " with colored crystal contacts")
     p_ss2.add_argument("ss2", help="WHAT IF list crystal contacts file "
                                    "(bzip2ed), e.g. 1crn.ss2.bz2",
                        type=lambda x: is_valid_file(parser, x))
-    p_ss2.set_defaults(func=ss2)
+    p_ss2.set_defaults(func=ss2, mode='ss2')
+    return parser
+
+
+def parse_job(job_args, verbose=False):
+    """Parse the arguments of a single run, without YASARA pid, as a job.
+
+    Return the parsed arguments, or None if they are invalid.
+    The YASARA pid and number of threads are assigned by the batch runner.
+    """
+    argv = ['-v'] if verbose else []
+    argv = argv + ['0'] + job_args
+    try:
+        job = build_parser().parse_args(argv)
+    except SystemExit:
+        _log.error('Invalid job: {}'.format(' '.join(job_args)))
+        return None
+    job.job_args = job_args
+    return job
+
+
+def read_jobs(job_file, verbose=False):
+    """Read the jobs in job_file.
+
+    Each line has the arguments of a single run without YASARA pid, e.g.
+        pdb1crn.ent.gz 1crn PDB ion 1crn.iod.bz2
+    Empty lines and lines starting with # are ignored, as are invalid jobs.
+    """
+    jobs = []
+    with open(job_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                job = parse_job(line.split(), verbose)
+                if job:
+                    jobs.append(job)
+    return jobs
+
+
+def batch(argv):
+    """Create YASARA scenes for all jobs in a job file, in parallel.
+
+    Jobs are run most expensive first, see scheduler and BatchRunner.
+    Finished jobs are recorded in a journal, so an interrupted run can be
+    resumed with --resume.
+    """
+    parser = argparse.ArgumentParser(description="Create YASARA scenes in "
+                                     "parallel.", prog="scenes batch")
+    parser.add_argument("-v", "--verbose", help="show verbose output",
+                        action="store_true")
+    parser.add_argument("-c", "--cores", help="number of cores to use "
+                        "(default: all)", type=int)
+    parser.add_argument("--first-ypid", help="first of the YASARA process "
+                        "ids to use, one per core (default: 1000)", type=int)
+    parser.add_argument("job_file", help="file with one job per line: the "
+                        "arguments of a single run without YASARA pid, e.g. "
+                        "'pdb1crn.ent.gz 1crn PDB ion 1crn.iod.bz2'",
+                        type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("--journal", help="journal of started and finished "
+                        "jobs (default: <job_file>.journal)")
+    parser.add_argument("--resume", help="skip the jobs that finished "
+                        "according to the journal, and delete the scenes of "
+                        "jobs that were interrupted", action="store_true")
+    add_profile_argument(parser)
+    add_status_argument(parser)
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args.job_file, args.verbose)
+    journal = Journal(args.journal or args.job_file + '.journal')
+    if args.resume:
+        jobs = resume(jobs, journal)
+    journal.open(args.resume)
+    try:
+        with profiling_run(args):
+            BatchRunner(pipeline, args.cores, args.first_ypid, journal,
+                        args.status).run(jobs)
+    finally:
+        journal.close()
+
+
+def export(argv):
+    """Write descriptors of the scenes of all jobs in a job file, without
+    YASARA.
+
+    A descriptor is a compact JSON file next to the scene with what the scene
+    shows: the ion sites with their ligands and distances, or the residues
+    with crystal contacts and their colours, with the coordinates of their
+    atoms. See descriptor.describe.
+    """
+    parser = argparse.ArgumentParser(description="Write JSON descriptors of "
+                                     "YASARA scenes for web viewers.",
+                                     prog="scenes export")
+    parser.add_argument("-p", "--processes", help="number of parallel "
+                        "exports (default: all cores)", type=int)
+    parser.add_argument("job_file", help="file with one job per line, see "
+                        "scenes batch",
+                        type=lambda x: is_valid_file(parser, x))
+    args = parser.parse_args(argv)
+
+    export_all(read_jobs(args.job_file), args.processes)
+
+
+def submit(argv):
+    """Add the jobs in a job file to a work dir shared by several nodes."""
+    parser = argparse.ArgumentParser(description="Add jobs to a shared work "
+                                     "dir.", prog="scenes submit")
+    parser.add_argument("work_dir", help="work dir on a filesystem shared by "
+                        "all nodes")
+    parser.add_argument("job_file", help="file with one job per line, see "
+                        "scenes batch",
+                        type=lambda x: is_valid_file(parser, x))
+    args = parser.parse_args(argv)
+
+    WorkDir(args.work_dir).submit(read_jobs(args.job_file))
+
+
+def work(argv):
+    """Run jobs from a work dir shared by several nodes until all finished.
+
+    Start a worker on every node; see LeaseRunner.
+    """
+    parser = argparse.ArgumentParser(description="Run jobs from a shared work "
+                                     "dir.", prog="scenes work")
+    parser.add_argument("-v", "--verbose", help="show verbose output",
+                        action="store_true")
+    parser.add_argument("-c", "--cores", help="number of cores to use "
+                        "(default: all)", type=int)
+    parser.add_argument("--first-ypid", help="first of the YASARA process "
+                        "ids to use, one per core (default: 1000)", type=int)
+    parser.add_argument("-f", "--follow", help="keep waiting for new jobs "
+                        "when all jobs have finished", action="store_true")
+    parser.add_argument("work_dir", help="work dir on a filesystem shared by "
+                        "all nodes")
+    add_profile_argument(parser)
+    add_status_argument(parser)
+    args = parser.parse_args(argv)
+
+    with profiling_run(args):
+        LeaseRunner(args.work_dir, lambda x: parse_job(x, args.verbose),
+                    pipeline, args.cores, args.first_ypid, args.follow,
+                    args.status).run()
+
+
+def watch(argv):
+    """Submit jobs for new and changed entries to a work dir.
+
+    Changes are read from a change feed written by the PDB mirror job and/or
+    found by polling the list databank dirs (LIST_DIRS); see watch.Watcher.
+    Run 'scenes work --follow' on the worker nodes.
+    """
+    parser = argparse.ArgumentParser(description="Submit jobs for changed "
+                                     "entries.", prog="scenes watch")
+    parser.add_argument("--feed", help="change feed: lines with 'added', "
+                        "'modified' or 'obsoleted' and a PDB ID")
+    parser.add_argument("--poll", help="poll the list databank dirs for "
+                        "changes", action="store_true")
+    parser.add_argument("--interval", help="seconds between checks "
+                        "(default: 60)", type=int)
+    parser.add_argument("--once", help="check once and exit",
+                        action="store_true")
+    parser.add_argument("source", choices=["PDB", "REDO"],
+                        help="PDB file source")
+    parser.add_argument("work_dir", help="work dir on a filesystem shared by "
+                        "all nodes")
+    args = parser.parse_args(argv)
+
+    feeds = []
+    if args.feed:
+        feeds.append(ChangeFeed(args.feed))
+    if args.poll:
+        feeds.append(ListPoller(settings.get('LIST_DIRS', {})))
+    if not feeds:
+        parser.error('Use --feed and/or --poll')
+    Watcher(args.work_dir, args.source, parse_job, feeds,
+            args.interval).run(args.once)
+
+
+def index(argv):
+    """Build or update the index of all WHAT IF iod and ss2 list files.
+
+    See ListIndex. The list databank dirs are configured as LIST_DIRS and the
+    index dir as LIST_INDEX in scenes_settings.
+    """
+    parser = argparse.ArgumentParser(description="Index WHAT IF list files.",
+                                     prog="scenes index")
+    parser.add_argument("action", choices=["build"],
+                        help="build: index new and changed list files")
+    parser.add_argument("-p", "--processes", help="number of parallel "
+                        "parsers (default: all cores)", type=int)
+    parser.add_argument("--index-dir", help="index dir (default: "
+                        "LIST_INDEX)", default=settings.get('LIST_INDEX'))
+    args = parser.parse_args(argv)
+    if not args.index_dir:
+        parser.error('No index dir: configure LIST_INDEX or use --index-dir')
+
+    list_index = ListIndex(args.index_dir)
+    list_index.update(settings.get('LIST_DIRS', {}), args.processes)
+    list_index.close()
+
+
+def store(argv):
+    """Collect garbage in the scene store.
+
+    See scenestore. The store dir is configured as SCENE_STORE in
+    scenes_settings.
+    """
+    parser = argparse.ArgumentParser(description="Manage the scene store.",
+                                     prog="scenes store")
+    parser.add_argument("action", choices=["gc"],
+                        help="gc: evict the least recently used scenes above "
+                        "the maximum size, scenes that are not in a scene "
+                        "dir first")
+    parser.add_argument("--orphans", help="also remove all scenes that are "
+                        "not in a scene dir (store and scene roots must be on "
+                        "the same filesystem)", action="store_true")
+    parser.add_argument("--max-bytes", help="maximum size of the store "
+                        "(default: SCENE_STORE MAX_BYTES)", type=int)
+    args = parser.parse_args(argv)
+    if not get_store_setting('DIR'):
+        parser.error('No scene store: configure SCENE_STORE')
+
+    if args.orphans:
+        remove_orphans()
+    evict_scenes(args.max_bytes)
+
+
+def pack(argv):
+    """Pack the scenes, logs and WHY NOT files of a source in an archive, or
+    get a file from it.
+
+    See pack.SceneArchive. The archive dir is configured as PACK_DIR in
+    scenes_settings.
+    """
+    parser = argparse.ArgumentParser(description="Pack scenes in sharded "
+                                     "archives.", prog="scenes pack")
+    parser.add_argument("--pack-dir", help="archive dir (default: "
+                        "PACK_DIR)", default=settings.get('PACK_DIR'))
+    subparsers = parser.add_subparsers(title="action")
+    p_build = subparsers.add_parser("build", description="Pack new and "
+                                    "changed files, and forget removed ones")
+    p_build.add_argument("source", choices=["PDB", "REDO"],
+                         help="PDB file source")
+    p_build.set_defaults(action='build')
+    p_get = subparsers.add_parser("get", description="Write a packed file "
+                                  "to stdout")
+    p_get.add_argument("-k", "--kind", choices=sorted(KINDS),
+                       default="scene", help="kind of file (default: scene)")
+    p_get.add_argument("source", choices=["PDB", "REDO"],
+                       help="PDB file source")
+    p_get.add_argument("mode", choices=["iod", "ss2"], help="scene type")
+    p_get.add_argument("pdb_id", help="PDB accession code",
+                       type=lambda x: is_valid_pdbid(parser, x))
+    p_get.set_defaults(action='get')
+    args = parser.parse_args(argv)
+    if not args.pack_dir:
+        parser.error('No archive dir: configure PACK_DIR or use --pack-dir')
+
+    archive = SceneArchive(args.pack_dir)
+    if args.action == 'build':
+        archive.update(args.source)
+        return
+    data = archive.get(args.source, args.mode, args.pdb_id.lower(),
+                       args.kind)
+    if data is None:
+        parser.exit(1, 'Not packed: {} {} {}\n'.format(
+            args.kind, args.mode, args.pdb_id))
+    sys.stdout.write(data)
+
+
+def structure_file(pdb_id, source):
+    """Return the path to the structure file of this PDB ID and source.
+
+    STRUCTURE_FILES is configured in scenes_settings, with a path template per
+    source, e.g. {"PDB": "/data/pdb/pdb{pdb_id}.ent.gz"}.
+    """
+    return settings['STRUCTURE_FILES'][source].format(pdb_id=pdb_id)
+
+
+def regen(argv):
+    """Create the scenes of all entries whose parsed lists match conditions.
+
+    The conditions are resolved against the list index, see query.Predicate.
+    The matching entries are run in parallel by the BatchRunner.
+    """
+    parser = argparse.ArgumentParser(description="Create YASARA scenes for "
+                                     "entries matching conditions.",
+                                     prog="scenes regen")
+    parser.add_argument("-v", "--verbose", help="show verbose output",
+                        action="store_true")
+    parser.add_argument("-c", "--cores", help="number of cores to use "
+                        "(default: all)", type=int)
+    parser.add_argument("--first-ypid", help="first of the YASARA process "
+                        "ids to use, one per core (default: 1000)", type=int)
+    parser.add_argument("-n", "--dry-run", help="print the jobs instead of "
+                        "running them", action="store_true")
+    parser.add_argument("--slim", help="delete hidden atoms from ion site "
+                        "scenes", action="store_true")
+    parser.add_argument("--where", help="condition on the list of an entry, "
+                        "e.g. 'ion=HG,CD', 'chain=A', 'sites>=2' (ion) or "
+                        "'contacts>20' (symm). Repeat to require several "
+                        "conditions.", action="append", required=True)
+    parser.add_argument("source", choices=["PDB", "REDO"],
+                        help="PDB file source")
+    parser.add_argument("mode", choices=["ion", "symm"],
+                        help="ion for metal ion sites, symm for crystal "
+                        "contacts")
+    add_profile_argument(parser)
+    add_status_argument(parser)
+    args = parser.parse_args(argv)
+
+    mode = 'iod' if args.mode == 'ion' else 'ss2'
+    try:
+        predicates = [Predicate(mode, w) for w in args.where]
+    except ValueError as e:
+        parser.error(e)
+    list_index = get_index()
+    if not list_index:
+        parser.error('No list index: configure LIST_INDEX and run '
+                     'scenes index build')
+
+    jobs = []
+    for pdb_id, list_path in select_entries(list_index, mode, predicates):
+        job_args = [structure_file(pdb_id, args.source), pdb_id,
+                    args.source, args.mode, list_path]
+        if args.slim and args.mode == 'ion':
+            job_args.insert(-1, '--slim')
+        if args.dry_run:
+            sys.stdout.write(' '.join(job_args) + '\n')
+            continue
+        job = parse_job(job_args, args.verbose)
+        if job:
+            jobs.append(job)
+
+    if jobs:
+        with profiling_run(args):
+            BatchRunner(pipeline, args.cores, args.first_ypid,
+                        status_path=args.status).run(jobs)
+
+
+def int_list(value):
+    """Parse a comma separated list of positive numbers, e.g. 1,2,4."""
+    try:
+        values = [int(v) for v in value.split(',')]
+    except ValueError:
+        values = []
+    if not values or min(values) < 1:
+        raise argparse.ArgumentTypeError('Not a list of positive numbers: {}'
+                                         .format(value))
+    return values
+
+
+def tune(argv):
+    """Find the fastest number of YASARA processes and threads per process
+    on this host, and store it in the settings file.
+
+    A sample of the jobs in a job file is run with every configuration, see
+    tune.tune. Batch runs then use the best one, as CORES and THREADS.
+    """
+    parser = argparse.ArgumentParser(description="Find the best number of "
+                                     "workers and threads per worker.",
+                                     prog="scenes tune")
+    parser.add_argument("-v", "--verbose", help="show verbose output",
+                        action="store_true")
+    parser.add_argument("-n", "--sample", help="number of jobs to run per "
+                        "configuration (default: 20)", type=int, default=20)
+    parser.add_argument("-c", "--cpus", help="number of cpus to use "
+                        "(default: all)", type=int)
+    parser.add_argument("--workers", help="numbers of workers to try, e.g. "
+                        "4,8,16 (default: doubling up to the number of cpus)",
+                        type=int_list)
+    parser.add_argument("--threads", help="numbers of threads per worker to "
+                        "try, e.g. 1,2 (default: doubling up to MAX_THREADS)",
+                        type=int_list)
+    parser.add_argument("--first-ypid", help="first of the YASARA process "
+                        "ids to use, one per cpu (default: 1000)", type=int)
+    parser.add_argument("--dry-run", help="report the best configuration "
+                        "without writing it to the settings file",
+                        action="store_true")
+    parser.add_argument("job_file", help="file with one job per line, see "
+                        "scenes batch",
+                        type=lambda x: is_valid_file(parser, x))
+    args = parser.parse_args(argv)
+
+    n_cpus = args.cpus or multiprocessing.cpu_count()
+    configs = grid(n_cpus, args.workers, args.threads)
+    if not configs:
+        parser.error('No configuration uses at most {} cpus'.format(n_cpus))
+    sample = [job.job_args for job in
+              sample_jobs(read_jobs(args.job_file), args.sample)]
+    if not sample:
+        parser.error('No jobs in {}'.format(args.job_file))
+
+    (n_workers, n_threads), rates = tune_host(
+        pipeline, lambda: [parse_job(a, args.verbose) for a in sample],
+        configs, args.first_ypid)
+    for config in configs:
+        sys.stdout.write('{:3d} workers x {} threads: {:8.1f} scenes/hour\n'
+                         .format(config[0], config[1], rates[config]))
+    sys.stdout.write('Best: {} workers x {} threads\n'.format(n_workers,
+                                                              n_threads))
+    if not args.dry_run:
+        write_settings(settings_file, n_workers, n_threads)
+        _log.info('Wrote CORES {} and THREADS {} to {}'.format(
+            n_workers * n_threads, n_threads, settings_file))
+
+
+def zygote(argv):
+    """Serve scenes commands from a warm interpreter, see zygote.Zygote.
+
+    Run commands with scripts/scenes-client, which takes the same arguments
+    as scenes.
+    """
+    parser = argparse.ArgumentParser(description="Serve scenes commands from "
+                                     "a warm interpreter.",
+                                     prog="scenes zygote")
+    parser.add_argument("socket", nargs="?", help="unix socket to listen on "
+                        "(default: ZYGOTE_SOCKET)",
+                        default=settings.get('ZYGOTE_SOCKET'))
+    args = parser.parse_args(argv)
+    if not args.socket:
+        parser.error('No socket: configure ZYGOTE_SOCKET or give one')
+
+    Zygote(args.socket).serve()
+
+
+COMMANDS = {
+    'batch': batch,
+    'export': export,
+    'index': index,
+    'pack': pack,
+    'regen': regen,
+    'store': store,
+    'submit': submit,
+    'tune': tune,
+    'watch': watch,
+    'work': work,
+    'zygote': zygote,
+}
+
+
+def main(argv=None):
+    """Create YASARA scenes.
+
+    Run one of the COMMANDS if it is the first argument, else create a single
+    scene.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
 
-    args = parser.parse_args()
+    args = build_parser().parse_args(argv)
 
-    args.func(args)
+    with profiling_run(args):
+        args.func(args)
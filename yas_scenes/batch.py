@@ -0,0 +1,319 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import multiprocessing
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from yas_scenes.health import MemoryMonitor
+from yas_scenes.listcache import get_cache
+from yas_scenes.progress import Progress
+from yas_scenes.scheduler import get_batch_setting, order_jobs, threads_for
+
+
+# Seconds between checks for finished jobs
+POLL_INTERVAL = 0.2
+
+
+def acquire_logging_locks():
+    """Acquire the lock of the logging module and of the root log handlers.
+
+    The runner forks job processes while its prepare and finish threads log.
+    Holding these locks while forking makes sure a job process does not
+    inherit a lock held by one of those threads.
+
+    Return the handlers whose locks are held.
+    """
+    logging._acquireLock()
+    handlers = list(logging.getLogger().handlers)
+    for handler in handlers:
+        handler.acquire()
+    return handlers
+
+
+def release_logging_locks(handlers):
+    """Release the locks acquired by acquire_logging_locks."""
+    for handler in reversed(handlers):
+        handler.release()
+    logging._releaseLock()
+
+
+def _render(render, job, conn, handlers):
+    """Render the scene of this job. This runs in a job process.
+
+    The job process is forked by the thread holding the logging locks, so it
+    can release its copies of them. The result of render is sent through conn.
+    """
+    release_logging_locks(handlers)
+    conn.send(render(job))
+    conn.close()
+
+
+class BatchRunner(object):
+    """Run scene jobs in parallel, most expensive first.
+
+    Jobs are parsed command line arguments of single scenes runs. They pass
+    through the stages of a pipeline (see pipeline):
+        prepare  make the scene dir, parse the list, stage the structure
+        render   create the scene with YASARA
+        finish   check the YASARA log, clean up, write a WHY NOT file
+        publish  publish the output files of finished jobs now
+    Only render needs YASARA: each job renders in its own process with its own
+    YASARA pid. The next PREFETCH jobs are prepared, and rendered jobs are
+    finished, by threads of the runner, so YASARA doesn't wait for file I/O.
+
+    Jobs are started longest first: expensive jobs get more YASARA cpu
+    threads, cheap jobs fill the remaining cores with one thread each. The
+    total number of threads in use never exceeds the number of cores. If
+    n_threads or THREADS is set, e.g. by scenes tune, every job gets that
+    many threads, so n_cores / n_threads jobs run at a time.
+
+    A job is only started if the memory it is estimated to need is available,
+    and jobs exceeding the memory ceiling are killed, see health.MemoryMonitor.
+    Jobs that fit in memory may overtake a job that doesn't, so small jobs
+    fill the memory left by large ones, until that job has waited
+    MEMORY_MAX_WAIT seconds.
+    Every job renders in a fresh process with a fresh YASARA, so memory
+    leaked by one job is returned when it ends.
+
+    If a journal is given, started and finished jobs are recorded in it, so
+    an interrupted run can be resumed, see journal. Progress is reported
+    while jobs run, and written to status_path if given, see progress.
+    """
+
+    def __init__(self, pipeline, n_cores=None, first_ypid=None, journal=None,
+                 status_path=None, n_threads=None):
+        self.pipeline = pipeline
+        self.journal = journal
+        self.n_cores = n_cores or get_batch_setting('CORES') or \
+            multiprocessing.cpu_count()
+        self.n_threads = n_threads or get_batch_setting('THREADS')
+        first_ypid = first_ypid or get_batch_setting('FIRST_YPID', 1000)
+        self.free_ypids = range(first_ypid + self.n_cores - 1,
+                                first_ypid - 1, -1)
+        self.free_cores = self.n_cores
+        self.running = []
+        self.pending = []
+        self.prefetch_depth = get_batch_setting('PREFETCH', self.n_cores)
+        self.prepare_pool = ThreadPool(get_batch_setting('PREPARE_THREADS',
+                                                         2))
+        self.finish_pool = ThreadPool(get_batch_setting('FINISH_THREADS', 2))
+        self.lock = threading.Lock()
+        self.memory = MemoryMonitor()
+        self.max_wait = get_batch_setting('MEMORY_MAX_WAIT', 300)
+        self.progress = Progress(self.n_cores, status_path)
+        self.next_sample = 0
+        self.finishing = 0
+        self.done = 0
+        self.failed = 0
+
+    def run(self, jobs):
+        """Run all jobs and wait for them to finish.
+
+        Return the number of created scenes and the number of failed jobs.
+        """
+        self.pending = order_jobs(jobs)
+        self.progress.add(self.pending)
+        _log.info('Running {} jobs on {} cores'.format(len(self.pending),
+                                                     self.n_cores))
+        try:
+            while self.pending or self.running or self.finishing:
+                self.step()
+                self.publish_last()
+        finally:
+            self.close()
+            self.pipeline.publish()
+            self.progress.report(force=True)
+
+        _log.info('Batch finished: {} scenes created, {} failed'.format(
+            self.done, self.failed))
+        _log.info('Parsed list cache: {}'.format(get_cache().stats()))
+        return self.done, self.failed
+
+    def publish_last(self):
+        """Publish the output files of finished jobs now if no jobs are
+        pending or running, rather than after PUBLISH_INTERVAL."""
+        if self.finishing and not (self.pending or self.running):
+            self.pipeline.publish()
+
+    def close(self):
+        """Wait for the prepare and finish threads to stop."""
+        for pool in (self.prepare_pool, self.finish_pool):
+            pool.close()
+            pool.join()
+
+    def step(self):
+        """Start prepared jobs on free cores, watch their memory use and reap
+        rendered jobs."""
+        self.start_prepared()
+        self.check_memory()
+        if self.journal:
+            self.journal.sync()
+        self.progress.report()
+        if not self.reap():
+            time.sleep(POLL_INTERVAL)
+
+    def start_prepared(self):
+        """Prefetch pending jobs and start them once they are prepared and
+        cores and memory are free, see next_job.
+
+        Jobs that could not be prepared fail. Jobs that are restored from the
+        scene store or certain to fail are finished without rendering them.
+        """
+        self.prefetch()
+        while self.free_cores > 0:
+            job = self.next_job()
+            if job is None:
+                break
+            self.pending.remove(job)
+            self.prefetch()
+            try:
+                outcome = job.prepared.get()
+            except Exception as e:
+                _log.error('{} {}: {}'.format(job.mode, job.pdb_id, e))
+                self._count(job, False)
+                continue
+            if outcome:
+                self.finish_later(job, *outcome)
+            else:
+                self.start(job)
+
+    def next_job(self):
+        """Return the next prefetched job to start, or None.
+
+        Jobs are taken in order, as soon as they are prepared. A job that
+        doesn't fit in memory is skipped, unless it has waited MEMORY_MAX_WAIT
+        seconds: then no later jobs are taken until it fits.
+        """
+        for job in self.pending[:self.prefetch_depth]:
+            if not job.prepared.ready():
+                return None
+            if not job.prepared.successful() or job.prepared.get():
+                # Finished without rendering
+                return job
+            if self.memory.admit(job, self.running):
+                return job
+            if getattr(job, 'waiting_since', None) is None:
+                job.waiting_since = time.time()
+                _log.debug('%s %s waits for %d MB of memory', job.mode,
+                           job.pdb_id, job.memory // 1024 ** 2)
+            if time.time() - job.waiting_since >= self.max_wait:
+                return None
+        return None
+
+    def prefetch(self):
+        """Prepare the first PREFETCH pending jobs in the prepare threads."""
+        for job in self.pending[:self.prefetch_depth]:
+            if getattr(job, 'prepared', None) is None:
+                self.progress.preparing(job)
+                job.prepared = self.prepare_pool.apply_async(
+                    self.pipeline.prepare, (job,))
+
+    def start(self, job):
+        """Render this prepared job in a new process.
+
+        The job gets the number of threads its cost deserves, or THREADS if
+        configured, or less if not enough cores are free.
+        """
+        job.ypid = self.free_ypids.pop()
+        job.threads = min(threads_for(job.cost, self.n_cores, self.n_threads),
+                          self.free_cores)
+        self.free_cores = self.free_cores - job.threads
+        _log.debug('Starting %s %s (cost %s) with %s threads', job.mode,
+                   job.pdb_id, job.cost, job.threads)
+
+        job.conn, send_conn = multiprocessing.Pipe(duplex=False)
+        handlers = acquire_logging_locks()
+        try:
+            p = multiprocessing.Process(
+                target=_render,
+                args=(self.pipeline.render, job, send_conn, handlers))
+            p.start()
+        finally:
+            release_logging_locks(handlers)
+        send_conn.close()
+        self.running.append((p, job))
+        self.progress.started(job)
+        if self.journal:
+            self.journal.record('started', job)
+
+    def check_memory(self):
+        """Sample the memory use of running jobs every MEMORY_INTERVAL
+        seconds."""
+        if self.running and time.time() >= self.next_sample:
+            self.memory.sample(self.running)
+            self.next_sample = time.time() + self.memory.interval
+
+    def reap(self):
+        """Release the pids and cores of rendered jobs and finish them in the
+        finish threads.
+
+        Return the number of jobs that were reaped.
+        """
+        rendered = [(p, job) for p, job in self.running if not p.is_alive()]
+        for p, job in rendered:
+            p.join()
+            self.running.remove((p, job))
+            self.free_cores = self.free_cores + job.threads
+            self.free_ypids.append(job.ypid)
+            self.progress.rendered(job)
+
+            _log.debug('%s %s: peak memory %d MB', job.mode, job.pdb_id,
+                       getattr(job, 'peak_rss', 0) // 1024 ** 2)
+            if getattr(job, 'killed', None):
+                success, msg = False, job.killed
+            elif job.conn.poll():
+                success, msg = job.conn.recv()
+            else:
+                success, msg = False, 'Error creating YASARA scene'
+            job.conn.close()
+            self.finish_later(job, success, msg)
+        return len(rendered)
+
+    def finish_later(self, job, success, msg):
+        """Finish this job in the finish threads."""
+        with self.lock:
+            self.finishing = self.finishing + 1
+        self.finish_pool.apply_async(self._finish, (job, success, msg))
+
+    def _finish(self, job, success, msg):
+        """Finish a rendered job. This runs in a finish thread.
+
+        The job is counted once its output files are published, see
+        _published.
+        """
+        try:
+            self.pipeline.finish(job, success, msg, self._published)
+        except Exception as e:
+            _log.error('{} {}: {}'.format(job.mode, job.pdb_id, e))
+            self._published(job, False)
+
+    def _published(self, job, success):
+        """Count a finished job whose output files are published. This runs
+        in a finish thread or the publisher thread."""
+        try:
+            self._count(job, success)
+        finally:
+            with self.lock:
+                self.finishing = self.finishing - 1
+
+    def _count(self, job, success):
+        with self.lock:
+            if success:
+                self.done = self.done + 1
+            else:
+                self.failed = self.failed + 1
+        if not success:
+            _log.error('{} {}: job failed'.format(job.mode, job.pdb_id))
+        if self.journal:
+            self.journal.record('done' if success else 'failed', job)
+        self.progress.finished(job, success)
+        self.finished(job, success)
+
+    def finished(self, job, success):
+        """Called when a job has finished. Subclasses may extend this.
+
+        This is called from the finish threads.
+        """
+        pass
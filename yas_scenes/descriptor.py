@@ -0,0 +1,291 @@
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+import gzip
+import json
+import multiprocessing
+import os
+
+from yas_scenes.listcache import parse_job_list
+from yas_scenes.pack import entry_files
+from yas_scenes.parser import Residue
+from yas_scenes.structure import is_gzipped, structure_format
+from yas_scenes.utils import ensure_dir_existence, get_scene_dir
+
+
+DESCRIPTOR_VERSION = 1
+
+# Background colours of the scenes, see scenes.create_ion_scene
+BACKGROUND = ['000040', '30c0ff']
+
+# mmCIF atom_site items of an atom; the optional ones may be missing
+CIF_ATOM_ITEMS = {
+    'num': '_atom_site.auth_seq_id',
+    'icode': '_atom_site.pdbx_PDB_ins_code',
+    'chain': '_atom_site.auth_asym_id',
+    'name': '_atom_site.label_atom_id',
+    'x': '_atom_site.Cartn_x',
+    'y': '_atom_site.Cartn_y',
+    'z': '_atom_site.Cartn_z',
+}
+CIF_OPTIONAL_ITEMS = {
+    'auth_name': '_atom_site.auth_atom_id',
+    'alt': '_atom_site.label_alt_id',
+    'element': '_atom_site.type_symbol',
+    'model': '_atom_site.pdbx_PDB_model_num',
+}
+
+
+def read_pdb_atoms(f, residues):
+    """Return the atoms of residues in a PDB file.
+
+    Return a dict of Residues and lists of atoms: name, element and
+    coordinates. Only the first model and the first alternate location of an
+    atom are read, as shown in the scenes.
+    """
+    atoms = {}
+    for line in f:
+        if line.startswith('ENDMDL'):
+            break
+        if not (line.startswith('ATOM  ') or line.startswith('HETATM')):
+            continue
+        if line[16:17] not in (' ', 'A'):
+            continue
+        try:
+            residue = Residue(int(line[22:26]), line[26:27].strip(),
+                              line[21:22])
+            if residue not in residues:
+                continue
+            coords = [float(line[i:i + 8]) for i in (30, 38, 46)]
+        except ValueError:
+            continue
+        atoms.setdefault(residue, []).append(
+            [line[12:16].strip(), line[76:78].strip()] + coords)
+    return atoms
+
+
+def unquote(value):
+    """Return an mmCIF value without its quotes, e.g. "O3'" -> O3'."""
+    if len(value) > 1 and value[0] in '"\'' and value[-1] == value[0]:
+        return value[1:-1]
+    return value
+
+
+def read_cif_atoms(f, residues):
+    """Return the atoms of residues in an mmCIF file, see read_pdb_atoms.
+
+    Raise ValueError if atom_site items are missing.
+    """
+    items = []
+    columns = None
+    atoms = {}
+    model = None
+    for line in f:
+        if columns is None:
+            if line.startswith('_atom_site.'):
+                items.append(line.split()[0])
+                continue
+            elif not items:
+                continue
+            # First row of the atom_site loop
+            missing = set(CIF_ATOM_ITEMS.values()) - set(items)
+            if missing:
+                raise ValueError('Missing {}'.format(', '.join(missing)))
+            columns = dict((key, items.index(item)) for key, item
+                           in CIF_ATOM_ITEMS.items() +
+                           CIF_OPTIONAL_ITEMS.items() if item in items)
+        if line.startswith(('#', 'loop_', '_')):
+            break
+        values = line.split()
+        if len(values) != len(items):
+            continue
+        row = dict((key, unquote(values[i]))
+                   for key, i in columns.iteritems())
+        model = model or row.get('model')
+        if row.get('model') != model or \
+                row.get('alt', '.') not in ('.', '?', 'A'):
+            continue
+        try:
+            residue = Residue(int(row['num']), row['icode'].strip('?.'),
+                              row['chain'])
+            if residue not in residues:
+                continue
+            coords = [float(row[k]) for k in ('x', 'y', 'z')]
+        except ValueError:
+            continue
+        atoms.setdefault(residue, []).append(
+            [row.get('auth_name', row['name']), row.get('element', '')] +
+            coords)
+    return atoms
+
+
+def read_atoms(path, residues):
+    """Return the atoms of residues in the PDB or mmCIF file at path,
+    optionally gzipped, see read_pdb_atoms.
+
+    Raise IOError if the file cannot be read.
+    Raise ValueError if the atom_site items of an mmCIF file are missing.
+    """
+    opener = gzip.open if is_gzipped(path) else open
+    with opener(path, 'rb') as f:
+        if structure_format(path) == 'cif':
+            return read_cif_atoms(f, residues)
+        return read_pdb_atoms(f, residues)
+
+
+def residue_id(residue):
+    return [residue.num, residue.icode, residue.chain]
+
+
+def describe_residue(residue, selection, atoms):
+    """Return the descriptor of a residue: its id, YASARA selection and
+    atoms with coordinates rounded to 0.001 A."""
+    return {
+        'residue': residue_id(residue),
+        'selection': selection,
+        'atoms': [atom[:2] + [round(c, 3) for c in atom[2:]]
+                  for atom in atoms[residue]],
+    }
+
+
+def describe_ion_sites(ion_sites, atoms):
+    """Return the ion sites with atoms in the structure.
+
+    Every site has the ion (shown as balls), its ligand residues (shown as
+    sticks) and the distances of the ligand atoms to the ion. Atoms keep
+    their element colours.
+    """
+    sites = []
+    for ion in sorted(ion_sites):
+        site = ion_sites[ion]
+        ligands = sorted(set(r for r in site.ligands if r in atoms))
+        if ion not in atoms or not ligands:
+            continue
+        described = describe_residue(ion, ion.res_selection, atoms)
+        described['name'] = site.name
+        sites.append({
+            'ion': described,
+            'ligands': [describe_residue(r, r.selection, atoms)
+                        for r in ligands],
+            'distances': [[atom.name, residue_id(atom.residue), dist]
+                          for atom, dist in sorted(site.distances.items())
+                          if atom.residue in atoms],
+        })
+    return {'sites': sites}
+
+
+def contact_color(n_contacts):
+    """Return the colour of a residue with n_contacts crystal contacts, as
+    in the scenes: from yellow for none to blue for 10 or more."""
+    fraction = min(n_contacts / 10, 1)
+    yellow = int(round(255 * (1 - fraction)))
+    return '{0:02x}{0:02x}{1:02x}'.format(yellow, 255 - yellow)
+
+
+def describe_sym_contacts(sym_contacts, atoms):
+    """Return the residues with crystal contacts with atoms in the structure,
+    with their number of contacts and colour. The side chains of residues
+    with contacts are shown in the scenes, on a grey C-alpha trace."""
+    residues = []
+    for residue in sorted(r for r in sym_contacts if r in atoms):
+        described = describe_residue(residue, residue.selection, atoms)
+        described['contacts'] = sym_contacts[residue]
+        described['color'] = contact_color(sym_contacts[residue])
+        residues.append(described)
+    return {'residues': residues}
+
+
+def describe(mode, pdb_id, parsed, structure_path):
+    """Return the descriptor of the scene of an entry: what the scene shows,
+    for viewers that don't load YASARA scenes.
+
+    Only the atoms of the residues in the parsed list are read from the
+    structure. Return None if none of them are in the structure.
+
+    Raise IOError if the structure cannot be read.
+    Raise ValueError if the atom_site items of an mmCIF file are missing.
+    """
+    if mode == 'iod':
+        residues = set(parsed)
+        for site in parsed.itervalues():
+            residues.update(site.ligands)
+        atoms = read_atoms(structure_path, residues)
+        body = describe_ion_sites(parsed, atoms)
+        empty = not body['sites']
+    else:
+        atoms = read_atoms(structure_path, set(parsed))
+        body = describe_sym_contacts(parsed, atoms)
+        empty = not body['residues']
+    if empty:
+        return None
+    body.update({'version': DESCRIPTOR_VERSION, 'pdb_id': pdb_id,
+                 'mode': mode, 'background': BACKGROUND})
+    return body
+
+
+def descriptor_path(job):
+    """Return the path of the descriptor of a job, next to its scene."""
+    scene_dir = get_scene_dir(job.source, job.mode, job.pdb_id)
+    return entry_files(scene_dir, job.mode, job.pdb_id)['descriptor']
+
+
+def write_descriptor(path, descriptor):
+    """Write a descriptor as compact JSON, replacing path atomically."""
+    ensure_dir_existence(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(descriptor, f, separators=(',', ':'), sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def export(job):
+    """Write the descriptor of the scene of a job, without YASARA. An old
+    descriptor is removed if there is nothing to show.
+
+    Return True if a descriptor was written.
+    Raise IOError or ValueError if the list or structure cannot be read.
+    """
+    path = descriptor_path(job)
+    descriptor = describe(job.mode, job.pdb_id, parse_job_list(job),
+                          job.pdb_file_path)
+    if descriptor is None:
+        _log.warn('{}: nothing to show in a {} descriptor'.format(
+            job.pdb_id, job.mode))
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    write_descriptor(path, descriptor)
+    return True
+
+
+def _export(job):
+    """Export the descriptor of a job. This runs in a pool process.
+
+    Return the job's PDB ID and whether a descriptor was written.
+    """
+    try:
+        return job.pdb_id, export(job)
+    except (IOError, OSError, ValueError) as e:
+        _log.error('{}: {}'.format(job.pdb_id, e))
+        return job.pdb_id, False
+
+
+def export_all(jobs, processes=None):
+    """Export the descriptors of jobs in parallel by processes processes.
+
+    Return the number of written descriptors and the number of jobs without
+    one: failed or with nothing to show.
+    """
+    pool = multiprocessing.Pool(processes)
+    written = 0
+    try:
+        for pdb_id, success in pool.imap_unordered(_export, jobs,
+                                                   chunksize=16):
+            written = written + success
+    finally:
+        pool.close()
+        pool.join()
+    _log.info('Exported {} descriptors, {} jobs without'.format(
+        written, len(jobs) - written))
+    return written, len(jobs) - written
@@ -0,0 +1,171 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import errno
+import os
+import signal
+
+from yas_scenes.scheduler import get_batch_setting, structure_size
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def available_memory():
+    """Return the memory available for new processes in bytes.
+
+    This is MemAvailable from /proc/meminfo, or None if it cannot be read.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except IOError as e:
+        _log.error(e)
+    return None
+
+
+def process_rss(pid):
+    """Return the resident set size of this process in bytes, 0 if it's
+    gone."""
+    try:
+        with open('/proc/{}/statm'.format(pid), 'r') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return 0
+
+
+def child_pids():
+    """Return a dict with the child pids of every running process."""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name), 'r') as f:
+                stat = f.read()
+        except IOError:
+            continue
+        # The command name may contain spaces; fields follow its last ')'
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+
+def process_tree(pid, children=None):
+    """Return the pids of this process and all its descendants.
+
+    A job process starts a task process which starts YASARA, so the tree of a
+    job process contains all processes working on the job.
+    """
+    if children is None:
+        children = child_pids()
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, []))
+    return tree
+
+
+def tree_rss(pid, children=None):
+    """Return the summed resident set size of a process tree in bytes."""
+    return sum(process_rss(p) for p in process_tree(pid, children))
+
+
+def kill_tree(pid, children=None):
+    """Kill this process and all its descendants.
+
+    Return the number of killed processes.
+    """
+    killed = 0
+    for p in reversed(process_tree(pid, children)):
+        try:
+            os.kill(p, signal.SIGKILL)
+            killed = killed + 1
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+    return killed
+
+
+def estimate_memory(job):
+    """Estimate the peak memory of a job in bytes.
+
+    A job needs JOB_MEMORY_BASE bytes for Python and an idle YASARA, plus
+    JOB_MEMORY_PER_COST bytes per unit of cost (see scheduler.estimate_cost).
+    If the number of atoms of the structure is known (job.n_atoms, see
+    preflight), the structure costs JOB_MEMORY_PER_ATOM bytes per atom
+    instead: the size of a structure file is a rough measure of its atoms.
+    All are configured in the BATCH settings.
+    """
+    base = get_batch_setting('JOB_MEMORY_BASE', 300 * 1024 ** 2)
+    per_cost = get_batch_setting('JOB_MEMORY_PER_COST', 20)
+    n_atoms = getattr(job, 'n_atoms', None)
+    if n_atoms is None:
+        return int(base + per_cost * job.cost)
+    per_atom = get_batch_setting('JOB_MEMORY_PER_ATOM', 2000)
+    list_cost = max(0, job.cost - structure_size(job.pdb_file_path))
+    return int(base + per_atom * n_atoms + per_cost * list_cost)
+
+
+class MemoryMonitor(object):
+    """Watch the memory use of running jobs and admit new ones.
+
+    Every MEMORY_INTERVAL seconds the RSS of the process tree of each running
+    job (its job process, task process and YASARA) is sampled. Jobs whose RSS
+    exceeds MEMORY_CEILING bytes are killed.
+
+    A job is admitted if the memory it is estimated to need (see
+    estimate_memory) fits in the available memory, minus MEMORY_RESERVE bytes
+    and the memory running jobs are estimated to claim on top of what they
+    use now. If there is a MEMORY_BUDGET, the estimated memory of all running
+    jobs, or their RSS if it is larger, must also fit in the budget.
+
+    MEMORY_CEILING, MEMORY_RESERVE, MEMORY_BUDGET and MEMORY_INTERVAL are
+    configured in the BATCH settings; jobs are not killed if there is no
+    ceiling.
+    """
+
+    def __init__(self):
+        self.ceiling = get_batch_setting('MEMORY_CEILING')
+        self.reserve = get_batch_setting('MEMORY_RESERVE', 1024 ** 3)
+        self.budget = get_batch_setting('MEMORY_BUDGET')
+        self.interval = get_batch_setting('MEMORY_INTERVAL', 1)
+
+    def sample(self, running):
+        """Sample the RSS of running jobs, (p, job) pairs.
+
+        The current and peak RSS are stored as job.rss and job.peak_rss.
+        Jobs over the memory ceiling are killed and get a job.killed reason.
+        """
+        children = child_pids()
+        for p, job in running:
+            job.rss = tree_rss(p.pid, children)
+            job.peak_rss = max(job.rss, getattr(job, 'peak_rss', 0))
+            if self.ceiling and job.rss > self.ceiling and \
+                    not getattr(job, 'killed', None):
+                job.killed = 'Memory ceiling exceeded: {} MB > {} MB'.format(
+                    job.rss // 1024 ** 2, self.ceiling // 1024 ** 2)
+                _log.error('{} {}: {}'.format(job.mode, job.pdb_id,
+                                              job.killed))
+                kill_tree(p.pid, children)
+
+    def admit(self, job, running):
+        """Return True if there is enough memory to start this job.
+
+        A job is always admitted if no other job runs.
+        """
+        job.memory = estimate_memory(job)
+        if not running:
+            return True
+        if self.budget:
+            used = sum(max(j.memory, getattr(j, 'rss', 0))
+                       for p, j in running)
+            if used + job.memory > self.budget:
+                return False
+        available = available_memory()
+        if available is None:
+            return True
+        claimed = sum(max(0, j.memory - getattr(j, 'rss', 0))
+                      for p, j in running)
+        return available - claimed - self.reserve >= job.memory
@@ -0,0 +1,362 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+
+from yas_scenes.parser import (Atom, Residue, build_ion_sites,
+                               build_sym_contacts, parse_iod_line,
+                               parse_ion_sites, parse_ss2_line,
+                               parse_sym_contacts, read_list)
+from yas_scenes.settings import settings
+
+
+# Columns of the index per list type: name and struct format of one value.
+# Insertion codes are stored as ' ' if there is none.
+COLUMNS = {
+    'iod': [('ion_num', 'i'), ('ion_icode', 'c'), ('ion_chain', 'c'),
+            ('ion_name', '4s'), ('res_num', 'i'), ('res_icode', 'c'),
+            ('res_chain', 'c'), ('atom', '4s'), ('dist', 'f')],
+    'ss2': [('res_num', 'i'), ('res_icode', 'c'), ('res_chain', 'c'),
+            ('num_contacts', 'i')],
+}
+PARSE_LINE = {'iod': parse_iod_line, 'ss2': parse_ss2_line}
+
+
+def to_row(mode, parsed):
+    """Return the index row of a parsed list line."""
+    if mode == 'iod':
+        ion, ion_name, residue, atom, dist = parsed
+        return (ion.num, ion.icode or ' ', ion.chain, ion_name,
+                residue.num, residue.icode or ' ', residue.chain, atom.name,
+                dist)
+    residue, num_contacts = parsed
+    return (residue.num, residue.icode or ' ', residue.chain, num_contacts)
+
+
+def from_row(mode, row):
+    """Return the parsed list line of an index row."""
+    if mode == 'iod':
+        (ion_num, ion_icode, ion_chain, ion_name, res_num, res_icode,
+         res_chain, atom, dist) = row
+        residue = Residue(res_num, res_icode.strip(), intern(res_chain))
+        return (Residue(ion_num, ion_icode.strip(), intern(ion_chain)),
+                intern(ion_name.rstrip('\0')), residue,
+                Atom(intern(atom.rstrip('\0')), residue), round(dist, 3))
+    res_num, res_icode, res_chain, num_contacts = row
+    return (Residue(res_num, res_icode.strip(), intern(res_chain)),
+            num_contacts)
+
+
+def list_stamp(path):
+    """Return the absolute path, size and mtime of a list file."""
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime
+
+
+def find_list_files(list_dir, mode):
+    """Yield the PDB ID and path of all <pdb_id>.<mode>.bz2 files in list_dir
+    and its sub dirs."""
+    suffix = '.{}.bz2'.format(mode)
+    for dir_path, dir_names, file_names in os.walk(list_dir):
+        for file_name in file_names:
+            if file_name.endswith(suffix):
+                yield file_name[:4].lower(), os.path.join(dir_path, file_name)
+
+
+def _parse_rows(mode_path):
+    """Parse a list file into index rows. This runs in a pool process.
+
+    Return the mode, path and rows, rows is None if the file is invalid.
+    """
+    mode, path = mode_path
+    try:
+        rows = [to_row(mode, parsed)
+                for parsed in read_list(path, PARSE_LINE[mode])]
+    except (IOError, ValueError):
+        rows = None
+    return mode, path, rows
+
+
+class ListIndex(object):
+    """Columnar index of the parsed lines of all WHAT IF iod and ss2 lists.
+
+    The index dir contains one binary file per column per list type
+    (<mode>.<column>, see COLUMNS) and index.json: an offset table with the
+    first row and the number of rows of each PDB ID, together with the path,
+    size and mtime of the list file they were parsed from.
+
+    Column files are memory-mapped, so loading an entry reads one slice per
+    column. Updates append the rows of new and changed list files; the rows
+    they replace are left behind until the index is compacted. Compacted
+    column files get the next generation number in their name
+    (<mode>.<column>.<generation>), so the offsets of an offset table always
+    refer to the column files of its own generation. Readers load the offset
+    table again when index.json is replaced, see refresh.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.table_path = os.path.join(path, 'index.json')
+        self._maps = {}
+        self._stale = []
+        self._stamp = None
+        self.refresh()
+
+    def _table_stamp(self):
+        try:
+            st = os.stat(self.table_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def refresh(self):
+        """Load the offset table if index.json was replaced since it was
+        loaded, and forget the column files mapped for the old one."""
+        stamp = self._table_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+        self.close()
+        self._stamp = stamp
+        try:
+            with open(self.table_path, 'r') as f:
+                self.table = json.load(f)
+        except (IOError, ValueError):
+            self.table = {}
+        for mode in COLUMNS:
+            self.table.setdefault(mode, {'rows': 0, 'entries': {}})
+
+    def _column_path(self, mode, column, generation=None):
+        if generation is None:
+            generation = self.table[mode].get('generation', 0)
+        name = '{}.{}'.format(mode, column)
+        if generation:
+            name = '{}.{}'.format(name, generation)
+        return os.path.join(self.path, name)
+
+    def close(self):
+        """Close the memory maps of the column files."""
+        for m in self._maps.itervalues():
+            if m is not None:
+                m.close()
+        self._maps = {}
+
+    def _map(self, mode, column):
+        key = (mode, column)
+        if key not in self._maps:
+            path = self._column_path(mode, column)
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self._maps[key] = mmap.mmap(f.fileno(), 0,
+                                            access=mmap.ACCESS_READ) \
+                    if size else None
+        return self._maps[key]
+
+    def lookup(self, mode, path):
+        """Return the offset table entry of this list file if it is current.
+
+        Return None if the file is not indexed or changed since indexing.
+        """
+        try:
+            stamp = list(list_stamp(path))
+        except (OSError, TypeError):
+            return None
+        pdb_id = os.path.basename(path)[:4].lower()
+        entry = self.table[mode]['entries'].get(pdb_id)
+        if entry and [entry['path'], entry['size'], entry['mtime']] == stamp:
+            return entry
+        return None
+
+    def rows(self, mode, entry):
+        """Return the rows of an offset table entry."""
+        offset, count = entry['offset'], entry['count']
+        columns = []
+        for column, code in COLUMNS[mode]:
+            size = struct.calcsize(code)
+            columns.append(struct.unpack_from(
+                '<{}'.format(code * count), self._map(mode, column),
+                offset * size))
+        return zip(*columns)
+
+    def load(self, mode, path):
+        """Return the parsed lines of this list file, or None if the index
+        does not have them."""
+        self.refresh()
+        entry = self.lookup(mode, path)
+        if entry is None:
+            return None
+        if entry['count'] == 0:
+            return []
+        try:
+            rows = self.rows(mode, entry)
+        except (IOError, struct.error) as e:
+            # The index was compacted while its table was being loaded
+            _log.warn('Could not load {} from the index: {}'.format(path, e))
+            return None
+        return [from_row(mode, row) for row in rows]
+
+    def update(self, list_dirs, processes=None):
+        """Index new and changed list files and forget removed ones.
+
+        list_dirs is a dict with the databank dir of each list type, e.g.
+            {"iod": "/data/wi-lists/iod", "ss2": "/data/wi-lists/ss2"}
+        List files are parsed in parallel by processes processes.
+
+        Return the number of (re)indexed list files.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.close()
+
+        todo = []
+        for mode, list_dir in list_dirs.iteritems():
+            entries = self.table[mode]['entries']
+            found = set()
+            for pdb_id, path in find_list_files(list_dir, mode):
+                found.add(pdb_id)
+                entry = entries.get(pdb_id)
+                if not entry or [entry['path'], entry['size'],
+                                 entry['mtime']] != list(list_stamp(path)):
+                    todo.append((mode, path))
+            for pdb_id in set(entries) - found:
+                del entries[pdb_id]
+        _log.info('Indexing {} new or changed list files'.format(len(todo)))
+
+        pool = multiprocessing.Pool(processes)
+        files = {}
+        try:
+            files = dict((mode, self._open_columns(mode))
+                         for mode in COLUMNS)
+            for mode, path, rows in pool.imap_unordered(_parse_rows, todo,
+                                                        chunksize=16):
+                if rows is None:
+                    _log.error('Not indexed: {} is invalid'.format(path))
+                    continue
+                self._append(mode, path, rows, files[mode])
+        finally:
+            pool.close()
+            pool.join()
+            for mode_files in files.itervalues():
+                for f in mode_files.itervalues():
+                    f.close()
+
+        for mode in COLUMNS:
+            live = sum(e['count']
+                       for e in self.table[mode]['entries'].itervalues())
+            if self.table[mode]['rows'] > 2 * live:
+                self.compact(mode)
+        self.save()
+        return len(todo)
+
+    def _open_columns(self, mode):
+        """Open the column files of this list type for appending.
+
+        Rows the offset table doesn't refer to, left behind by an interrupted
+        update, are cut off first, so appended rows are at their offsets.
+        """
+        files = {}
+        for column, code in COLUMNS[mode]:
+            f = open(self._column_path(mode, column), 'ab')
+            f.truncate(self.table[mode]['rows'] * struct.calcsize(code))
+            files[column] = f
+        return files
+
+    def _append(self, mode, path, rows, files):
+        """Append rows of a list file to the open column files."""
+        count = len(rows)
+        for i, (column, code) in enumerate(COLUMNS[mode]):
+            files[column].write(struct.pack('<{}'.format(code * count),
+                                            *[row[i] for row in rows]))
+        table = self.table[mode]
+        abs_path, size, mtime = list_stamp(path)
+        table['entries'][os.path.basename(path)[:4].lower()] = {
+            'path': abs_path, 'size': size, 'mtime': mtime,
+            'offset': table['rows'], 'count': count}
+        table['rows'] = table['rows'] + count
+
+    def compact(self, mode):
+        """Write the column files of this list type without stale rows, as
+        the next generation.
+
+        The old column files are removed by save, once the offset table
+        refers to the new ones.
+        """
+        _log.info('Compacting {} index'.format(mode))
+        entries = sorted(self.table[mode]['entries'].itervalues(),
+                         key=lambda e: e['offset'])
+        generation = self.table[mode].get('generation', 0) + 1
+        for column, code in COLUMNS[mode]:
+            size = struct.calcsize(code)
+            path = self._column_path(mode, column)
+            new_path = self._column_path(mode, column, generation)
+            with open(path, 'rb') as src, \
+                    open(new_path + '.tmp', 'wb') as dst:
+                for entry in entries:
+                    src.seek(entry['offset'] * size)
+                    dst.write(src.read(entry['count'] * size))
+            os.rename(new_path + '.tmp', new_path)
+            self._stale.append(path)
+        offset = 0
+        for entry in entries:
+            entry['offset'] = offset
+            offset = offset + entry['count']
+        self.table[mode]['rows'] = offset
+        self.table[mode]['generation'] = generation
+
+    def save(self):
+        """Write the offset table. Rows it doesn't refer to are ignored, and
+        column files of older generations are removed."""
+        with open(self.table_path + '.tmp', 'w') as f:
+            json.dump(self.table, f, separators=(',', ':'))
+        os.rename(self.table_path + '.tmp', self.table_path)
+        self._stamp = self._table_stamp()
+        for path in self._stale:
+            try:
+                os.remove(path)
+            except OSError as e:
+                _log.error('Could not remove {}: {}'.format(path, e))
+        self._stale = []
+
+
+_index = None
+
+
+def get_index():
+    """Return the ListIndex in LIST_INDEX, or None if it's not configured.
+
+    LIST_INDEX is configured in scenes_settings.
+    """
+    global _index
+    if _index is None and settings.get('LIST_INDEX') and \
+            os.path.exists(os.path.join(settings['LIST_INDEX'],
+                                        'index.json')):
+        _index = ListIndex(settings['LIST_INDEX'])
+    return _index
+
+
+def load_ion_sites(iod):
+    """Return the ion sites of this iod file, from the index if possible.
+
+    See parser.parse_ion_sites.
+    """
+    index = get_index()
+    lines = index.load('iod', iod) if index else None
+    if lines is None:
+        return parse_ion_sites(iod)
+    return build_ion_sites(lines)
+
+
+def load_sym_contacts(ss2):
+    """Return the crystal contacts of this ss2 file, from the index if
+    possible.
+
+    See parser.parse_sym_contacts.
+    """
+    index = get_index()
+    lines = index.load('ss2', ss2) if index else None
+    if lines is None:
+        return parse_sym_contacts(ss2)
+    return build_sym_contacts(lines)
@@ -0,0 +1,119 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+import Queue
+import threading
+from contextlib import contextmanager
+
+
+DEBUG_FORMATTER = logging.Formatter("%(asctime)s | %(levelname)-7s | "
+                                    "%(message)s [in %(pathname)s:%(lineno)d]")
+
+
+class LogWriter(object):
+    """Background thread that writes log records to their handlers.
+
+    Records are formatted and written by the writer thread, so the thread
+    that logs only puts them in a queue.
+    """
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, handler, record):
+        """Write this record to handler in the writer thread."""
+        self.queue.put((handler, record, None))
+
+    def close(self, handler):
+        """Close handler once its queued records are written.
+
+        Wait until it is closed.
+        """
+        closed = threading.Event()
+        self.queue.put((handler, None, closed))
+        closed.wait()
+
+    def _write(self):
+        while True:
+            handler, record, closed = self.queue.get()
+            if record is not None:
+                handler.handle(record)
+            else:
+                handler.close()
+                closed.set()
+
+
+_writer = None
+_writer_pid = None
+
+
+def get_writer():
+    """Return the LogWriter of this process.
+
+    Threads don't survive a fork, so a forked job process starts its own.
+    """
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = LogWriter()
+        _writer_pid = os.getpid()
+    return _writer
+
+
+class QueueHandler(logging.Handler):
+    """Pass the log records of one thread to a LogWriter.
+
+    Records of other threads, e.g. of other jobs handled by the batch runner,
+    are ignored. Messages are formatted by the writer thread.
+
+    Processes forked while logging, e.g. the task process of a job, write
+    their records directly to a log file handler of their own: the writer
+    thread is not forked with them.
+    """
+
+    def __init__(self, writer, target):
+        logging.Handler.__init__(self)
+        self.writer = writer
+        self.target = target
+        self.thread_id = threading.current_thread().ident
+        self.pid = os.getpid()
+        self.fork_target = None
+
+    def emit(self, record):
+        if record.thread != self.thread_id:
+            return
+        if os.getpid() == self.pid:
+            self.writer.put(self.target, record)
+            return
+        if self.fork_target is None or self.fork_target.pid != os.getpid():
+            self.fork_target = logging.FileHandler(self.target.baseFilename,
+                                                   'a')
+            self.fork_target.setFormatter(self.target.formatter)
+            self.fork_target.pid = os.getpid()
+        self.fork_target.handle(record)
+
+
+@contextmanager
+def job_log(log_path, mode='a', verbose=False):
+    """Log the messages of this thread to log_path while in the block.
+
+    The log file is closed, and its handler removed from the root logger,
+    when the block is left, so log files don't collect messages of later jobs.
+    With mode 'w' the log file is truncated first. If verbose, messages are
+    logged with their source location.
+    """
+    target = logging.FileHandler(log_path, mode)
+    if verbose:
+        target.setFormatter(DEBUG_FORMATTER)
+    writer = get_writer()
+    handler = QueueHandler(writer, target)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        yield
+    finally:
+        root.removeHandler(handler)
+        writer.close(target)
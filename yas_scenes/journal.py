@@ -0,0 +1,123 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+import threading
+import time
+
+from yas_scenes.scheduler import get_batch_setting
+from yas_scenes.utils import delete_scene
+
+
+# States of a job in the journal
+STATES = ('started', 'done', 'failed')
+
+
+def job_key(job):
+    """Return the key of a job in the journal: its job file line."""
+    return ' '.join(job.job_args)
+
+
+class Journal(object):
+    """Append-only journal of the jobs of a batch run.
+
+    Every line has a state, a job and the path to its scene, separated by
+    tabs, e.g.
+        started<TAB>pdb1crn.ent.gz 1crn PDB ion 1crn.iod.bz2<TAB>scenes/...
+    The last line of a job counts. Lines are flushed as they are written, but
+    only synced to disk every JOURNAL_SYNC_INTERVAL seconds: a crash loses
+    the last few lines at most, and those jobs are simply run again.
+    """
+
+    def __init__(self, path, sync_interval=None):
+        self.path = path
+        self.sync_interval = sync_interval
+        if self.sync_interval is None:
+            self.sync_interval = get_batch_setting('JOURNAL_SYNC_INTERVAL', 5)
+        self.lock = threading.Lock()
+        self.f = None
+        self.unsynced = False
+        self.last_sync = 0
+
+    def read(self):
+        """Return the last state and scene path of every job in the journal.
+
+        Incomplete and invalid lines, e.g. written during a crash, are
+        skipped.
+        """
+        records = {}
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.read().split('\n')[:-1]
+        except IOError:
+            return records
+        for line in lines:
+            fields = line.split('\t')
+            if len(fields) != 3 or fields[0] not in STATES:
+                continue
+            records[fields[1]] = (fields[0], fields[2])
+        return records
+
+    def open(self, resume=False):
+        """Open the journal for writing: start it afresh, or append to it if
+        the run is resumed."""
+        self.f = open(self.path, 'a' if resume else 'w')
+        if resume and self.f.tell() > 0:
+            # Finish a line left incomplete by a crash
+            self.f.write('\n')
+        self.last_sync = time.time()
+
+    def record(self, state, job):
+        """Append the state of a job to the journal."""
+        if self.f is None:
+            return
+        with self.lock:
+            self.f.write('{}\t{}\t{}\n'.format(
+                state, job_key(job), getattr(job, 'scene_path', '')))
+            self.f.flush()
+            self.unsynced = True
+
+    def sync(self, force=False):
+        """Sync the journal to disk if JOURNAL_SYNC_INTERVAL seconds have
+        passed since the last sync, or if force."""
+        if self.f is None or not self.unsynced:
+            return
+        if not force and time.time() < self.last_sync + self.sync_interval:
+            return
+        with self.lock:
+            os.fsync(self.f.fileno())
+            self.unsynced = False
+            self.last_sync = time.time()
+
+    def close(self):
+        """Sync and close the journal."""
+        if self.f is None:
+            return
+        self.sync(force=True)
+        self.f.close()
+        self.f = None
+
+
+def resume(jobs, journal):
+    """Return the jobs that have not finished according to the journal.
+
+    Jobs that were in flight when the run stopped may have left a partially
+    written scene; those scenes are deleted.
+    """
+    records = journal.read()
+    remaining = []
+    for job in jobs:
+        state, scene_path = records.get(job_key(job), (None, None))
+        if state in ('done', 'failed'):
+            continue
+        if state == 'started' and scene_path:
+            _log.info('Deleting scene {} of interrupted job'.format(
+                scene_path))
+            try:
+                delete_scene(scene_path)
+            except OSError:
+                pass
+        remaining.append(job)
+    _log.info('Resuming: {} of {} jobs left'.format(len(remaining),
+                                                    len(jobs)))
+    return remaining
@@ -0,0 +1,296 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import errno
+import os
+import socket
+import threading
+import time
+
+from yas_scenes.batch import POLL_INTERVAL, BatchRunner
+from yas_scenes.listcache import get_cache
+from yas_scenes.scheduler import estimate_cost, get_batch_setting, order_jobs
+from yas_scenes.utils import ensure_dir_existence
+
+
+def owner_id():
+    """Return an identifier of this worker process: <hostname>:<pid>."""
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkDir(object):
+    """A work dir with jobs, shared by workers on several nodes.
+
+    The work dir only needs a shared filesystem (e.g. NFS) and contains:
+        jobs/<name>    unfinished jobs: the arguments of a single run
+                       without YASARA pid. Names start with the rank of the
+                       job, so the most expensive jobs are claimed first.
+        leases/<name>  lease files of running jobs, created exclusively by the
+                       worker running the job and touched as heartbeat.
+        done/<name>    jobs that created a scene
+        failed/<name>  jobs that failed
+        clock/         files touched to read the time of the file server
+
+    A lease expires when it has not been touched for LEASE_TTL seconds, e.g.
+    because the node running the job died. Expired leases are reclaimed by
+    the next worker that wants to run the job.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for sub_dir in ('jobs', 'leases', 'done', 'failed', 'clock'):
+            ensure_dir_existence(os.path.join(path, sub_dir))
+        self.owner = owner_id()
+        self.ttl = get_batch_setting('LEASE_TTL', 300)
+        self.next_reclaim = 0
+
+    def _path(self, sub_dir, name):
+        return os.path.join(self.path, sub_dir, name)
+
+    def next_rank(self):
+        """Return the rank after those of all unfinished jobs, so new jobs
+        are claimed after them."""
+        ranks = [0]
+        for name in os.listdir(os.path.join(self.path, 'jobs')):
+            try:
+                ranks.append(int(name.lstrip('.').split('_')[0]) + 1)
+            except ValueError:
+                continue
+        return max(ranks)
+
+    def submit(self, jobs):
+        """Add jobs, most expensive first, after the unfinished jobs. Jobs
+        need a job_args attribute."""
+        for rank, job in enumerate(order_jobs(jobs), self.next_rank()):
+            name = '{:08d}_{}_{}_{}'.format(rank, job.mode, job.source,
+                                            job.pdb_id)
+            tmp_path = self._path('jobs', '.' + name)
+            with open(tmp_path, 'w') as f:
+                f.write(' '.join(job.job_args) + '\n')
+            os.rename(tmp_path, self._path('jobs', name))
+        _log.info('Submitted {} jobs to {}'.format(len(jobs), self.path))
+
+    def pending(self):
+        """Return the names of all unfinished jobs, in order."""
+        return sorted(n for n in os.listdir(os.path.join(self.path, 'jobs'))
+                      if not n.startswith('.'))
+
+    def now(self):
+        """Return the current time of the file server.
+
+        Lease files are touched by workers on different nodes, so their
+        modification times are compared with the file server's clock, not
+        with the clock of this node.
+        """
+        clock_path = self._path('clock', self.owner)
+        with open(clock_path, 'a'):
+            os.utime(clock_path, None)
+        return os.stat(clock_path).st_mtime
+
+    def leased(self):
+        """Return the names of all jobs with a lease."""
+        return set(n for n in os.listdir(os.path.join(self.path, 'leases'))
+                   if '.expired.' not in n)
+
+    def claim(self):
+        """Claim the first unfinished job that is not leased by a worker.
+
+        A claim lists the jobs and leases once, to spare the shared
+        filesystem. Leased jobs are skipped, except that every ttl / 2
+        seconds their leases are checked for expiry, with one reading of the
+        file server's clock.
+
+        Return the name and arguments of the job, or None if there is none.
+        """
+        pending = self.pending()
+        leased = self.leased()
+        check_leases = time.time() >= self.next_reclaim
+        if check_leases:
+            self.next_reclaim = time.time() + self.ttl / 2
+        now = None
+        for name in pending:
+            if name in leased:
+                if not check_leases:
+                    continue
+                if now is None:
+                    now = self.now()
+                if not self.reclaim(name, now):
+                    continue
+            job = self._claim(name)
+            if job:
+                return job
+        return None
+
+    def _claim(self, name):
+        """Return the name and arguments of this job if its lease could be
+        acquired, else None."""
+        if not self.acquire(name):
+            return None
+        try:
+            with open(self._path('jobs', name), 'r') as f:
+                return name, f.read().split()
+        except IOError:
+            # Finished by another worker in the meantime
+            self.release(name)
+        return None
+
+    def acquire(self, name):
+        """Create the lease of this job.
+
+        Return True if this worker holds the lease.
+        """
+        lease_path = self._path('leases', name)
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        os.write(fd, self.owner + '\n')
+        os.close(fd)
+        return True
+
+    def reclaim(self, name, now=None):
+        """Remove the lease of this job if it has expired at time now of the
+        file server (default: read its clock).
+
+        Return True if the lease was removed by this worker.
+        """
+        lease_path = self._path('leases', name)
+        try:
+            age = (now or self.now()) - os.stat(lease_path).st_mtime
+        except OSError:
+            # Released in the meantime
+            return True
+        if age < self.ttl:
+            return False
+
+        # Only one worker can rename the expired lease
+        expired_path = '{}.expired.{}'.format(lease_path, self.owner)
+        try:
+            os.rename(lease_path, expired_path)
+        except OSError:
+            return False
+        os.remove(expired_path)
+        _log.warn('Reclaimed expired lease of {} ({} s old)'.format(name,
+                                                                   int(age)))
+        return True
+
+    def heartbeat(self, name):
+        """Touch the lease of this job so it does not expire."""
+        try:
+            os.utime(self._path('leases', name), None)
+        except OSError as e:
+            _log.error('Lost lease of {}: {}'.format(name, e))
+
+    def release(self, name):
+        """Remove the lease of this job."""
+        try:
+            os.remove(self._path('leases', name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def complete(self, name, success):
+        """Move this job to done or failed and release its lease."""
+        try:
+            os.rename(self._path('jobs', name),
+                      self._path('done' if success else 'failed', name))
+        except OSError as e:
+            _log.error('Could not complete {}: {}'.format(name, e))
+        self.release(name)
+
+
+class LeaseRunner(BatchRunner):
+    """Run the jobs of a WorkDir shared with workers on other nodes.
+
+    A job is only claimed when a core is free or it can be prepared ahead
+    (see PREFETCH), so jobs spread over all nodes that run a worker. While
+    jobs are pending or running, a heartbeat thread touches their leases
+    every HEARTBEAT_INTERVAL seconds. The runner stops when all jobs in the
+    work dir have finished, unless it follows the work dir: then it keeps
+    waiting for new jobs, e.g. submitted by a watch.Watcher.
+    """
+
+    def __init__(self, work_dir, parse_job, pipeline, n_cores=None,
+                 first_ypid=None, follow=False, status_path=None):
+        super(LeaseRunner, self).__init__(pipeline, n_cores, first_ypid,
+                                          status_path=status_path)
+        self.work_dir = WorkDir(work_dir)
+        self.parse_job = parse_job
+        self.heartbeat_interval = get_batch_setting('HEARTBEAT_INTERVAL', 60)
+        self.claim_interval = get_batch_setting('CLAIM_INTERVAL', 10)
+        self.next_claim = 0
+        self.follow = follow
+        self._stop = threading.Event()
+
+    def run(self):
+        """Run jobs from the work dir until all of them have finished.
+
+        Return the number of created scenes and the number of failed jobs.
+        """
+        _log.info('Worker {} running jobs from {} on {} cores'.format(
+            self.work_dir.owner, self.work_dir.path, self.n_cores))
+        heartbeat = threading.Thread(target=self._heartbeat)
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            while self.follow or self.pending or self.running or \
+                    self.finishing or self.work_dir.pending():
+                self.step()
+                self.publish_last()
+        finally:
+            self._stop.set()
+            self.close()
+            self.pipeline.publish()
+            self.progress.report(force=True)
+
+        _log.info('Worker finished: {} scenes created, {} failed'.format(
+            self.done, self.failed))
+        _log.info('Parsed list cache: {}'.format(get_cache().stats()))
+        return self.done, self.failed
+
+    def step(self):
+        """Claim jobs, start them and reap rendered jobs.
+
+        If no job could be claimed, wait CLAIM_INTERVAL seconds before trying
+        again, to spare the shared filesystem.
+        """
+        while len(self.pending) < max(self.free_cores, self.prefetch_depth) \
+                and time.time() >= self.next_claim:
+            job = self.claim()
+            if not job:
+                self.next_claim = time.time() + self.claim_interval
+                break
+            self.pending.append(job)
+            self.progress.add([job])
+        self.start_prepared()
+        self.check_memory()
+        self.progress.report()
+        if not self.reap():
+            busy = self.pending or self.running or self.finishing
+            time.sleep(POLL_INTERVAL if busy else self.claim_interval)
+
+    def claim(self):
+        """Return the next claimed job, or None."""
+        while True:
+            claimed = self.work_dir.claim()
+            if not claimed:
+                return None
+            name, job_args = claimed
+            job = self.parse_job(job_args)
+            if job:
+                job.lease = name
+                job.cost = estimate_cost(job)
+                return job
+            self.work_dir.complete(name, False)
+
+    def finished(self, job, success):
+        """Mark the job as done or failed in the work dir."""
+        self.work_dir.complete(job.lease, success)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            jobs = list(self.pending) + [job for p, job in list(self.running)]
+            for job in jobs:
+                self.work_dir.heartbeat(job.lease)
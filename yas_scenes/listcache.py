@@ -0,0 +1,134 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from yas_scenes.index import load_ion_sites, load_sym_contacts
+from yas_scenes.settings import settings
+
+
+def estimate_size(obj):
+    """Estimate the memory used by parsed list data in bytes.
+
+    Containers and records are followed; strings are assumed to be interned
+    and shared, so they are not counted.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size = size + estimate_size(k) + estimate_size(v)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            size = size + estimate_size(v)
+    elif isinstance(obj, str):
+        size = 0
+    return size
+
+
+class ParsedListCache(object):
+    """LRU cache of parsed list files, bounded by memory.
+
+    Entries are keyed by parse function and file path and are only used while
+    the size and modification time of the file are unchanged. The least
+    recently used entries are evicted when the estimated memory used by all
+    entries exceeds max_bytes.
+
+    The cache may be used by several threads; files are parsed outside the
+    lock.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, parse, path):
+        """Return parse(path), from the cache if the file is unchanged.
+
+        Raise IOError and ValueError as parse does.
+        """
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            # Let parse raise the appropriate error
+            return parse(path)
+        stamp = (st.st_size, st.st_mtime)
+        key = (parse.__name__, os.path.abspath(path))
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.num_bytes = self.num_bytes - entry[1]
+                if entry[0] == stamp:
+                    self.hits = self.hits + 1
+                    self._add(key, entry)
+                    return entry[2]
+                _log.debug('%s changed, parsing it again', path)
+            self.misses = self.misses + 1
+
+        parsed = parse(path)
+        entry = (stamp, estimate_size(parsed), parsed)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.num_bytes = self.num_bytes - old[1]
+            self._add(key, entry)
+        return parsed
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        self.num_bytes = self.num_bytes + entry[1]
+        while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.num_bytes = self.num_bytes - evicted[1]
+            self.evictions = self.evictions + 1
+
+    def clear(self):
+        """Drop all entries."""
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        """Return a dict with hit, miss and eviction counts and memory use."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.num_bytes}
+
+
+_cache = ParsedListCache(settings.get('LIST_CACHE_BYTES', 256 * 1024 ** 2))
+
+
+def get_cache():
+    """Return the parsed list cache of this process."""
+    return _cache
+
+
+def cached_parse_ion_sites(iod):
+    """parse_ion_sites, memoized in the parsed list cache.
+
+    The list is loaded from the list index if it has it, see index.
+    """
+    return _cache.get(load_ion_sites, iod)
+
+
+def cached_parse_sym_contacts(ss2):
+    """parse_sym_contacts, memoized in the parsed list cache.
+
+    The list is loaded from the list index if it has it, see index.
+    """
+    return _cache.get(load_sym_contacts, ss2)
+
+
+def parse_job_list(job):
+    """Parse the list file of this job, memoized in the parsed list cache."""
+    if job.mode == 'iod':
+        return cached_parse_ion_sites(job.iod)
+    return cached_parse_sym_contacts(job.ss2)
@@ -0,0 +1,300 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+import struct
+
+from yas_scenes.settings import settings
+from yas_scenes.utils import PDB_ID_PAT, ensure_dir_existence, get_scene_dir
+
+
+# Index header: magic and generation of the archive the index refers to
+HEADER = struct.Struct('<4sI')
+MAGIC = 'SIDX'
+# Index record: PDB ID, mode, kind code, offset and length in the archive,
+# mtime of the packed file, and whether the file was removed.
+RECORD = struct.Struct('<4s3scQId?')
+
+# Kinds of files of an entry: code and file name template
+KINDS = {
+    'scene': ('s', '{pdb_id}_{name}.sce'),
+    'log': ('l', 'scenes_{pdb_id}_{name}.log'),
+    'yasara_log': ('y', '{pdb_id}_{name}.log'),
+    'whynot': ('w', '{pdb_id}_{name}.whynot'),
+    'descriptor': ('d', '{pdb_id}_{name}.json'),
+}
+KIND_OF_CODE = dict((code, kind) for kind, (code, template)
+                    in KINDS.iteritems())
+
+MODES = ('iod', 'ss2')
+
+
+def shard_of(pdb_id):
+    """Return the shard of a PDB ID: its middle two characters, as in the
+    PDB archive."""
+    return pdb_id[1:3]
+
+
+def entry_files(scene_dir, mode, pdb_id):
+    """Return the path of each kind of file of an entry in its scene dir."""
+    name = settings['SCENES_NAME'][mode][0]
+    return dict((kind, os.path.join(scene_dir, template.format(
+        pdb_id=pdb_id, name=name)))
+        for kind, (code, template) in KINDS.iteritems())
+
+
+class Shard(object):
+    """Archive of the files of the entries of one shard, with an index.
+
+    <shard>.<generation>.pack has the contents of the files, one after the
+    other. <shard>.idx has a HEADER with the generation of the archive and a
+    RECORD per packed or removed file. Both are only appended to: a changed
+    file is packed again and the last record of a file counts. The archive
+    is written and synced before the index, so a crash leaves no records of
+    unwritten data; an incomplete last record is ignored.
+
+    Compaction writes the archive of the next generation, so readers of the
+    old index keep reading the old archive until they read the new index.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.idx_path = base_path + '.idx'
+        self.generation = 0
+        self.entries = {}
+        self.records = 0
+        self.loaded_stamp = None
+        self.load()
+
+    @property
+    def pack_path(self):
+        return self._pack_path(self.generation)
+
+    def _pack_path(self, generation):
+        return '{}.{}.pack'.format(self.base_path, generation)
+
+    def idx_stamp(self):
+        try:
+            st = os.stat(self.idx_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def load(self):
+        """Read the index."""
+        self.entries = {}
+        self.loaded_stamp = self.idx_stamp()
+        try:
+            with open(self.idx_path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            data = ''
+        self.generation = 0
+        if len(data) >= HEADER.size:
+            magic, self.generation = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise IOError('Not a shard index: {}'.format(self.idx_path))
+        self.records = max(0, len(data) - HEADER.size) // RECORD.size
+        for i in xrange(self.records):
+            pdb_id, mode, code, offset, length, mtime, removed = \
+                RECORD.unpack_from(data, HEADER.size + i * RECORD.size)
+            key = (pdb_id, mode, KIND_OF_CODE.get(code))
+            if removed:
+                self.entries.pop(key, None)
+            else:
+                self.entries[key] = (offset, length, mtime)
+
+    def get(self, pdb_id, mode, kind='scene'):
+        """Return the contents of a packed file, or None if there is none.
+
+        The index is read again if another process updated it, or compacted
+        the archive.
+        """
+        if self.idx_stamp() != self.loaded_stamp:
+            self.load()
+        for attempt in (1, 2):
+            entry = self.entries.get((pdb_id, mode, kind))
+            if entry is None:
+                return None
+            offset, length, mtime = entry
+            try:
+                with open(self.pack_path, 'rb') as f:
+                    f.seek(offset)
+                    return f.read(length)
+            except IOError:
+                if attempt == 2:
+                    raise
+                # Compacted since the index was read
+                self.load()
+
+    def append(self, changes):
+        """Pack the files of changes, (pdb_id, mode, kind, path, mtime)
+        tuples. Files with path None are removed.
+
+        Raise IOError or OSError if a file cannot be read or packed.
+        """
+        records = []
+        with open(self.pack_path, 'ab') as pack:
+            pack.seek(0, os.SEEK_END)
+            offset = pack.tell()
+            for pdb_id, mode, kind, path, mtime in changes:
+                length = 0
+                if path:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    pack.write(data)
+                    length = len(data)
+                records.append((pdb_id, mode, kind, offset, length, mtime,
+                                not path))
+                offset = offset + length
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        fd = os.open(self.idx_path, os.O_RDWR | os.O_CREAT, 0o666)
+        with os.fdopen(fd, 'r+b') as idx:
+            # Drop an incomplete record left by a crash
+            idx.truncate(HEADER.size + self.records * RECORD.size)
+            idx.seek(0)
+            idx.write(HEADER.pack(MAGIC, self.generation))
+            idx.seek(0, os.SEEK_END)
+            for pdb_id, mode, kind, offset, length, mtime, removed \
+                    in records:
+                idx.write(RECORD.pack(pdb_id, mode, KINDS[kind][0], offset,
+                                      length, mtime, removed))
+                key = (pdb_id, mode, kind)
+                if removed:
+                    self.entries.pop(key, None)
+                else:
+                    self.entries[key] = (offset, length, mtime)
+            idx.flush()
+            os.fsync(idx.fileno())
+        self.records = self.records + len(records)
+        self.loaded_stamp = self.idx_stamp()
+
+    def live_bytes(self):
+        return sum(length for offset, length, mtime
+                   in self.entries.itervalues())
+
+    def compact(self):
+        """Write the archive of the next generation, and its index, without
+        replaced and removed files.
+
+        The old archive is removed once the new index is in place.
+        """
+        _log.info('Compacting {}'.format(self.pack_path))
+        entries = sorted(self.entries.iteritems(), key=lambda e: e[1][0])
+        old_path = self.pack_path
+        new_path = self._pack_path(self.generation + 1)
+        offset = 0
+        with open(old_path, 'rb') as src, \
+                open(new_path, 'wb') as pack, \
+                open(self.idx_path + '.tmp', 'wb') as idx:
+            idx.write(HEADER.pack(MAGIC, self.generation + 1))
+            for (pdb_id, mode, kind), (old, length, mtime) in entries:
+                src.seek(old)
+                pack.write(src.read(length))
+                idx.write(RECORD.pack(pdb_id, mode, KINDS[kind][0], offset,
+                                      length, mtime, False))
+                offset = offset + length
+            pack.flush()
+            os.fsync(pack.fileno())
+            idx.flush()
+            os.fsync(idx.fileno())
+        os.rename(self.idx_path + '.tmp', self.idx_path)
+        os.remove(old_path)
+        self.load()
+
+
+class SceneArchive(object):
+    """Packed archive of the scenes, logs, descriptors and WHY NOT files of a
+    source.
+
+    The files of all entries are packed in shards, see shard_of and Shard:
+        <path>/<source>/<shard>.<generation>.pack
+        <path>/<source>/<shard>.idx
+    so serving or backing up a scene takes one seek in one large file
+    instead of a small file of its own. Only one process should update an
+    archive at a time; any number may read it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.shards = {}
+
+    def shard(self, source, shard):
+        """Return this Shard, loading its index once."""
+        key = (source, shard)
+        if key not in self.shards:
+            self.shards[key] = Shard(os.path.join(self.path, source, shard))
+        return self.shards[key]
+
+    def get(self, source, mode, pdb_id, kind='scene'):
+        """Return the contents of a packed file of an entry, or None."""
+        return self.shard(source, shard_of(pdb_id)).get(pdb_id, mode, kind)
+
+    def find_changes(self, source):
+        """Return the new, changed and removed files in the scene dirs of a
+        source, per shard."""
+        found = {}
+        for mode in MODES:
+            try:
+                pdb_ids = os.listdir(get_scene_dir(source, mode, ''))
+            except OSError:
+                continue
+            for pdb_id in pdb_ids:
+                if not PDB_ID_PAT.match(pdb_id):
+                    continue
+                scene_dir = get_scene_dir(source, mode, pdb_id)
+                for kind, path in entry_files(scene_dir, mode,
+                                              pdb_id).iteritems():
+                    try:
+                        mtime = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                    found.setdefault(shard_of(pdb_id), {})[
+                        (pdb_id, mode, kind)] = (path, mtime)
+
+        shards = set(found)
+        shard_dir = os.path.join(self.path, source)
+        if os.path.isdir(shard_dir):
+            shards.update(os.path.splitext(name)[0]
+                          for name in os.listdir(shard_dir)
+                          if name.endswith('.idx'))
+        changes = {}
+        for shard in shards:
+            entries = self.shard(source, shard).entries
+            files = found.get(shard, {})
+            shard_changes = [key + (path, mtime)
+                             for key, (path, mtime) in files.iteritems()
+                             if entries.get(key, (0, 0, None))[2] != mtime]
+            shard_changes.extend(key + (None, 0) for key in entries
+                                 if key not in files)
+            if shard_changes:
+                changes[shard] = shard_changes
+        return changes
+
+    def update(self, source):
+        """Pack the new and changed files in the scene dirs of a source, and
+        record removed ones.
+
+        Shards whose archive is more than twice the size of its live files
+        are compacted.
+
+        Return the number of packed and removed files.
+        """
+        ensure_dir_existence(os.path.join(self.path, source))
+        changes = self.find_changes(source)
+        n_changes = 0
+        for shard, shard_changes in sorted(changes.iteritems()):
+            shard = self.shard(source, shard)
+            try:
+                shard.append(sorted(shard_changes))
+            except (IOError, OSError) as e:
+                _log.error('Could not pack {}: {}'.format(shard.pack_path, e))
+                continue
+            n_changes = n_changes + len(shard_changes)
+            if os.path.getsize(shard.pack_path) > 2 * shard.live_bytes():
+                shard.compact()
+        _log.info('Packed {} changed files of {} scenes'.format(n_changes,
+                                                               source))
+        return n_changes
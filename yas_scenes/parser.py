@@ -3,6 +3,46 @@ _log = logging.getLogger(__name__)
 
 import bz2
 import re
+from collections import namedtuple
+
+
+class Residue(namedtuple('Residue', ['num', 'icode', 'chain'])):
+    """PDB residue identifier: residue number, insertion code and chain.
+
+    YASARA selection strings are only composed when asked for.
+    """
+    __slots__ = ()
+
+    @property
+    def selection(self):
+        """YASARA residue selection string, e.g. '3B mol A'."""
+        return '{0:d}{1:s} mol {2:s}'.format(self.num, self.icode, self.chain)
+
+    @property
+    def res_selection(self):
+        """YASARA selection string for the atoms of a residue, e.g. the ion of
+        an ion site: 'res 262 mol A'."""
+        return 'res {}'.format(self.selection)
+
+
+class Atom(namedtuple('Atom', ['name', 'residue'])):
+    """PDB atom name and the Residue it is part of."""
+    __slots__ = ()
+
+    @property
+    def selection(self):
+        """YASARA atom selection string, e.g. 'ND1 res 96 mol A'."""
+        return '{0:s} res {1:s}'.format(self.name, self.residue.selection)
+
+
+class IonSite(namedtuple('IonSite', ['name', 'ligands', 'distances'])):
+    """Metal ion site.
+
+    name is the PDB atom name of the ion, e.g. 'ZN'
+    ligands is a list of Residues bound to the ion
+    distances is a dict of ligand Atoms (keys) and their distance to the ion
+    """
+    __slots__ = ()
 
 
 RE_SYMM = re.compile("""
@@ -121,8 +161,8 @@ def int_check_iod(seq_num, res_num, ion_num, ion_pnum, dist):
 def parse_ss2_line(l):
     """Extract residue identifier and number of crystal contacts from ss2 line.
 
-    Return YASARA selection string and number of contacts.
-    The YASARA selection string is composed as:
+    Return a Residue and the number of contacts.
+    The YASARA selection string of the Residue is composed as:
         <PDBResNumberWithInsertionCode> mol <MolName> e.g. '3B mol A'
 
     The ss2 file has a fixed format so we parse the line directly.
@@ -151,26 +191,25 @@ def parse_ss2_line(l):
     seq_num, res_num, num_contacts = int_check_ss2(seq_num, res_num,
                                                    num_contacts)
 
-    yasara_residue_selection = '{0:d}{1:s} mol {2:s}'.format(res_num, res_ic,
-                                                             chain)
-
-    return yasara_residue_selection, num_contacts
+    return Residue(res_num, res_ic, intern(chain)), num_contacts
 
 
 def parse_iod_line(l):
     """Extract ion, residue, and atom selections plus distance from iod line.
 
-    Return YASARA selection strings for ion, residue, and atom;
-        plus the PDB name of the ion and distance between ion and ligand atom.
-    The YASARA selection string for the ion is composed as:
+    Return the Residue of the ion, the PDB name of the ion, the Residue and
+        Atom of the ligand, and distance between ion and ligand atom.
+    The YASARA selection string for the ion (Residue.res_selection) is
+    composed as:
         res <PDBResNumberWithInsertionCode> mol <MolName>
         e.g. 'res 262  mol A'
 
-    The YASARA selection string for the residue is composed as:
+    The YASARA selection string for the residue (Residue.selection) is
+    composed as:
         <PDBResNumberWithInsertionCode> mol <MolName>
         e.g. '96  mol A'
 
-    The YASARA selection string for the atom is composed as:
+    The YASARA selection string for the atom (Atom.selection) is composed as:
         <PDBAtomName res PDBResNumberWithInsertionCode> mol <MolName>'
         e.g. 'ND1 res 96  mol A'
 
@@ -210,97 +249,108 @@ def parse_iod_line(l):
                                                               ion_pnum,
                                                               dist)
 
-    yasara_ion_selection = 'res {0:d}{1:s} mol {2:s}'.format(ion_pnum, ion_ic,
-                                                             ion_chain)
-    yasara_residue_selection = '{0:d}{1:s} mol {2:s}'.format(res_num, res_ic,
-                                                             chain)
-    yasara_atom_selection = '{0:s} res {1:d}{2:s} mol {3:s}'.format(atom,
-                                                                    res_num,
-                                                                    res_ic,
-                                                                    chain)
-    return yasara_ion_selection, ion, yasara_residue_selection, \
-        yasara_atom_selection, dist
+    ion_residue = Residue(ion_pnum, ion_ic, intern(ion_chain))
+    residue = Residue(res_num, res_ic, intern(chain))
+    return ion_residue, intern(ion), residue, Atom(intern(atom), residue), \
+        dist
 
 
-def parse_sym_contacts(ss2):
-    """Parse crystal contacts from a ss2.bz2 file.
+def read_list(path, parse_line):
+    """Parse the lines of a bzip2ed WHAT IF list file with parse_line.
 
-    Return a dict of YASARA residue selection strings (keys) and number of
-    crystal contacts (values):
-        {'<ResNumberWithInsertionCode> mol <MolName>': 1}
-    Residue insertion codes are included in the residue number.
+    Yield the parsed lines.
 
     Raise IOError if the file cannot be read properly.
     Raise ValueError if the format of the file is incorrect.
     """
-    symm_cont = {}
     try:
-        with bz2.BZ2File(ss2, 'r') as f:
+        with bz2.BZ2File(path, 'r') as f:
             for line in f:
                 if not line.startswith('*END'):
                     line = line.rstrip()
-                    select, n_contacts = parse_ss2_line(line)
-                    symm_cont[select] = n_contacts
+                    yield parse_line(line)
     except IOError as e:
         _log.error(e)
-        raise(IOError('Problem reading {}'.format(ss2)))
+        raise(IOError('Problem reading {}'.format(path)))
     except ValueError as e:
         _log.error(e)
         raise e
 
+
+def build_sym_contacts(ss2_lines):
+    """Collect parsed ss2 lines (see parse_ss2_line) in a dict.
+
+    See parse_sym_contacts.
+    """
+    symm_cont = {}
+    for select, n_contacts in ss2_lines:
+        symm_cont[select] = n_contacts
     return symm_cont
 
 
+def build_ion_sites(iod_lines):
+    """Collect parsed iod lines (see parse_iod_line) in a dict of IonSites.
+
+    See parse_ion_sites.
+    """
+    ion_sites = {}
+    residues = {}
+    for ion, ion_name, residue, atom, dist in iod_lines:
+        residue = residues.setdefault(residue, residue)
+        atom = Atom(atom.name, residue)
+        if ion not in ion_sites:
+            ion = residues.setdefault(ion, ion)
+            ion_sites[ion] = IonSite(ion_name, [residue], {atom: dist})
+        else:
+            ion_sites[ion].ligands.append(residue)
+            ion_sites[ion].distances[atom] = dist
+    return ion_sites
+
+
+def parse_sym_contacts(ss2):
+    """Parse crystal contacts from a ss2.bz2 file.
+
+    Return a dict of Residues (keys) and number of crystal contacts (values):
+        {Residue(num, icode, chain): 1}
+    The YASARA selection string of a Residue is composed as:
+        <ResNumberWithInsertionCode> mol <MolName>
+
+    Raise IOError if the file cannot be read properly.
+    Raise ValueError if the format of the file is incorrect.
+    """
+    return build_sym_contacts(read_list(ss2, parse_ss2_line))
+
+
 def parse_ion_sites(iod):
     """Parse metal ion sites from an iod.bz2 file.
 
     Return a dict:
 
-        The keys are YASARA residue selection strings for the ion (its in its
-        own residue):
+        The keys are the Residues of the ions (an ion is in its own residue).
+        Their YASARA selection string (Residue.res_selection) is composed as:
             res <PDBResNumberWithInsertionCode> mol <MolName>
             e.g. 'res 262 mol A'
-        The values are lists:
-            The first element is the PDB atom name e.g. 'ZN'
+        The values are IonSites:
+            name is the PDB atom name e.g. 'ZN'
 
-            The second element is a list of YASARA selection strings
-            of residues bound to the ion.
+            ligands is a list of Residues bound to the ion.
+            Their YASARA selection strings (Residue.selection) are composed as
             <PDBResNumberWithInsertionCode> mol <MolName>
             e.g. ['94  mol A', '96  mol A', '106  mol A', '119  mol A']
 
-            The third element is a dict
-            The keys are YASARA atom selection strings (as above)
+            distances is a dict
+            The keys are the Atoms of the ligands.
             The values are distances defined by the atom to the ion.
 
-        {'res <ResNumberWithInsertionCode> mol <MolName>':
-            ['<PDBAtomName>',
-             [<PDBResNumberWithInsertionCode> mol <MolName>, ],
-             {<PDBAtomName> res <ResNumberWithInsertionCode> mol <MolName>:
-             distance}]},
+        {Residue(num, icode, chain):
+            IonSite('<PDBAtomName>',
+                    [Residue(num, icode, chain), ],
+                    {Atom('<PDBAtomName>', Residue(num, icode, chain)):
+                     distance})},
 
-    Residue insertion codes are included in the residue number.
+    Equal residues share a single Residue object.
 
     Raise IOError if the file cannot be read properly.
     Raise ValueError if the format of the file is incorrect.
     """
-    ion_sites = {}
-    try:
-        with bz2.BZ2File(iod, 'r') as f:
-            for line in f:
-                if not line.startswith('*END'):
-                    line = line.rstrip()
-                    ion, ion_name, residue, atom, dist = parse_iod_line(line)
-                    if ion not in ion_sites:
-                        ion_sites[ion] = [ion_name, [residue], {atom: dist}]
-                    else:
-                        ion_sites[ion][1].append(residue)
-                        ion_sites[ion][2][atom] = dist
-
-    except IOError as e:
-        _log.error(e)
-        raise(IOError('Problem reading {}'.format(iod)))
-    except ValueError as e:
-        _log.error(e)
-        raise e
-
-    return ion_sites
+    return build_ion_sites(read_list(iod, parse_iod_line))
@@ -0,0 +1,207 @@
+import logging
+_log = logging.getLogger(__name__)
+
+from yas_scenes.joblog import job_log
+from yas_scenes.listcache import parse_job_list
+from yas_scenes.preflight import preflight
+from yas_scenes.profiling import profiled
+from yas_scenes.scenestore import get_store_setting, put, restore, scene_key
+from yas_scenes.scheduler import list_path
+from yas_scenes.scratch import (enter_scratch, flush, get_publisher,
+                                published_path)
+from yas_scenes.structure import stage_structure, unstage_structure
+from yas_scenes.tasks import (check_ion_sites_log, check_symmetry_contacts_log,
+                              ion_sites, symmetry_contacts)
+from yas_scenes.utils import (content_hash, delete_scene, scene_paths,
+                              set_debug_loggers, write_whynot)
+from yas_scenes.watchdog import run_with_retries
+from yas_scenes.yobcache import cached, get_cache_setting, lookup
+
+
+# Per scene type: the YASARA task, its log check and a description
+TASKS = {
+    'iod': (ion_sites, check_ion_sites_log, 'metal ion sites'),
+    'ss2': (symmetry_contacts, check_symmetry_contacts_log,
+            'crystal contacts'),
+}
+
+
+def profile_name(job, stage):
+    """Return the name of the profile of a stage of this job."""
+    return '{}_{}_{}'.format(job.pdb_id, job.mode, stage)
+
+
+def prepare(job):
+    """Make the scene dir, parse the list and stage the structure of a job.
+
+    If the scene store has a scene of the same inputs, it is restored instead,
+    see scenestore. The parsed list is screened against the residues in the
+    structure, see preflight, and the structure is looked up in the structure
+    cache, see yobcache. This doesn't need YASARA, so the batch runner
+    prepares the next jobs while YASARA works on the current ones. The job log
+    is started here, in the scratch dir of the job if scratch dirs are
+    configured, see scratch.
+
+    Return None if the job should be rendered. Otherwise return the outcome
+    of the job, success and a message, with which it should be finished
+    without rendering: jobs that are restored or certain to fail.
+    Raise IOError or ValueError if the list or structure cannot be read.
+    """
+    job.scene_path, job.log_path, job.yas_log_path, job.wn_file, \
+        job.wn_db = scene_paths(job, job.mode)
+    job.staged_path = job.pdb_file_path
+    job.yob_path, job.yob_cached = None, False
+    job.scene_key, job.from_store = None, False
+    enter_scratch(job)
+    try:
+        return _prepare(job)
+    except Exception:
+        # Keep the job log
+        if job.scratch_dir:
+            get_publisher().add(job)
+        raise
+
+
+def _prepare(job):
+    with job_log(job.log_path, 'w', job.verbose), \
+            profiled(profile_name(job, 'prepare')):
+        try:
+            if get_cache_setting('DIR') or get_store_setting('DIR'):
+                job.structure_hash = content_hash(job.pdb_file_path)
+            if get_store_setting('DIR'):
+                job.scene_key = scene_key(
+                    job.structure_hash, list_path(job), job.mode,
+                    getattr(job, 'slim', False))
+                if restore(job.scene_key, published_path(job)):
+                    job.from_store = True
+                    return True, 'Scene restored from store'
+                # The old scene may be linked to the store: don't let YASARA
+                # write into it
+                delete_scene(job.scene_path)
+            job.parsed = parse_job_list(job)
+            job.staged_path = stage_structure(job.pdb_file_path)
+        except (IOError, OSError, ValueError) as e:
+            _log.error('{}: {}'.format(job.pdb_id, e))
+            raise
+        try:
+            job.parsed, doomed, job.n_atoms = preflight(
+                job.mode, job.parsed, job.staged_path)
+        except IOError as e:
+            unstage_structure(job.pdb_file_path, job.staged_path)
+            _log.error('{}: {}'.format(job.pdb_id, e))
+            raise
+        if get_cache_setting('DIR'):
+            job.yob_path, job.yob_cached = lookup(job.structure_hash)
+    if doomed:
+        return False, doomed
+    return None
+
+
+def render(job):
+    """Create the scene of a prepared job with YASARA.
+
+    Return a boolean indicating whether YASARA created the scene
+    Return also a string reporting the most important reason why things went
+        ok or went wrong.
+    """
+    if job.verbose:
+        set_debug_loggers()
+
+    task, check, description = TASKS[job.mode]
+    with job_log(job.log_path, 'a', job.verbose):
+        _log.info('Will try to create {} YASARA scene {} from {} and {} for '
+                  'PDB ID {}'.format(description, job.scene_path,
+                                     job.pdb_file_path,
+                                     list_path(job),
+                                     job.pdb_id))
+        args = [job.staged_path, job.scene_path, job.parsed, job.ypid,
+                job.yas_log_path, job.threads, job.yob_path]
+        if job.mode == 'iod':
+            args.append(job.slim)
+        return run_with_retries(task, job.scene_path, *args)
+
+
+def finish(job, success, msg, finished=None):
+    """Check the YASARA log of a rendered job and clean up.
+
+    The staged structure is removed. If the scene could not be created, the
+    scene is deleted and a WHY NOT file is written. The output files are
+    published from the scratch dir of the job, if any, and new scenes are
+    added to the scene store. Restored scenes need no checks.
+
+    finished(job, success) is called once the output files are published:
+    right away without scratch dir, later by the publisher with one. Only
+    then is the job done; success is False if publishing failed.
+
+    Return True if the scene was created.
+    """
+    with job_log(job.log_path, 'a', job.verbose), \
+            profiled(profile_name(job, 'finish')):
+        unstage_structure(job.pdb_file_path, job.staged_path)
+        if success and not job.from_store:
+            args = [job.yas_log_path, job.parsed]
+            if job.mode == 'iod':
+                args.append(job.slim)
+            success, msg = TASKS[job.mode][1](*args)
+
+        if not success:
+            _log.error('{}: {}'.format(job.pdb_id, msg))
+            # If the scene file is still present, delete it
+            delete_scene(job.scene_path)
+            if job.scratch_dir:
+                delete_scene(published_path(job))
+            # Create a WHY NOT entry
+            write_whynot(job.pdb_id, msg, job.wn_db, job.wn_file)
+        else:
+            _log.info('{}: {}'.format(job.pdb_id, msg))
+
+        if job.yob_path and not job.yob_cached:
+            cached(job.yob_path)
+
+    stored = success and not job.from_store
+
+    def published(job, ok=True):
+        try:
+            if ok and stored:
+                store(job)
+        finally:
+            if finished:
+                finished(job, success and ok)
+
+    if job.scratch_dir:
+        get_publisher().add(job, published)
+    else:
+        published(job)
+    return success
+
+
+def store(job):
+    """Add the published scene of a job to the scene store."""
+    put(job.scene_key, published_path(job))
+
+
+def publish():
+    """Publish the output files of all finished jobs now, see scratch."""
+    flush()
+
+
+def run(job):
+    """Prepare, render and finish a job, one after the other, and publish its
+    output files.
+
+    Return True if the scene was created and published.
+    """
+    results = []
+    try:
+        outcome = prepare(job)
+        if not outcome:
+            try:
+                outcome = render(job)
+            except Exception:
+                unstage_structure(job.pdb_file_path, job.staged_path)
+                raise
+        finish(job, *outcome,
+               finished=lambda job, success: results.append(success))
+    finally:
+        publish()
+    return results == [True]
@@ -0,0 +1,155 @@
+import logging
+_log = logging.getLogger(__name__)
+
+from yas_scenes.parser import IonSite, Residue
+from yas_scenes.structure import structure_format
+
+
+# mmCIF atom_site items that identify a residue, as selected in YASARA
+CIF_RESIDUE_ITEMS = ('_atom_site.auth_seq_id', '_atom_site.pdbx_PDB_ins_code',
+                     '_atom_site.auth_asym_id')
+
+
+def scan_pdb_residues(f):
+    """Return the Residues of all ATOM and HETATM records of a PDB file, and
+    the number of atoms."""
+    ids = set()
+    n_atoms = 0
+    for line in f:
+        if line.startswith('ATOM  ') or line.startswith('HETATM'):
+            ids.add(line[21:27])
+            n_atoms = n_atoms + 1
+    residues = set()
+    for res_id in ids:
+        try:
+            residues.add(Residue(int(res_id[1:5]), res_id[5:6].strip(),
+                                 res_id[0:1]))
+        except ValueError:
+            continue
+    return residues, n_atoms
+
+
+def scan_cif_residues(f):
+    """Return the Residues of all atom_site rows of an mmCIF file, and the
+    number of atoms.
+
+    Values in atom_site rows don't contain white space, except for quoted atom
+    names that are not needed here, so rows are split on white space.
+    """
+    items = []
+    columns = None
+    ids = set()
+    n_atoms = 0
+    for line in f:
+        if columns is None:
+            if line.startswith('_atom_site.'):
+                items.append(line.split()[0])
+            elif items:
+                # First row of the atom_site loop
+                columns = [items.index(item) for item in CIF_RESIDUE_ITEMS]
+            else:
+                continue
+        if columns is not None:
+            if line.startswith(('#', 'loop_', '_')):
+                break
+            values = line.split()
+            if len(values) == len(items):
+                ids.add(tuple(values[i] for i in columns))
+                n_atoms = n_atoms + 1
+    residues = set()
+    for num, icode, chain in ids:
+        try:
+            residues.add(Residue(int(num), icode.strip('?.'), chain))
+        except ValueError:
+            continue
+    return residues, n_atoms
+
+
+def scan_structure(path):
+    """Return the Residues in the uncompressed PDB or mmCIF file at path, and
+    its number of atoms.
+
+    Raise IOError if the file cannot be read.
+    Raise ValueError if the atom_site items of an mmCIF file are missing.
+    """
+    with open(path, 'r') as f:
+        if structure_format(path) == 'cif':
+            return scan_cif_residues(f)
+        return scan_pdb_residues(f)
+
+
+def scan_residues(path):
+    """Return the Residues in the uncompressed PDB or mmCIF file at path.
+
+    See scan_structure.
+    """
+    return scan_structure(path)[0]
+
+
+def screen_ion_sites(ion_sites, residues):
+    """Drop ion sites whose ion, and ligands, that are not in residues.
+
+    Return the remaining ion sites, and the number of dropped ion sites and
+    ligands.
+    """
+    screened = {}
+    dropped = 0
+    for ion, site in ion_sites.iteritems():
+        if ion not in residues:
+            dropped = dropped + 1
+            continue
+        ligands = [r for r in site.ligands if r in residues]
+        distances = dict((atom, dist)
+                         for atom, dist in site.distances.iteritems()
+                         if atom.residue in residues)
+        dropped = dropped + len(site.ligands) - len(ligands)
+        if ligands:
+            screened[ion] = IonSite(site.name, ligands, distances)
+    return screened, dropped
+
+
+def screen_sym_contacts(sym_contacts, residues):
+    """Drop crystal contacts of residues that are not in residues.
+
+    Return the remaining crystal contacts, and the number of dropped ones.
+    """
+    screened = dict((residue, n)
+                    for residue, n in sym_contacts.iteritems()
+                    if residue in residues)
+    return screened, len(sym_contacts) - len(screened)
+
+
+def preflight(mode, parsed, structure_path):
+    """Check the parsed list of a job against the structure it belongs to.
+
+    Selections of residues that are not in the structure would make YASARA
+    log warnings, and fail the log check, so they are dropped. Jobs without
+    anything to show are certain to fail.
+
+    Return the screened parsed list, the reason why the job is certain to
+    fail or None, and the number of atoms in the structure or None if it was
+    not scanned.
+
+    Raise IOError if the structure cannot be read.
+    """
+    if not parsed:
+        return parsed, 'Empty {} list: nothing to show'.format(mode), None
+
+    try:
+        residues, n_atoms = scan_structure(structure_path)
+    except ValueError as e:
+        # Let YASARA have a go at it
+        _log.warn('Could not scan {}: {}'.format(structure_path, e))
+        return parsed, None, None
+
+    if mode == 'iod':
+        screened, dropped = screen_ion_sites(parsed, residues)
+    else:
+        screened, dropped = screen_sym_contacts(parsed, residues)
+    if dropped:
+        _log.warn('Dropped {} selections of residues not in {}'.format(
+            dropped, structure_path))
+    if not screened:
+        return screened, 'None of the {} list residues are in the ' \
+            'structure'.format(mode), n_atoms
+    return screened, None, n_atoms
@@ -0,0 +1,117 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from yas_scenes.utils import ensure_dir_existence
+
+
+# Modules of which the hot path is reported
+REPORT_MODULES = ('parser', 'scenes', 'tasks')
+
+_profile_dir = None
+
+
+def enable(profile_dir):
+    """Profile the stages of all jobs started from now on.
+
+    Processes forked after this, e.g. job and task processes, profile their
+    stages too. Profiles are written to profile_dir, see report.
+    """
+    global _profile_dir
+    ensure_dir_existence(profile_dir)
+    _profile_dir = profile_dir
+
+
+@contextmanager
+def profiled(name):
+    """Profile the block if profiling is enabled.
+
+    The profile is written to a new <name>_*.prof file in the profile dir.
+    Only the current thread is profiled.
+    """
+    if _profile_dir is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        fd, path = tempfile.mkstemp(prefix='{}_'.format(name),
+                                    suffix='.prof', dir=_profile_dir)
+        os.close(fd)
+        profile.dump_stats(path)
+
+
+def is_yasara(key):
+    """Return True if this pstats function key is YASARA's python api or
+    the socket it talks to YASARA through."""
+    filename, line, function = key
+    if filename == '~':
+        return '_socket' in function or 'select' in function
+    return os.path.basename(filename).startswith('yasara')
+
+
+def module_of(key):
+    """Return the yas_scenes module name of this pstats function key, or
+    None."""
+    filename = key[0]
+    if os.path.basename(os.path.dirname(filename)) != 'yas_scenes':
+        return None
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def merge(profile_dir):
+    """Return the pstats.Stats of all profiles in profile_dir, or None."""
+    paths = sorted(glob.glob(os.path.join(profile_dir, '*.prof')))
+    if not paths:
+        return None
+    stats = pstats.Stats(paths[0], stream=sys.stdout)
+    for path in paths[1:]:
+        stats.add(path)
+    stats.num_profiles = len(paths)
+    return stats
+
+
+def report(profile_dir, stream=sys.stdout, top=10):
+    """Write a report of all profiles in profile_dir to stream.
+
+    The report has the time spent in YASARA (its python api and socket
+    calls) versus Python, and the top functions by cumulative time in each of
+    the REPORT_MODULES.
+    """
+    stats = merge(profile_dir)
+    if stats is None:
+        stream.write('No profiles in {}\n'.format(profile_dir))
+        return
+
+    yasara_time = sum(tt for key, (cc, nc, tt, ct, callers)
+                      in stats.stats.iteritems() if is_yasara(key))
+    total = stats.total_tt
+    stream.write('Merged {} profiles from {}\n'.format(stats.num_profiles,
+                                                        profile_dir))
+    stream.write('Total {:.3f} s: YASARA {:.3f} s ({:.0%}), Python {:.3f} s\n'
+                 .format(total, yasara_time,
+                         yasara_time / total if total else 0,
+                         total - yasara_time))
+
+    for module in REPORT_MODULES:
+        rows = sorted(((ct, tt, nc, key) for key, (cc, nc, tt, ct, callers)
+                       in stats.stats.iteritems() if module_of(key) == module),
+                      reverse=True)[:top]
+        stream.write('\nTop {} functions in {} by cumulative time:\n'.format(
+            len(rows), module))
+        stream.write('{:>10} {:>10} {:>10}  function\n'.format(
+            'ncalls', 'cumtime', 'tottime'))
+        for ct, tt, nc, (filename, line, function) in rows:
+            stream.write('{:>10} {:>10.3f} {:>10.3f}  {}:{}\n'.format(
+                nc, ct, tt, function, line))
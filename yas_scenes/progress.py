@@ -0,0 +1,175 @@
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from yas_scenes.scheduler import get_batch_setting
+
+
+class Progress(object):
+    """Progress of a batch run.
+
+    Every STATUS_INTERVAL seconds a status line is logged and, if there is a
+    status path, a status file is written (see status). Throughput is
+    measured over sliding windows of RATE_WINDOWS seconds. The ETA is based
+    on the estimated costs of the jobs (see scheduler.estimate_cost), not on
+    the number of jobs: the cost still to do, divided by the cost finished
+    per second in the longest window. Jobs finished without rendering them,
+    e.g. restored from the scene store or certain to fail, take no time: they
+    are left out of the windows, and their cost out of the cost to do.
+
+    Jobs are in flight from when they are being prepared until they finish.
+
+    A worker is a YASARA pid of the runner; its utilisation is the fraction
+    of the run it was rendering. Core utilisation also counts the YASARA
+    threads of the jobs.
+    """
+
+    def __init__(self, n_cores, status_path=None, interval=None,
+                 windows=None):
+        self.n_cores = n_cores
+        self.status_path = status_path or get_batch_setting('STATUS_FILE')
+        self.interval = interval or get_batch_setting('STATUS_INTERVAL', 30)
+        self.windows = sorted(windows or
+                              get_batch_setting('RATE_WINDOWS',
+                                                [60, 300, 900]))
+        self.start_time = time.time()
+        self.next_report = self.start_time + self.interval
+        self.lock = threading.Lock()
+        self.n_jobs = 0
+        self.total_cost = 0
+        self.finished_jobs = deque()
+        self.done = 0
+        self.failed = 0
+        self.finished_cost = 0
+        self.busy = {}
+        self.core_seconds = 0
+        self.in_flight = 0
+        self.rendering = {}
+
+    def add(self, jobs):
+        """Add jobs to run. Their cost must be estimated."""
+        with self.lock:
+            self.n_jobs = self.n_jobs + len(jobs)
+            self.total_cost = self.total_cost + sum(job.cost for job in jobs)
+
+    def preparing(self, job):
+        """Record that a job is being prepared."""
+        with self.lock:
+            self.in_flight = self.in_flight + 1
+
+    def started(self, job):
+        """Record that a job started rendering."""
+        self.rendering[job.ypid] = (time.time(), job.threads)
+
+    def rendered(self, job):
+        """Record that a job stopped rendering, and mark it as rendered."""
+        start, threads = self.rendering.pop(job.ypid)
+        job.rendered = True
+        seconds = time.time() - start
+        self.busy[job.ypid] = self.busy.get(job.ypid, 0) + seconds
+        self.core_seconds = self.core_seconds + seconds * threads
+
+    def finished(self, job, success):
+        """Record that a job finished, rendered or not. This is called from
+        the finish threads."""
+        now = time.time()
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if getattr(job, 'rendered', False):
+                self.finished_jobs.append((now, job.cost, success))
+                self.finished_cost = self.finished_cost + job.cost
+            else:
+                self.total_cost = self.total_cost - job.cost
+            while self.windows and self.finished_jobs and \
+                    self.finished_jobs[0][0] < now - self.windows[-1]:
+                self.finished_jobs.popleft()
+            if success:
+                self.done = self.done + 1
+            else:
+                self.failed = self.failed + 1
+
+    def rates(self, now):
+        """Return the scenes created per minute, and the cost of the jobs
+        finished per second, in each window."""
+        elapsed = max(now - self.start_time, 1e-6)
+        rates = []
+        for window in self.windows:
+            recent = [(cost, success) for t, cost, success
+                      in self.finished_jobs if t >= now - window]
+            seconds = min(window, elapsed)
+            rates.append((window,
+                          sum(1 for c, s in recent if s) * 60 / seconds,
+                          sum(c for c, s in recent) / seconds))
+        return rates
+
+    def status(self, now=None):
+        """Return the status of the run as a dict."""
+        now = now or time.time()
+        with self.lock:
+            elapsed = max(now - self.start_time, 1e-6)
+            rates = self.rates(now)
+            busy = dict(self.busy)
+            core_seconds = self.core_seconds
+            for ypid, (start, threads) in self.rendering.items():
+                busy[ypid] = busy.get(ypid, 0) + now - start
+                core_seconds = core_seconds + (now - start) * threads
+            remaining_cost = self.total_cost - self.finished_cost
+            cost_rate = rates[-1][2] if rates else 0
+            eta = remaining_cost / cost_rate if cost_rate else None
+            return {
+                'jobs': self.n_jobs,
+                'done': self.done,
+                'failed': self.failed,
+                'in_flight': self.in_flight,
+                'rendering': len(self.rendering),
+                'remaining': self.n_jobs - self.done - self.failed,
+                'elapsed': int(elapsed),
+                'scenes_per_minute': dict((str(window), round(rate, 2))
+                                          for window, rate, cost in rates),
+                'worker_utilisation': dict(
+                    (str(ypid), round(seconds / elapsed, 3))
+                    for ypid, seconds in sorted(busy.items())),
+                'core_utilisation': round(
+                    core_seconds / (elapsed * self.n_cores), 3),
+                'remaining_cost': remaining_cost,
+                'eta': None if eta is None else int(eta),
+            }
+
+    def report(self, force=False):
+        """Log the status, and write the status file, every STATUS_INTERVAL
+        seconds, or now if force."""
+        now = time.time()
+        if not force and now < self.next_report:
+            return
+        self.next_report = now + self.interval
+        status = self.status(now)
+        window = str(self.windows[-1]) if self.windows else None
+        _log.info('Progress: {}/{} done, {} failed, {} in flight ({} '
+                  'rendering), {} scenes/min, cores {:.0%} busy, ETA {}'
+                  .format(status['done'], status['jobs'], status['failed'],
+                          status['in_flight'], status['rendering'],
+                          status['scenes_per_minute'].get(window, 0),
+                          status['core_utilisation'],
+                          'unknown' if status['eta'] is None else
+                          timedelta(seconds=status['eta'])))
+        if self.status_path:
+            self.write(status)
+
+    def write(self, status):
+        """Write the status file at once, so readers never see part of it."""
+        tmp_path = '{}.{}.tmp'.format(self.status_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(status, f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.status_path)
+        except (IOError, OSError) as e:
+            _log.error('Could not write status file {}: {}'.format(
+                self.status_path, e))
@@ -0,0 +1,96 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import operator
+import re
+
+
+RE_PREDICATE = re.compile(r"""
+                          ^\s*
+                          (?P<field>\w+)
+                          \s*
+                          (?P<op>!=|>=|<=|=|>|<)
+                          \s*
+                          (?P<value>\S+)
+                          \s*$
+                          """, re.VERBOSE)
+
+# Fields per list type; sets of names or counts
+NAME_FIELDS = {'iod': ('ion', 'chain'), 'ss2': ('chain',)}
+# Name fields that are case-insensitive; chain IDs are not, large mmCIF
+# entries have lowercase chains.
+UPPER_FIELDS = ('ion',)
+COUNT_FIELDS = {'iod': ('sites', 'ligands'), 'ss2': ('contacts', 'residues')}
+
+OPERATORS = {'=': operator.eq, '!=': operator.ne, '>': operator.gt,
+             '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+
+class Predicate(object):
+    """A condition on the parsed list of an entry, e.g. 'ion=HG,CD'.
+
+    Name fields (ion, chain) support = (any of the names is present) and !=
+    (none of the names is present); ion names are case-insensitive, chain
+    IDs are not. Count fields support all comparisons:
+        iod: sites (number of ion sites), ligands (number of ligand residues)
+        ss2: contacts (number of residues with contacts), residues
+    """
+
+    def __init__(self, mode, text):
+        m = RE_PREDICATE.match(text)
+        if not m:
+            raise ValueError("Invalid condition: '{}'".format(text))
+        self.field, self.op, value = m.group('field', 'op', 'value')
+
+        if self.field in NAME_FIELDS[mode]:
+            if self.op not in ('=', '!='):
+                raise ValueError("Use = or != with {}".format(self.field))
+            self.value = set(value.split(','))
+            if self.field in UPPER_FIELDS:
+                self.value = set(v.upper() for v in self.value)
+        elif self.field in COUNT_FIELDS[mode]:
+            try:
+                self.value = int(value)
+            except ValueError:
+                raise ValueError("{} should be compared with an integer"
+                                 .format(self.field))
+        else:
+            raise ValueError("Unknown field for {} lists: '{}'".format(
+                mode, self.field))
+
+    def matches(self, summary):
+        """Return True if the summary of an entry satisfies this condition."""
+        value = summary[self.field]
+        if isinstance(value, set):
+            present = bool(value & self.value)
+            return present if self.op == '=' else not present
+        return OPERATORS[self.op](value, self.value)
+
+
+def summarize(mode, rows):
+    """Return the values of all fields for the index rows of an entry.
+
+    See index.COLUMNS for the rows.
+    """
+    if mode == 'iod':
+        sites = set((r[0], r[1], r[2]) for r in rows)
+        return {'ion': set(r[3].rstrip('\0') for r in rows),
+                'chain': set(r[2] for r in rows) | set(r[6] for r in rows),
+                'sites': len(sites),
+                'ligands': len(set((r[4], r[5], r[6]) for r in rows))}
+    return {'chain': set(r[2] for r in rows),
+            'contacts': sum(1 for r in rows if r[3] > 0),
+            'residues': len(rows)}
+
+
+def select_entries(list_index, mode, predicates):
+    """Return PDB IDs and list paths of the entries that satisfy all
+    predicates, sorted by PDB ID."""
+    selected = []
+    for pdb_id, entry in sorted(list_index.table[mode]['entries'].items()):
+        rows = list_index.rows(mode, entry) if entry['count'] else []
+        summary = summarize(mode, rows)
+        if all(p.matches(summary) for p in predicates):
+            selected.append((str(pdb_id), str(entry['path'])))
+    _log.info('{} {} entries match'.format(len(selected), mode))
+    return selected
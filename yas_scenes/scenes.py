@@ -3,17 +3,22 @@ from __future__ import division
 import logging
 _log = logging.getLogger(__name__)
 
+import os
 import re
 
 import yasara as yas
 
+from yas_scenes.structure import structure_format
+from yas_scenes.watchdog import stage_timeout
+
 
 def prepare_yasara(pid, yasara_log=None, n_threads=1):
     """Prepare YASARA for a parallel setting.
 
     This means: enable text mode, disable the license screen, assign a unique
     YASARA pid (prevents issues with temporary files created by YASARA),
-    disabling the console and disabling multi-threadingsetting.
+    disabling the console and setting the number of cpu threads (by default
+    multi-threading is disabled).
 
     If yasara_log is not None, don't disable the console; instead log to
     yasara_log. (If the console if off, commands are not recorded).
@@ -26,69 +31,111 @@ def prepare_yasara(pid, yasara_log=None, n_threads=1):
     yas.info.licenseshown = 0
 
     # Assign a unique yasara PID
-    _log.debug("Setting YASARA pid to {}...".format(pid))
+    _log.debug("Setting YASARA pid to %s...", pid)
     yas.pid = pid
 
     if yasara_log:
         # Log
         yas.RecordLog(yasara_log, append="No")
-        _log.debug("Logging YASARA commands to {}.log...".format(yasara_log))
+        _log.debug("Logging YASARA commands to %s.log...", yasara_log)
     else:
         # Disable Console
         _log.debug("Disabling YASARA console...")
         yas.Console("off")
 
-    # Use 1 cpu thread
-    _log.debug("Assigning {} cpu threads to YASARA...".format(n_threads))
+    # Use n_threads cpu threads
+    _log.debug("Assigning %s cpu threads to YASARA...", n_threads)
     yas.Processors(cputhreads=n_threads)
 
 
-def create_ion_scene(pdb_path, sce_path, ion_sites):
+def load_structure(pdb_path, yob_path=None):
+    """Load a PDB or mmCIF structure file in YASARA.
+
+    mmCIF files are loaded with YASARA's own mmCIF reader, so structures that
+    are only available as mmCIF need no conversion to PDB format.
+
+    If yob_path is given, the structure is loaded from that YASARA object file
+    if it exists (see yobcache). Otherwise the structure is saved there after
+    loading it, if it is a single object.
+    """
+    if yob_path and os.path.exists(yob_path):
+        _log.debug("Loading cached object %s...", yob_path)
+        with stage_timeout('load'):
+            yas.LoadYOb(yob_path)
+        return
+
+    _log.debug("Loading file %s as structure...", pdb_path)
+    with stage_timeout('load'):
+        if structure_format(pdb_path) == 'cif':
+            objects = yas.LoadCIF(pdb_path)
+        else:
+            objects = yas.LoadPDB(pdb_path)
+
+    if yob_path and objects and len(objects) == 1:
+        save_object(objects[0], yob_path)
+
+
+def save_object(obj, yob_path):
+    """Save a YASARA object to yob_path, without partial files in the way.
+
+    Failures are logged, the scene can be created without the object file.
+    """
+    tmp_path = '{}.{}.yob'.format(os.path.splitext(yob_path)[0],
+                                  os.getpid())
+    _log.debug("Caching object %s as %s...", obj, yob_path)
+    try:
+        if not os.path.isdir(os.path.dirname(yob_path)):
+            os.makedirs(os.path.dirname(yob_path))
+        with stage_timeout('save'):
+            yas.SaveYOb(obj, tmp_path)
+        os.rename(tmp_path, yob_path)
+    except (OSError, RuntimeError) as e:
+        _log.warn('Could not cache {}: {}'.format(yob_path, e))
+
+
+def create_ion_scene(pdb_path, sce_path, ion_sites, yob_path=None,
+                     slim=False):
     """Create a YASARA scene displaying metal ion sites.
 
     pdb_path is the path to the PDB file
     sce_path is the path of the YASARA scene to be created
-    ion_sites is a dictionary of the ion sites to display.
-        The keys are YASARA residue selection strings for the ion (its in its
-        own residue):
+    yob_path is the path of the cached YASARA object, see load_structure
+    ion_sites is a dictionary of the ion sites to display, as returned by
+        parser.parse_ion_sites.
+        The keys are the parser.Residues of the ions (an ion is in its own
+        residue), selected in YASARA as:
             res <PDBResNumberWithInsertionCode> mol <MolName>
             e.g. 'res 262 mol A'
-        The values are lists:
-            The first element is the PDB atom name e.g. 'ZN'
+        The values are parser.IonSites:
+            name is the PDB atom name e.g. 'ZN'
 
-            The second element is a list of YASARA selection strings
-            of residues bound to the ion.
+            ligands is a list of parser.Residues bound to the ion, selected in
+            YASARA as:
             <PDBResNumberWithInsertionCode> mol <MolName>
             e.g. ['94  mol A', '96  mol A', '106  mol A', '119  mol A']
 
-            The third element is a dict
-            The keys are YASARA atom selection strings (as above)
-            The values are distances defined by the atom to the ion.
-
-        {'res <ResNumberWithInsertionCode> mol <MolName>':
-            ['<PDBAtomName>',
-             [<PDBResNumberWithInsertionCode> mol <MolName>, ],
-             {<PDBAtomName> res <ResNumberWithInsertionCode> mol <MolName>:
-             distance}]},
-
+            distances is a dict of the ligand parser.Atoms and their distance
+            to the ion.
 
-
-
-    Residue insertion codes are included in the residue number.
+    YASARA selection strings are composed here, while the scene is built.
 
     Only the ion sites (ion + ligands) wil be shown, all other atoms are
     hidden. Arrows between ions and atoms are hidden.
     The scene is zoomed in on the first ion site.
 
+    If slim, the hidden atoms are deleted before the scene is saved, so the
+    scene only contains the ion sites. The original and remaining numbers of
+    atoms are logged.
+
     RuntimeErrors will be raised if the pdb_path is invalid, if the residue
     name is more than 4 digits, etc.
+    A StageTimeout will be raised if loading or saving takes too long.
 
     Unrealistic selections don't always raise a RuntimeError: non-existing 'Zn'
     or non- existing residue numbers, for example.
     """
     # Load PDB structure
-    _log.debug("Loading file {} as structure...".format(pdb_path))
-    yas.LoadPDB(pdb_path)
+    load_structure(pdb_path, yob_path)
 
     _log.debug("Making YASARA ion scene...")
 
@@ -98,17 +145,16 @@ def create_ion_scene(pdb_path, sce_path, ion_sites):
     yas.HideArrowAll()
 
     # Then show the ion sites
-    for ion, values in ion_sites.iteritems():
+    for ion, site in ion_sites.iteritems():
         # metal ions..
         # always have their own residue
-        yas.ShowAtom("{}".format(ion))
-        yas.BallAtom("{}".format(ion))
+        yas.ShowAtom(ion.res_selection)
+        yas.BallAtom(ion.res_selection)
 
         # ..and ligands
-        ligands = values[1]
-        for ligand in ligands:
-            yas.ShowRes(ligand)
-            yas.StickRes(ligand)
+        for ligand in site.ligands:
+            yas.ShowRes(ligand.selection)
+            yas.StickRes(ligand.selection)
 
     # Nice visualisation
     yas.ColorBG("000040", "30c0ff")
@@ -118,22 +164,41 @@ def create_ion_scene(pdb_path, sce_path, ion_sites):
     # Zoom in on first site
     ion1 = ion_sites.iterkeys().next()
     # Deal with alternates
-    alt1 = yas.ListRes("{}".format(ion1), format="ATOMNUM")
+    alt1 = yas.ListRes(ion1.res_selection, format="ATOMNUM")
     yas.CenterAtom(alt1, coordsys="Global")
     yas.ZoomAtom(alt1, steps=0)
 
+    if slim:
+        delete_hidden_atoms()
+
     # Save scene
-    _log.debug("Saving YASARA scene to file {}".format(sce_path))
-    yas.SaveSce(sce_path)
+    _log.debug("Saving YASARA scene to file %s", sce_path)
+    with stage_timeout('save'):
+        yas.SaveSce(sce_path)
+
+
+def delete_hidden_atoms():
+    """Delete all atoms that are not visible.
+
+    Return the number of atoms before and after deleting them.
+    """
+    total = yas.CountAtom("all")
+    yas.DelAtom("visible no")
+    kept = yas.CountAtom("all")
+    _log.info('Slim scene: kept {} of {} atoms'.format(kept, total))
+    return total, kept
 
 
-def create_sym_scene(pdb_path, sce_path, sym_contacts):
+def create_sym_scene(pdb_path, sce_path, sym_contacts, yob_path=None):
     """Create a YASARA scene displaying the crystal contacts.
 
     pdb_path is the path to the PDB file
     sce_path is the path of the YASARA scene to be created
-    sym_contacts is a dictionary of the symmetry contacts to display.
-        the keys are YASARA residue selection strings (one key = one residue):
+    yob_path is the path of the cached YASARA object, see load_structure
+    sym_contacts is a dictionary of the symmetry contacts to display, as
+        returned by parser.parse_sym_contacts.
+        the keys are parser.Residues (one key = one residue), selected in
+        YASARA as:
             <ResNumber> mol <MolName> e.g.
             '3 Mol A'
         the values incidate the number of symmetry contacts
@@ -152,13 +217,13 @@ def create_sym_scene(pdb_path, sce_path, sym_contacts):
 
     RuntimeErrors will be raised if the pdb_path is invalid, if the residue
     name is more than 4 digits, etc.
+    A StageTimeout will be raised if loading or saving takes too long.
 
     Unrealistic selections don't always raise a RuntimeError: non-existing 'Zn'
     or non- existing residue numbers, for example.
     """
     # Load PDB structure
-    _log.debug("Loading file {} as structure...".format(pdb_path))
-    yas.LoadPDB(pdb_path)
+    load_structure(pdb_path, yob_path)
 
     _log.debug("Making YASARA symmetry contacts scene...")
 
@@ -168,10 +233,11 @@ def create_sym_scene(pdb_path, sce_path, sym_contacts):
 
     # Show residues and color according to property values
     for residue, num_contacts in sym_contacts.iteritems():
+        selection = residue.selection
         if num_contacts > 0:
-            yas.ShowAtom("Sidechain res {}".format(residue))
-        yas.PropRes(residue, num_contacts/10)
-        yas.ColorRes(residue, "Property")
+            yas.ShowAtom("Sidechain res {}".format(selection))
+        yas.PropRes(selection, num_contacts/10)
+        yas.ColorRes(selection, "Property")
 
     # Nice visualisation
     yas.ColorBG("000040", "30c0ff")
@@ -180,18 +246,21 @@ def create_sym_scene(pdb_path, sce_path, sym_contacts):
     yas.NiceOriAll()
 
     # Save scene
-    _log.debug("Saving YASARA scene to file {}".format(sce_path))
-    yas.SaveSce(sce_path)
+    _log.debug("Saving YASARA scene to file %s", sce_path)
+    with stage_timeout('save'):
+        yas.SaveSce(sce_path)
 
 
 def exit_yasara():
     """Return True if YASARA terminated normally.
 
     Any open YASARA log files will be closed.
+    A StageTimeout will be raised if YASARA does not exit in time.
     """
     try:
         _log.debug("Closing YASARA...")
-        yas.Exit()
+        with stage_timeout('exit'):
+            yas.Exit()
     except RuntimeError as e:
         return False
     return True
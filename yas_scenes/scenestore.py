@@ -0,0 +1,173 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import hashlib
+import os
+import shutil
+
+from yas_scenes.settings import settings
+from yas_scenes.utils import (content_hash, ensure_dir_existence, evict,
+                              get_evictor)
+
+
+# Modules that define what scenes look like. A change to any of them changes
+# the style fingerprint, so stored scenes of the old style are not used.
+STYLE_MODULES = ('scenes',)
+
+_style_hash = None
+
+
+def get_store_setting(key, default=None):
+    """Return this scene store setting.
+
+    SCENE_STORE is configured in scenes_settings, e.g.
+        {"DIR": "/data/scenes/store", "MAX_BYTES": 107374182400}
+    The store is disabled if there is no DIR. Put the store on the same
+    filesystem as the scene roots, so stored scenes are hard linked rather
+    than copied.
+    """
+    value = settings.get('SCENE_STORE', {}).get(key)
+    return default if value is None else value
+
+
+def style_fingerprint(slim=False):
+    """Return the fingerprint of the scene style: the hash of the sources of
+    the STYLE_MODULES and the scene options."""
+    global _style_hash
+    if _style_hash is None:
+        digest = hashlib.sha1()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for module in STYLE_MODULES:
+            digest.update(content_hash(os.path.join(here, module + '.py')))
+        _style_hash = digest.hexdigest()
+    return '{}{}'.format(_style_hash, '-slim' if slim else '')
+
+
+def scene_key(structure_hash, list_path, mode, slim=False):
+    """Return the store key of a scene: the hash of its inputs and style.
+
+    Identical inputs render identical scenes, so the key is the same for
+    reruns, unchanged obsolete entries and PDB and REDO entries sharing a
+    structure and list.
+
+    Raise IOError if the list file cannot be read.
+    """
+    digest = hashlib.sha1()
+    for part in (structure_hash, content_hash(list_path), mode,
+                 style_fingerprint(slim)):
+        digest.update(part)
+        digest.update('\0')
+    return digest.hexdigest()
+
+
+def store_path(store_dir, key):
+    """Return the path of the stored scene with this key."""
+    return os.path.join(store_dir, key[:2], '{}.sce'.format(key))
+
+
+def materialize(src, dst):
+    """Hard link src to dst, or copy it if it cannot be linked, e.g. across
+    filesystems. dst is replaced at once, without partial files in the way.
+
+    Raise OSError or IOError if neither works.
+    """
+    tmp_path = '{}.{}.tmp'.format(dst, os.getpid())
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    try:
+        os.rename(tmp_path, dst)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+def restore(key, scene_path):
+    """Restore the stored scene with this key to scene_path, if any.
+
+    Hits are touched, so the least recently used scenes are evicted first.
+
+    Return True if the scene was restored.
+    """
+    store_dir = get_store_setting('DIR')
+    if not store_dir or not key:
+        return False
+    path = store_path(store_dir, key)
+    try:
+        os.utime(path, None)
+        materialize(path, scene_path)
+    except (IOError, OSError) as e:
+        if os.path.exists(path):
+            _log.error('Could not restore {}: {}'.format(path, e))
+        return False
+    _log.info('Restored {} from {}'.format(scene_path, path))
+    return True
+
+
+def put(key, scene_path):
+    """Add the scene at scene_path to the store under this key, and evict
+    scenes once the store exceeds MAX_BYTES, see utils.Evictor.
+
+    Return True if the scene was added.
+    """
+    store_dir = get_store_setting('DIR')
+    if not store_dir or not key:
+        return False
+    path = store_path(store_dir, key)
+    if os.path.exists(path):
+        return False
+    try:
+        ensure_dir_existence(os.path.dirname(path))
+        materialize(scene_path, path)
+    except (IOError, OSError) as e:
+        _log.error('Could not store {}: {}'.format(scene_path, e))
+        return False
+    _log.debug('Stored %s as %s', scene_path, path)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    get_evictor(store_dir, '.sce', True).added(
+        size, get_store_setting('MAX_BYTES', 100 * 1024 ** 3))
+    return True
+
+
+def evict_scenes(max_bytes=None):
+    """Evict stored scenes above max_bytes (default MAX_BYTES, 100 GB).
+
+    Scenes that are not linked from a scene dir anymore are evicted first.
+
+    Return the number of evicted scenes.
+    """
+    store_dir = get_store_setting('DIR')
+    if not store_dir or not os.path.isdir(store_dir):
+        return 0
+    if max_bytes is None:
+        max_bytes = get_store_setting('MAX_BYTES', 100 * 1024 ** 3)
+    return evict(store_dir, max_bytes, '.sce', orphans_first=True)
+
+
+def remove_orphans():
+    """Remove all stored scenes that are not linked from a scene dir.
+
+    Only use this if the store is on the same filesystem as the scene roots:
+    copied scenes look like orphans.
+
+    Return the number of removed scenes.
+    """
+    store_dir = get_store_setting('DIR')
+    if not store_dir or not os.path.isdir(store_dir):
+        return 0
+    removed = 0
+    for dir_path, dir_names, file_names in os.walk(store_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            try:
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed = removed + 1
+            except OSError as e:
+                _log.error('Could not remove {}: {}'.format(path, e))
+    _log.info('Removed {} orphaned scenes from {}'.format(removed, store_dir))
+    return removed
@@ -0,0 +1,98 @@
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+
+from yas_scenes.index import get_index
+from yas_scenes.settings import settings
+from yas_scenes.structure import is_gzipped
+
+
+# Approximate compression ratio of gzipped structure files
+GZIP_RATIO = 4
+# A list file line costs about as much YASARA time as this many structure
+# bytes: each line adds two or three YASARA commands to the scene.
+LIST_LINE_COST = 2000
+# Approximate number of bzip2ed bytes per list file line
+BZ2_LINE_BYTES = 5
+
+
+def get_batch_setting(key, default=None):
+    """Return this batch runner setting.
+
+    BATCH is configured in scenes_settings, e.g.
+        {"CORES": 16, "FIRST_YPID": 1000, "MAX_THREADS": 4,
+         "COST_PER_THREAD": 20000000}
+    """
+    value = settings.get('BATCH', {}).get(key)
+    return default if value is None else value
+
+
+def list_path(job):
+    """Return the path to the WHAT IF list file of this job."""
+    return job.iod if job.mode == 'iod' else job.ss2
+
+
+def estimate_lines(mode, bz2_path):
+    """Return the (estimated) number of lines in a bzip2ed list file.
+
+    The number is taken from the list index if it has the file, otherwise it
+    is estimated from the compressed size, so the file isn't decompressed.
+    Return 0 if the file can't be read.
+    """
+    index = get_index()
+    entry = index.lookup(mode, bz2_path) if index else None
+    if entry is not None:
+        return entry['count']
+    try:
+        return os.path.getsize(bz2_path) // BZ2_LINE_BYTES
+    except OSError as e:
+        _log.error(e)
+        return 0
+
+
+def structure_size(pdb_file_path):
+    """Return the (estimated) uncompressed size of a structure file in
+    bytes."""
+    size = os.path.getsize(pdb_file_path)
+    if is_gzipped(pdb_file_path):
+        size = size * GZIP_RATIO
+    return size
+
+
+def estimate_cost(job):
+    """Estimate how expensive it is to create the scene of this job.
+
+    The cost is expressed in structure bytes: the size of the structure file
+    (loading it dominates for large assemblies) plus a fixed amount per line
+    in the list file. No file is read, so ordering many jobs is fast.
+    """
+    return structure_size(job.pdb_file_path) + \
+        LIST_LINE_COST * estimate_lines(job.mode, list_path(job))
+
+
+def threads_for(cost, n_cores, threads=None):
+    """Return the number of YASARA cpu threads for a job with this cost.
+
+    Jobs get one thread plus one per COST_PER_THREAD, up to MAX_THREADS and
+    the number of cores. If threads is given, e.g. found by scenes tune, every
+    job gets that many threads instead, up to the number of cores.
+    """
+    if threads:
+        return min(threads, n_cores)
+    max_threads = get_batch_setting('MAX_THREADS', 4)
+    cost_per_thread = get_batch_setting('COST_PER_THREAD', 20000000)
+    threads = 1 + int(cost // cost_per_thread)
+    return max(1, min(threads, max_threads, n_cores))
+
+
+def order_jobs(jobs):
+    """Return the jobs ordered by estimated cost, most expensive first.
+
+    The estimated cost is stored on each job as job.cost.
+    """
+    for job in jobs:
+        job.cost = estimate_cost(job)
+    return sorted(jobs, key=lambda job: job.cost, reverse=True)
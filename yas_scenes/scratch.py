@@ -0,0 +1,207 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+import shutil
+import tempfile
+import threading
+
+from yas_scenes.settings import settings
+from yas_scenes.utils import ensure_dir_existence
+
+
+# Job attributes with the paths of the files a job writes
+OUTPUT_PATHS = ('scene_path', 'log_path', 'yas_log_path', 'wn_file')
+
+
+def get_scratch_setting(key, default=None):
+    """Return this scratch setting.
+
+    SCRATCH is configured in scenes_settings, e.g.
+        {"DIR": "/scratch/scenes", "PUBLISH_BATCH": 32,
+         "PUBLISH_INTERVAL": 10}
+    Scratch dirs are disabled if there is no DIR. Use a node-local disk or
+    tmpfs.
+    """
+    value = settings.get('SCRATCH', {}).get(key)
+    return default if value is None else value
+
+
+def enter_scratch(job):
+    """Let a job write its output files in a scratch dir of its own.
+
+    The paths of the output files of the job are moved to the scratch dir;
+    job.scene_dir keeps the scene dir they are published to, see publish.
+
+    Return False if scratch dirs are disabled.
+    """
+    job.scene_dir = os.path.dirname(job.scene_path)
+    job.scratch_dir = None
+    scratch_root = get_scratch_setting('DIR')
+    if not scratch_root:
+        return False
+    ensure_dir_existence(scratch_root)
+    job.scratch_dir = tempfile.mkdtemp(
+        prefix='{}_{}_'.format(job.mode, job.pdb_id), dir=scratch_root)
+    for attr in OUTPUT_PATHS:
+        setattr(job, attr, os.path.join(job.scratch_dir,
+                                        os.path.basename(getattr(job, attr))))
+    return True
+
+
+def published_path(job):
+    """Return the path the scene of a job is published to."""
+    return os.path.join(job.scene_dir, os.path.basename(job.scene_path))
+
+
+def leave_scratch(job):
+    """Remove the scratch dir of a job, with everything in it."""
+    if job.scratch_dir:
+        shutil.rmtree(job.scratch_dir, ignore_errors=True)
+
+
+def publish_file(job, name):
+    """Copy an output file of a job from its scratch dir to its scene dir.
+
+    The file is copied next to its destination under a temporary name and
+    renamed, so readers never see part of a file. The temporary file is
+    removed if this fails.
+
+    Raise IOError or OSError if the file could not be published.
+    """
+    tmp_path = os.path.join(job.scene_dir, '.{}.tmp'.format(name))
+    try:
+        shutil.copyfile(os.path.join(job.scratch_dir, name), tmp_path)
+        os.rename(tmp_path, os.path.join(job.scene_dir, name))
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def publish(job):
+    """Move the output files of a job from its scratch dir to its scene dir,
+    see publish_file. The scratch dir is removed.
+
+    Files that could not be published are logged and lost; the others are
+    still published.
+
+    Raise IOError or OSError if a file could not be published.
+    """
+    lost = []
+    try:
+        names = sorted(os.listdir(job.scratch_dir))
+        try:
+            ensure_dir_existence(job.scene_dir)
+        except OSError as e:
+            _log.error('{} {}: {}'.format(job.mode, job.pdb_id, e))
+            lost = names
+        else:
+            for name in names:
+                try:
+                    publish_file(job, name)
+                except (IOError, OSError) as e:
+                    _log.error('{} {}: could not publish {}: {}'.format(
+                        job.mode, job.pdb_id, name, e))
+                    lost.append(name)
+    finally:
+        leave_scratch(job)
+    if lost:
+        raise IOError('Lost {} of {}: {}'.format(len(lost), len(names),
+                                                 ', '.join(lost)))
+
+
+class Publisher(object):
+    """Background thread that publishes the output files of jobs in batches.
+
+    Jobs are published once PUBLISH_BATCH jobs are waiting, and at least
+    every PUBLISH_INTERVAL seconds. Together with scratch dirs, this keeps
+    the many small writes of YASARA, and the reads of its log, off the shared
+    filesystem the scene dirs are on.
+    """
+
+    def __init__(self, batch_size=None, interval=None):
+        self.batch_size = batch_size or get_scratch_setting('PUBLISH_BATCH',
+                                                            32)
+        self.interval = interval or get_scratch_setting('PUBLISH_INTERVAL',
+                                                        10)
+        self.queue = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.waiting = threading.Event()
+        self.full = threading.Event()
+        self.thread = threading.Thread(target=self._publish)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, job, published=None):
+        """Publish the output files of a job in the next batch.
+
+        published(job, success) is called once they are published, or
+        publishing failed.
+        """
+        with self.lock:
+            self.queue.append((job, published))
+            self.waiting.set()
+            if len(self.queue) >= self.batch_size:
+                self.full.set()
+
+    def flush(self):
+        """Publish all waiting jobs now.
+
+        Return the number of jobs that were published.
+        """
+        with self.flush_lock:
+            with self.lock:
+                batch, self.queue = self.queue, []
+                self.waiting.clear()
+                self.full.clear()
+            for job, published in batch:
+                success = True
+                try:
+                    publish(job)
+                except (IOError, OSError) as e:
+                    _log.error('Could not publish {} {}: {}'.format(
+                        job.mode, job.pdb_id, e))
+                    success = False
+                if published:
+                    published(job, success)
+            if batch:
+                _log.debug('Published %d jobs', len(batch))
+        if threading.current_thread() is not self.thread:
+            # Don't let the thread wait out the interval for jobs that are
+            # gone: wake it, so it waits for new jobs
+            self.full.set()
+        return len(batch)
+
+    def _publish(self):
+        while True:
+            self.waiting.wait()
+            self.full.wait(self.interval)
+            self.flush()
+
+
+_publisher = None
+_publisher_pid = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    """Return the Publisher of this process.
+
+    Threads don't survive a fork, so a forked process starts its own.
+    """
+    global _publisher, _publisher_pid
+    with _publisher_lock:
+        if _publisher is None or _publisher_pid != os.getpid():
+            _publisher = Publisher()
+            _publisher_pid = os.getpid()
+        return _publisher
+
+
+def flush():
+    """Publish the output files of all finished jobs now."""
+    if _publisher is not None and _publisher_pid == os.getpid():
+        _publisher.flush()
@@ -0,0 +1,115 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import gzip
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from yas_scenes.settings import settings
+
+
+GZIP_MAGIC = '\x1f\x8b'
+PDB_EXTENSIONS = ('.pdb', '.ent', '.brk')
+CIF_EXTENSIONS = ('.cif', '.mmcif')
+
+
+def is_gzipped(path):
+    """Return True if the file name of path ends with .gz."""
+    return path.lower().endswith('.gz')
+
+
+def structure_format(path):
+    """Return the format of the structure file at path: 'pdb' or 'cif'.
+
+    The format is derived from the file name extension; a trailing .gz is
+    ignored. Files with an unknown extension are treated as PDB files.
+    """
+    name = path.lower()
+    if is_gzipped(name):
+        name = name[:-3]
+    if name.endswith(CIF_EXTENSIONS):
+        return 'cif'
+    return 'pdb'
+
+
+def get_staging_dir():
+    """Return the directory used to stage decompressed structure files.
+
+    STAGING_DIR is configured in scenes_settings. If it is not configured,
+    /dev/shm is used if it is available, the system tmp dir otherwise.
+    """
+    staging_dir = settings.get('STAGING_DIR')
+    if staging_dir:
+        return staging_dir
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def decompress_to(path, staging_dir):
+    """Stream the gzipped file at path to a new file in staging_dir.
+
+    Return the path of the decompressed file. The extension of the new file
+    tells YASARA which format to expect.
+
+    Raise IOError if the file cannot be decompressed.
+    """
+    suffix = '.cif' if structure_format(path) == 'cif' else '.pdb'
+    fd, staged_path = tempfile.mkstemp(suffix=suffix, prefix='scenes_',
+                                       dir=staging_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            src = gzip.open(path, 'rb')
+            try:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+            finally:
+                src.close()
+    except (IOError, OSError, EOFError) as e:
+        _log.error(e)
+        os.remove(staged_path)
+        raise IOError('Problem decompressing {}'.format(path))
+    _log.debug('Staged %s as %s', path, staged_path)
+    return staged_path
+
+
+def stage_structure(path, staging_dir=None):
+    """Return the path to the structure file at path in a form YASARA can
+    load.
+
+    Uncompressed PDB and mmCIF files are used as is. Gzipped files are
+    decompressed to a temporary file in staging_dir (see get_staging_dir).
+    Remove it with unstage_structure.
+
+    Raise IOError if the file cannot be decompressed.
+    """
+    if not is_gzipped(path):
+        return path
+    return decompress_to(path, staging_dir or get_staging_dir())
+
+
+def unstage_structure(path, staged_path):
+    """Remove the staged file of the structure file at path, if any."""
+    if staged_path == path:
+        return
+    try:
+        os.remove(staged_path)
+    except OSError as e:
+        _log.error('Could not delete {}: {}'.format(staged_path, e))
+
+
+@contextmanager
+def staged_structure(path, staging_dir=None):
+    """Provide a structure file at path in a form YASARA can load.
+
+    See stage_structure. The staged file is removed again when the context is
+    left.
+
+    Yield the path of the file to load.
+    """
+    staged_path = stage_structure(path, staging_dir)
+    try:
+        yield staged_path
+    finally:
+        unstage_structure(path, staged_path)
@@ -8,40 +8,64 @@ import re
 
 from yas_scenes.scenes import (create_ion_scene, create_sym_scene, exit_yasara,
                                prepare_yasara)
+from yas_scenes.watchdog import StageTimeout
 
 
 def ion_sites(pdb_file_path, yasara_scene_path, ion_ligand_dict,
-              yasara_pid, yasara_log):
+              yasara_pid, yasara_log, n_threads=1, yob_path=None, slim=False):
     """Creates a YASARA scene displaying metal ion sites.
 
+    The YASARA log is not checked, see check_ion_sites_log and
+    check_symmetry_contacts_log. The structure is loaded from, or cached in,
+    yob_path if it is given (see yobcache).
+
     Return a boolean indicating whether everything went succesful
     Return also a string reporting the most important reason why things went
         ok or went wrong.
+    Raise StageTimeout if a YASARA command took too long.
     """
     success = False
     try:
         # Set pid and open a log file
-        prepare_yasara(pid=yasara_pid, yasara_log=yasara_log)
+        prepare_yasara(pid=yasara_pid, yasara_log=yasara_log,
+                       n_threads=n_threads)
         # Create and save the scene
         create_ion_scene(pdb_path=pdb_file_path, sce_path=yasara_scene_path,
-                         ion_sites=ion_ligand_dict)
+                         ion_sites=ion_ligand_dict, yob_path=yob_path,
+                         slim=slim)
         msg = 'Scene created'
         success = True
-        _log.debug('{}: {}'.format(msg, yasara_scene_path))
+        _log.debug('%s: %s', msg, yasara_scene_path)
+    except StageTimeout:
+        # YASARA hangs and will not exit; it is killed by the watchdog
+        raise
     except Exception as e:
         # The scene will not be created if an exception is raised
         _log.debug(e)
         _log.error('Scene {} could not be created!'.format(yasara_scene_path))
         msg = 'Error creating YASARA scene'
+        exit_yasara()
         return False, msg
-    finally:
-        # Exit and close log
-        exit = exit_yasara()
+
+    # Exit and close log
+    exit = exit_yasara()
 
     if not exit:
         msg = 'Error terminating YASARA'
         return False, msg
 
+    return success, msg
+
+
+def check_ion_sites_log(yasara_log, ion_ligand_dict, slim=False):
+    """Checks the YASARA log of a metal ion sites scene.
+
+    slim tells whether hidden atoms were deleted from the scene.
+
+    Return a boolean indicating whether all commands were executed
+    Return also a string reporting the most important reason why things went
+        ok or went wrong.
+    """
     has_exit, num_lines = has_logged_exit(yasara_log)
     if not has_exit:
         msg = 'Error terminating YASARA: no Exit statement in YASARA log'
@@ -50,47 +74,69 @@ def ion_sites(pdb_file_path, yasara_scene_path, ion_ligand_dict,
     warned, warning, warn_count = has_logged_warning(yasara_log)
     if warned:
         num_lines = num_lines - warn_count
+    num_lines = num_lines - count_logged_cache_commands(yasara_log)
 
-    if not has_expected_log_count_ions(num_lines, ion_ligand_dict):
+    if not has_expected_log_count_ions(num_lines, ion_ligand_dict, slim):
         msg = 'Error creating YASARA scene:' \
             ' some commands could not be executed correctly'
         return False, msg
 
-    return success, msg
+    return True, 'Scene created'
 
 
 def symmetry_contacts(pdb_file_path, yasara_scene_path, symmetry_contacts_dict,
-                      yasara_pid, yasara_log):
+                      yasara_pid, yasara_log, n_threads=1, yob_path=None):
     """Creates a YASARA scene displaying crystal contacts.
 
+    The YASARA log is not checked, see check_ion_sites_log and
+    check_symmetry_contacts_log. The structure is loaded from, or cached in,
+    yob_path if it is given (see yobcache).
+
     Return a boolean indicating whether everything went succesful
     Return also a string reporting the most important reason why things went
         ok or went wrong.
+    Raise StageTimeout if a YASARA command took too long.
     """
     success = False
     try:
         # Set pid and open a log file
-        prepare_yasara(pid=yasara_pid, yasara_log=yasara_log)
+        prepare_yasara(pid=yasara_pid, yasara_log=yasara_log,
+                       n_threads=n_threads)
         # Create and save the scene
         create_sym_scene(pdb_path=pdb_file_path, sce_path=yasara_scene_path,
-                         sym_contacts=symmetry_contacts_dict)
+                         sym_contacts=symmetry_contacts_dict,
+                         yob_path=yob_path)
         msg = 'Scene created'
         success = True
-        _log.debug('{}: {}'.format(msg, yasara_scene_path))
+        _log.debug('%s: %s', msg, yasara_scene_path)
+    except StageTimeout:
+        # YASARA hangs and will not exit; it is killed by the watchdog
+        raise
     except Exception as e:
         # The scene will not be created if an exception is raised
         _log.debug(e)
         _log.error('Scene {} could not be created!'.format(yasara_scene_path))
         msg = 'Error creating YASARA scene'
+        exit_yasara()
         return False, msg
-    finally:
-        # Exit and close log
-        exit = exit_yasara()
+
+    # Exit and close log
+    exit = exit_yasara()
 
     if not exit:
         msg = 'Error terminating YASARA'
         return False, msg
 
+    return success, msg
+
+
+def check_symmetry_contacts_log(yasara_log, symmetry_contacts_dict):
+    """Checks the YASARA log of a crystal contacts scene.
+
+    Return a boolean indicating whether all commands were executed
+    Return also a string reporting the most important reason why things went
+        ok or went wrong.
+    """
     has_exit, num_lines = has_logged_exit(yasara_log)
     if not has_exit:
         msg = 'Error terminating YASARA: no Exit statement in YASARA log'
@@ -100,16 +146,18 @@ def symmetry_contacts(pdb_file_path, yasara_scene_path, symmetry_contacts_dict,
     if warned:
         _log.error(warn_count)
         num_lines = num_lines - warn_count
+    num_lines = num_lines - count_logged_cache_commands(yasara_log)
 
     if not has_expected_log_count_symm(num_lines, symmetry_contacts_dict):
         msg = 'Error creating YASARA scene:' \
             ' some commands could not be executed'
         return False, msg
 
-    return success, msg
+    return True, 'Scene created'
 
 
-def has_expected_log_count_ions(found_log_lines, ion_ligand_dict):
+def has_expected_log_count_ions(found_log_lines, ion_ligand_dict,
+                                slim=False):
     """Returns True if the number of found log lines equals the expected number.
 
     The expected number of logs is calculated as follows (pseudocode):
@@ -120,13 +168,14 @@ def has_expected_log_count_ions(found_log_lines, ion_ligand_dict):
                 +2 show, style
         +3 (color background, stick, ballstick)
         +10 (list alternate A, center, zoom, save, exit)
+        +3 if slim (count atoms, delete hidden atoms, count atoms)
     """
     head = 6
-    tail = 13
+    tail = 16 if slim else 13
     rest = 0
-    for l in ion_ligand_dict.itervalues():
+    for site in ion_ligand_dict.itervalues():
         rest = rest + 2
-        for ligres in l[1]:
+        for ligres in site.ligands:
             rest = rest + 2
     expected = head + rest + tail
 
@@ -134,8 +183,8 @@ def has_expected_log_count_ions(found_log_lines, ion_ligand_dict):
         _log.error('Number of log lines ({}) not equal to expected number of '
                    'log lines ({})'.format(found_log_lines, expected))
     else:
-        _log.debug('Number of log lines ({}) equal to expected number of '
-                   'log lines ({})'.format(found_log_lines, expected))
+        _log.debug('Number of log lines (%s) equal to expected number of '
+                   'log lines (%s)', found_log_lines, expected)
 
     return found_log_lines == expected
     return True
@@ -164,8 +213,8 @@ def has_expected_log_count_symm(found_log_lines, symmetry_contacts):
         _log.error('Number of log lines ({}) not equal to expected number of '
                    'log lines ({})'.format(found_log_lines, expected))
     else:
-        _log.debug('Number of log lines ({}) equal to expected number of '
-                   'log lines ({})'.format(found_log_lines, expected))
+        _log.debug('Number of log lines (%s) equal to expected number of '
+                   'log lines (%s)', found_log_lines, expected)
 
     return found_log_lines == expected
 
@@ -182,9 +231,9 @@ def has_logged_exit(yasara_log):
         with open(yasara_log + '.log', 'r') as f:
             for last_line in f:
                 num_lines = num_lines + 1
-            _log.debug('Log {}.log has {} lines'.format(yasara_log, num_lines))
+            _log.debug('Log %s.log has %s lines', yasara_log, num_lines)
             if re.search('^>Exit$', last_line):
-                _log.debug('Exit found in last line of {}'.format(yasara_log))
+                _log.debug('Exit found in last line of %s', yasara_log)
                 exit_present = True
     except IOError as e:
         _log.error(e)
@@ -214,8 +263,24 @@ def has_logged_warning(yasara_log, warning=None):
                 warning_present = True
                 warning = m.group(1)
                 warning_lines = warning.count('\n') + 1
-                _log.debug('WARNING found in {}: {}'.format(yasara_log,
-                                                            warning))
+                _log.debug('WARNING found in %s: %s', yasara_log, warning)
     except IOError as e:
         _log.error(e)
     return warning_present, warning, warning_lines
+
+
+RE_CACHE_COMMAND = re.compile('^>SaveYOb ', re.MULTILINE)
+
+
+def count_logged_cache_commands(yasara_log):
+    """Return the number of commands in the log that cached the structure.
+
+    These are not part of the expected number of log lines, as the structure
+    is only cached the first time it is loaded (see yobcache).
+    """
+    try:
+        with open(yasara_log + '.log', 'r') as f:
+            return len(RE_CACHE_COMMAND.findall(f.read()))
+    except IOError as e:
+        _log.error(e)
+    return 0
@@ -0,0 +1,123 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from argparse import Namespace
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.descriptor import (contact_color, describe, export,
+                                   read_atoms)
+from yas_scenes.parser import Atom, IonSite, Residue
+from yas_scenes.settings import settings
+
+
+PDB = """\
+ATOM      1  N   HIS A  94      11.000  12.000  13.000  1.00 20.00           N
+ATOM      2  NE2AHIS A  94      10.000  10.000  10.000  0.50 20.00           N
+ATOM      3  NE2BHIS A  94      10.500  10.500  10.500  0.50 20.00           N
+ATOM      4  ND1 HIS A  96A     10.000  10.000  10.000  1.00 20.00           N
+HETATM    5 ZN    ZN A 262       8.000   9.000  10.123  1.00 20.00          ZN
+ENDMDL
+HETATM    6 ZN    ZN A 262       0.000   0.000   0.000  1.00 20.00          ZN
+END
+"""
+
+CIF = """\
+data_1CRA
+#
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.label_atom_id
+_atom_site.label_alt_id
+_atom_site.Cartn_x
+_atom_site.Cartn_y
+_atom_site.Cartn_z
+_atom_site.auth_seq_id
+_atom_site.pdbx_PDB_ins_code
+_atom_site.auth_asym_id
+_atom_site.pdbx_PDB_model_num
+ATOM   1 N  N     . 11.0 12.0 13.0 94  ? A 1
+ATOM   2 O  "O3'" A 1.0  2.0  3.0  96  A A 1
+ATOM   3 O  "O3'" B 1.5  2.5  3.5  96  A A 1
+HETATM 4 ZN ZN    . 8.0  9.0  10.0 262 ? A 1
+HETATM 5 ZN ZN    . 0.0  0.0  0.0  262 ? A 2
+#
+"""
+
+HIS94 = Residue(94, '', 'A')
+HIS96A = Residue(96, 'A', 'A')
+ZN262 = Residue(262, '', 'A')
+ION_SITES = {ZN262: IonSite('ZN', [HIS94, HIS96A],
+                            {Atom('NE2', HIS94): 2.1,
+                             Atom('ND1', HIS96A): 2.0})}
+
+
+class TestDescriptor(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.pdb = os.path.join(self.path, 'pdb1cra.ent.gz')
+        with gzip.open(self.pdb, 'wb') as f:
+            f.write(PDB)
+        settings['PDB_SCENES_ROOT'] = os.path.join(self.path, 'scenes')
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        settings['PDB_SCENES_ROOT'] = 'scenes'
+
+    def test_read_pdb_atoms(self):
+        """Test that only the first model and alternate are read."""
+        atoms = read_atoms(self.pdb, set([HIS94, ZN262]))
+        eq_([['N', 'N', 11.0, 12.0, 13.0], ['NE2', 'N', 10.0, 10.0, 10.0]],
+            atoms[HIS94])
+        eq_([['ZN', 'ZN', 8.0, 9.0, 10.123]], atoms[ZN262])
+        ok_(HIS96A not in atoms)
+
+    def test_read_cif_atoms(self):
+        """Test that atoms are read from mmCIF files."""
+        cif = os.path.join(self.path, '1cra.cif')
+        with open(cif, 'w') as f:
+            f.write(CIF)
+        atoms = read_atoms(cif, set([HIS94, HIS96A, ZN262]))
+        eq_([["O3'", 'O', 1.0, 2.0, 3.0]], atoms[HIS96A])
+        eq_([['ZN', 'ZN', 8.0, 9.0, 10.0]], atoms[ZN262])
+
+    def test_describe_ion_sites(self):
+        """Test that ion sites get their atoms and distances."""
+        descriptor = describe('iod', '1cra', ION_SITES, self.pdb)
+        site = descriptor['sites'][0]
+        eq_('res 262 mol A', site['ion']['selection'])
+        eq_('ZN', site['ion']['name'])
+        eq_(['94 mol A', '96A mol A'],
+            [ligand['selection'] for ligand in site['ligands']])
+        eq_([['ND1', [96, 'A', 'A'], 2.0], ['NE2', [94, '', 'A'], 2.1]],
+            site['distances'])
+
+    def test_describe_nothing(self):
+        """Test that there is no descriptor if no residue is found."""
+        eq_(None, describe('ss2', '1cra', {Residue(1, '', 'B'): 3},
+                           self.pdb))
+
+    def test_contact_color(self):
+        eq_('ffff00', contact_color(0))
+        eq_('80807f', contact_color(5))
+        eq_('0000ff', contact_color(12))
+
+    def test_export(self):
+        """Test that the descriptor is written next to the scene."""
+        list_path = os.path.join('yas_scenes', 'tests', 'files',
+                                 '1cra.iod.bz2')
+        job = Namespace(pdb_file_path=self.pdb, pdb_id='1cra', source='PDB',
+                        mode='iod', iod=list_path)
+        ok_(export(job))
+        path = os.path.join(self.path, 'scenes', 'iod', '1cra',
+                            '1cra_ion-sites.json')
+        with open(path) as f:
+            descriptor = json.load(f)
+        eq_(1, descriptor['version'])
+        eq_([[262, '', 'A']],
+            [site['ion']['residue'] for site in descriptor['sites']])
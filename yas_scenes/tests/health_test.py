@@ -0,0 +1,98 @@
+import os
+import time
+from argparse import Namespace
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.batch import BatchRunner
+from yas_scenes.health import (MemoryMonitor, available_memory,
+                               estimate_memory, process_tree, tree_rss)
+from yas_scenes.settings import settings
+
+
+class SleepingPipeline(object):
+    """Pipeline whose render sleeps long enough to be killed."""
+
+    @staticmethod
+    def prepare(job):
+        pass
+
+    @staticmethod
+    def render(job):
+        time.sleep(10)
+        return True, 'Rendered'
+
+    @staticmethod
+    def finish(job, success, msg, finished=None):
+        job.msg = msg
+        if finished:
+            finished(job, success)
+        return success
+
+    @staticmethod
+    def publish():
+        pass
+
+
+def test_tree_rss():
+    """Test that the RSS of this process is found."""
+    eq_(os.getpid(), process_tree(os.getpid())[0])
+    ok_(tree_rss(os.getpid()) > 0)
+    ok_(available_memory() > 0)
+
+
+def test_admit():
+    """Test that a job is admitted if nothing runs or memory suffices."""
+    monitor = MemoryMonitor()
+    monitor.reserve = 0
+    running = [(None, Namespace(memory=estimate_memory(Namespace(cost=0)),
+                                rss=0))]
+    ok_(monitor.admit(Namespace(cost=10 ** 15), []))
+    ok_(not monitor.admit(Namespace(cost=10 ** 15), running))
+    ok_(monitor.admit(Namespace(cost=0), running))
+
+
+def test_memory_ceiling():
+    """Test that a job over the memory ceiling is killed."""
+    batch = settings.setdefault('BATCH', {})
+    batch['MEMORY_CEILING'] = 1
+    try:
+        iod = os.path.join('yas_scenes', 'tests', 'files', '1cra.iod.bz2')
+        job = Namespace(pdb_file_path=iod, pdb_id='1cra', mode='iod', iod=iod)
+        start = time.time()
+        eq_((0, 1), BatchRunner(SleepingPipeline, n_cores=1,
+                                first_ypid=1).run([job]))
+        ok_(time.time() - start < 5)
+        ok_(job.msg.startswith('Memory ceiling exceeded'))
+    finally:
+        batch['MEMORY_CEILING'] = None
+
+
+def test_estimate_memory():
+    """Test that atoms are counted instead of structure bytes if known."""
+    pdb = os.path.join('yas_scenes', 'tests', 'files', '1cra.iod')
+    job = Namespace(pdb_file_path=pdb, cost=os.path.getsize(pdb) + 2000)
+    small = estimate_memory(job)
+    job.n_atoms = 10 ** 6
+    ok_(estimate_memory(job) > small + 10 ** 9)
+
+
+def test_budget():
+    """Test that small jobs overtake a job that exceeds the memory budget,
+    until it has waited too long."""
+    runner = BatchRunner(SleepingPipeline, n_cores=2, first_ypid=1)
+    try:
+        runner.memory.budget = estimate_memory(Namespace(cost=10 ** 6)) * 2
+        runner.running = [(None, Namespace(memory=estimate_memory(
+            Namespace(cost=10 ** 6)), rss=0))]
+        large = Namespace(pdb_id='1mus', mode='iod', cost=10 ** 8)
+        small = Namespace(pdb_id='1cra', mode='iod', cost=10 ** 3)
+        runner.pending = [large, small]
+        runner.prefetch()
+        for job in runner.pending:
+            job.prepared.wait()
+        eq_(small, runner.next_job())
+        large.waiting_since = time.time() - runner.max_wait
+        eq_(None, runner.next_job())
+    finally:
+        runner.close()
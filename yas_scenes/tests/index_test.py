@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_raises, eq_
+
+from yas_scenes.index import ListIndex
+from yas_scenes.parser import (build_ion_sites, build_sym_contacts,
+                               parse_ion_sites, parse_sym_contacts)
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+class TestListIndex(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.list_dirs = {}
+        for mode, names in (('iod', ['1cra', '1mus']),
+                            ('ss2', ['103l', '1a02', '1a34'])):
+            list_dir = os.path.join(self.tmp_dir, mode)
+            os.makedirs(list_dir)
+            for name in names:
+                shutil.copy(os.path.join(FILES, '{}.{}.bz2'.format(name,
+                                                                    mode)),
+                            list_dir)
+            self.list_dirs[mode] = list_dir
+        self.index_dir = os.path.join(self.tmp_dir, 'index')
+        eq_(5, ListIndex(self.index_dir).update(self.list_dirs, 2))
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _path(self, mode, name):
+        return os.path.join(self.list_dirs[mode], '{}.{}.bz2'.format(name,
+                                                                      mode))
+
+    def test_load(self):
+        """Test that indexed lists equal parsed lists."""
+        index = ListIndex(self.index_dir)
+        for name in ('1cra', '1mus'):
+            path = self._path('iod', name)
+            eq_(parse_ion_sites(path),
+                build_ion_sites(index.load('iod', path)))
+        for name in ('103l', '1a02', '1a34'):
+            path = self._path('ss2', name)
+            eq_(parse_sym_contacts(path),
+                build_sym_contacts(index.load('ss2', path)))
+
+    def test_update_incremental(self):
+        """Test that only changed files are indexed again."""
+        path = self._path('ss2', '103l')
+        shutil.copy(self._path('ss2', '1a02'), path)
+        os.utime(path, (0, 0))
+        index = ListIndex(self.index_dir)
+        eq_(None, index.load('ss2', path))
+        eq_(1, index.update(self.list_dirs))
+        eq_(parse_sym_contacts(path),
+            build_sym_contacts(index.load('ss2', path)))
+
+    def test_compacted_by_other(self):
+        """Test that a reader sees the index compacted by another one."""
+        reader = ListIndex(self.index_dir)
+        path = self._path('ss2', '1a34')
+        eq_(parse_sym_contacts(path),
+            build_sym_contacts(reader.load('ss2', path)))
+
+        changed = self._path('ss2', '103l')
+        shutil.copy(self._path('ss2', '1a02'), changed)
+        os.utime(changed, (0, 0))
+        writer = ListIndex(self.index_dir)
+        writer.update(self.list_dirs)
+        writer.compact('ss2')
+        writer.save()
+        eq_(['ss2.num_contacts.1', 'ss2.res_chain.1', 'ss2.res_icode.1',
+             'ss2.res_num.1'],
+            sorted(name for name in os.listdir(self.index_dir)
+                   if name.startswith('ss2.')))
+
+        for path in (changed, path):
+            eq_(parse_sym_contacts(path),
+                build_sym_contacts(reader.load('ss2', path)))
+
+    def test_update_interrupted(self):
+        """Test that rows of an interrupted update are not used."""
+        changed = [self._path('ss2', name) for name in ('103l', '1a34')]
+        shutil.copy(self._path('ss2', '1a02'), changed[0])
+        os.utime(changed[0], (0, 0))
+
+        def interrupt(*args):
+            append(*args)
+            raise KeyboardInterrupt()
+
+        index = ListIndex(self.index_dir)
+        append = index._append
+        index._append = interrupt
+        assert_raises(KeyboardInterrupt, index.update, self.list_dirs, 1)
+
+        shutil.copy(os.path.join(FILES, '103l.ss2.bz2'), changed[1])
+        os.utime(changed[1], (0, 0))
+        index = ListIndex(self.index_dir)
+        eq_(2, index.update(self.list_dirs, 1))
+        for path in changed:
+            eq_(parse_sym_contacts(path),
+                build_sym_contacts(index.load('ss2', path)))
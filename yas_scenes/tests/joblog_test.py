@@ -0,0 +1,60 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.joblog import job_log
+
+
+_log = logging.getLogger(__name__)
+
+
+def _log_in_child():
+    _log.info('From the task process')
+
+
+class TestJobLog(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.handlers = list(logging.getLogger().handlers)
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name), 'r') as f:
+            return f.read().splitlines()
+
+    def test_jobs_have_own_logs(self):
+        """Test that messages of later jobs don't end up in earlier logs."""
+        for name in ('1crn', '1cra'):
+            with job_log(os.path.join(self.path, name), 'w'):
+                _log.info('Job %s', name)
+        eq_(['Job 1crn'], self._read('1crn'))
+        eq_(['Job 1cra'], self._read('1cra'))
+        eq_(self.handlers, logging.getLogger().handlers)
+
+    def test_other_threads_ignored(self):
+        """Test that messages of other threads are not in the job log."""
+        with job_log(os.path.join(self.path, '1crn'), 'w'):
+            t = threading.Thread(target=_log.info, args=('Other job',))
+            t.start()
+            t.join()
+            _log.info('This job')
+        eq_(['This job'], self._read('1crn'))
+
+    def test_forked_process(self):
+        """Test that messages of a forked process end up in the job log."""
+        with job_log(os.path.join(self.path, '1crn'), 'a'):
+            _log.info('Before')
+            p = multiprocessing.Process(target=_log_in_child)
+            p.start()
+            p.join()
+        lines = self._read('1crn')
+        ok_('Before' in lines)
+        ok_('From the task process' in lines)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from argparse import Namespace
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.batch import BatchRunner
+from yas_scenes.journal import Journal, job_key, resume
+from yas_scenes.tests.scheduler_test import FakePipeline
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+def _job(pdb_id, scene_path=None):
+    iod = os.path.join(FILES, '1cra.iod.bz2')
+    pdb = os.path.join(FILES, '1cra.iod')
+    return Namespace(pdb_file_path=pdb, pdb_id=pdb_id, mode='iod', iod=iod,
+                     scene_path=scene_path,
+                     job_args=[pdb, pdb_id, 'PDB', 'ion', iod])
+
+
+class TestJournal(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.journal = Journal(os.path.join(self.path, 'jobs.journal'), 0)
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_read(self):
+        """Test that the last state of a job counts and incomplete lines are
+        skipped."""
+        self.journal.open()
+        self.journal.record('started', _job('1cra', 'a.sce'))
+        self.journal.record('done', _job('1cra', 'a.sce'))
+        self.journal.record('started', _job('1mus', 'b.sce'))
+        self.journal.close()
+        with open(self.journal.path, 'a') as f:
+            f.write('failed\t1mus')
+        eq_({job_key(_job('1cra')): ('done', 'a.sce'),
+             job_key(_job('1mus')): ('started', 'b.sce')},
+            self.journal.read())
+
+    def test_resume(self):
+        """Test that finished jobs are skipped and the scenes of interrupted
+        jobs are deleted."""
+        scene_path = os.path.join(self.path, '1mus.sce')
+        open(scene_path, 'w').close()
+        jobs = [_job('1cra'), _job('1mus', scene_path), _job('1bad')]
+        self.journal.open()
+        self.journal.record('done', jobs[0])
+        self.journal.record('started', jobs[1])
+        self.journal.close()
+        eq_(jobs[1:], resume(jobs, self.journal))
+        ok_(not os.path.exists(scene_path))
+
+    def test_batch_runner(self):
+        """Test that the runner records all jobs and a resumed run does not
+        run them again."""
+        jobs = [_job(pdb_id) for pdb_id in ('1cra', '1mus', '1bad', '1dud')]
+        self.journal.open()
+        eq_((1, 3), BatchRunner(FakePipeline, n_cores=2, first_ypid=1,
+                                journal=self.journal).run(jobs))
+        self.journal.close()
+        states = sorted(s for s, p in self.journal.read().values())
+        eq_(['done', 'failed', 'failed', 'failed'], states)
+        eq_([], resume(jobs, self.journal))
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+from argparse import Namespace
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.lease import WorkDir
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+def _job(pdb_id):
+    iod = os.path.join(FILES, '{}.iod.bz2'.format(pdb_id))
+    return Namespace(pdb_file_path=iod, pdb_id=pdb_id, source='PDB',
+                     mode='iod', iod=iod, job_args=[iod, pdb_id, 'PDB', 'ion',
+                                                     iod])
+
+
+class TestWorkDir(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        WorkDir(self.path).submit([_job('1cra'), _job('1mus')])
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_claim_in_order(self):
+        """Test that jobs are claimed once, most expensive first."""
+        work_dir = WorkDir(self.path)
+        name, job_args = work_dir.claim()
+        ok_(name.endswith('_iod_PDB_1mus'))
+        eq_('1mus', job_args[1])
+        name, job_args = work_dir.claim()
+        ok_(name.endswith('_iod_PDB_1cra'))
+        eq_(None, work_dir.claim())
+
+    def test_submit_after_pending(self):
+        """Test that later jobs are claimed after the unfinished ones."""
+        work_dir = WorkDir(self.path)
+        work_dir.complete(work_dir.claim()[0], True)
+        work_dir.submit([_job('1mus')])
+        eq_(['00000001_iod_PDB_1cra', '00000002_iod_PDB_1mus'],
+            work_dir.pending())
+
+    def test_complete(self):
+        """Test that completed jobs are no longer pending."""
+        work_dir = WorkDir(self.path)
+        name, job_args = work_dir.claim()
+        work_dir.complete(name, True)
+        eq_(1, len(work_dir.pending()))
+        ok_(os.path.exists(os.path.join(self.path, 'done', name)))
+
+    def test_reclaim_expired(self):
+        """Test that an expired lease is reclaimed by another worker."""
+        work_dir = WorkDir(self.path)
+        name, job_args = work_dir.claim()
+        lease = os.path.join(self.path, 'leases', name)
+        old = time.time() - 2 * work_dir.ttl
+        os.utime(lease, (old, old))
+
+        other = WorkDir(self.path)
+        other.owner = 'other:1'
+        eq_(name, other.claim()[0])
+
+    def test_leases_checked_periodically(self):
+        """Test that leases are only checked for expiry now and then."""
+        work_dir = WorkDir(self.path)
+        name, job_args = work_dir.claim()
+        lease = os.path.join(self.path, 'leases', name)
+        old = time.time() - 2 * work_dir.ttl
+        os.utime(lease, (old, old))
+
+        other = WorkDir(self.path)
+        other.owner = 'other:1'
+        other.next_reclaim = time.time() + 60
+        ok_(other.claim()[0].endswith('_iod_PDB_1cra'))
+        other.next_reclaim = 0
+        eq_(name, other.claim()[0])
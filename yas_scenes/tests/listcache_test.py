@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.listcache import ParsedListCache
+from yas_scenes.parser import parse_ion_sites, parse_sym_contacts
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+def test_hit_and_miss():
+    """Test that a file is parsed once and then served from the cache."""
+    cache = ParsedListCache(10 ** 7)
+    path = os.path.join(FILES, '1cra.iod.bz2')
+    first = cache.get(parse_ion_sites, path)
+    ok_(first is cache.get(parse_ion_sites, path))
+    eq_(1, cache.stats()['hits'])
+    eq_(1, cache.stats()['misses'])
+
+
+def test_invalidate_changed_file():
+    """Test that a changed file is parsed again."""
+    cache = ParsedListCache(10 ** 7)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'x.ss2.bz2')
+        shutil.copy(os.path.join(FILES, '1a34.ss2.bz2'), path)
+        eq_(len(parse_sym_contacts(path)),
+            len(cache.get(parse_sym_contacts, path)))
+        shutil.copy(os.path.join(FILES, '103l.ss2.bz2'), path)
+        os.utime(path, (0, 0))
+        eq_(len(parse_sym_contacts(path)),
+            len(cache.get(parse_sym_contacts, path)))
+        eq_(2, cache.stats()['misses'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_evict_least_recently_used():
+    """Test that the least recently used entry is evicted."""
+    cache = ParsedListCache(1)
+    cra = os.path.join(FILES, '1cra.iod.bz2')
+    mus = os.path.join(FILES, '1mus.iod.bz2')
+    cache.get(parse_ion_sites, cra)
+    cache.get(parse_ion_sites, mus)
+    eq_(1, cache.stats()['entries'])
+    eq_(1, cache.stats()['evictions'])
+    cache.get(parse_ion_sites, mus)
+    eq_(1, cache.stats()['hits'])
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.pack import HEADER, RECORD, SceneArchive, Shard
+from yas_scenes.settings import settings
+
+
+class TestSceneArchive(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        settings['PDB_SCENES_ROOT'] = os.path.join(self.path, 'scenes')
+        self.archive_dir = os.path.join(self.path, 'pack')
+        self.scene_dir = os.path.join(self.path, 'scenes', 'iod', '1crn')
+        os.makedirs(self.scene_dir)
+        self.scene = os.path.join(self.scene_dir, '1crn_ion-sites.sce')
+        self._write(self.scene, 'scene')
+        self._write(os.path.join(self.scene_dir, '1crn_ion-sites.whynot'),
+                    'whynot')
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        settings['PDB_SCENES_ROOT'] = 'scenes'
+
+    def _write(self, path, data, mtime=1):
+        with open(path, 'w') as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def test_update(self):
+        """Test that files are packed once, and changes appended."""
+        eq_(2, SceneArchive(self.archive_dir).update('PDB'))
+        eq_(0, SceneArchive(self.archive_dir).update('PDB'))
+
+        self._write(self.scene, 'new scene', 2)
+        os.remove(os.path.join(self.scene_dir, '1crn_ion-sites.whynot'))
+        eq_(2, SceneArchive(self.archive_dir).update('PDB'))
+
+        archive = SceneArchive(self.archive_dir)
+        eq_('new scene', archive.get('PDB', 'iod', '1crn'))
+        eq_(None, archive.get('PDB', 'iod', '1crn', 'whynot'))
+        eq_(None, archive.get('PDB', 'ss2', '1crn'))
+
+    def test_compact(self):
+        """Test that replaced files are dropped when compacting."""
+        archive = SceneArchive(self.archive_dir)
+        archive.update('PDB')
+        self._write(self.scene, 'new scene', 2)
+        archive.update('PDB')
+        shard = Shard(os.path.join(self.archive_dir, 'PDB', 'cr'))
+        shard.compact()
+        eq_(len('new scene') + len('whynot'), os.path.getsize(shard.pack_path))
+        eq_(HEADER.size + 2 * RECORD.size, os.path.getsize(shard.idx_path))
+        eq_('whynot', shard.get('1crn', 'iod', 'whynot'))
+
+    def test_read_while_compacting(self):
+        """Test that a reader of the old index finds the compacted
+        archive."""
+        archive = SceneArchive(self.archive_dir)
+        archive.update('PDB')
+        self._write(self.scene, 'new scene', 2)
+        archive.update('PDB')
+        reader = Shard(os.path.join(self.archive_dir, 'PDB', 'cr'))
+        eq_('new scene', reader.get('1crn', 'iod'))
+        old_pack = reader.pack_path
+        Shard(os.path.join(self.archive_dir, 'PDB', 'cr')).compact()
+        ok_(not os.path.exists(old_pack))
+        eq_('new scene', reader.get('1crn', 'iod'))
+        eq_('whynot', reader.get('1crn', 'iod', 'whynot'))
+
+    def test_empty_file(self):
+        """Test that empty files are packed once, and removal recorded."""
+        self._write(self.scene, '')
+        archive = SceneArchive(self.archive_dir)
+        eq_(2, archive.update('PDB'))
+        eq_(0, archive.update('PDB'))
+        eq_('', archive.get('PDB', 'iod', '1crn'))
+        os.remove(self.scene)
+        eq_(1, archive.update('PDB'))
+        eq_(None, SceneArchive(self.archive_dir).get('PDB', 'iod', '1crn'))
+
+    def test_incomplete_record(self):
+        """Test that an incomplete index record is ignored."""
+        archive = SceneArchive(self.archive_dir)
+        archive.update('PDB')
+        shard = archive.shard('PDB', 'cr')
+        with open(shard.idx_path, 'ab') as f:
+            f.write('1crn')
+        shard.load()
+        eq_(2, shard.records)
+        self._write(self.scene, 'new scene', 2)
+        eq_(1, archive.update('PDB'))
+        eq_(HEADER.size + 3 * RECORD.size, os.path.getsize(shard.idx_path))
+        eq_('new scene', SceneArchive(self.archive_dir).get('PDB', 'iod',
+                                                            '1crn'))
@@ -3,12 +3,23 @@ import os
 
 from nose.tools import eq_, ok_, raises
 
-from yas_scenes.parser import (check_iod_line_regex, int_check_iod,
-                               check_ss2_line_regex, int_check_ss2,
-                               parse_iod_line, parse_ion_sites,
+from yas_scenes.parser import (Atom, Residue, check_iod_line_regex,
+                               int_check_iod, check_ss2_line_regex,
+                               int_check_ss2, parse_iod_line, parse_ion_sites,
                                parse_ss2_line, parse_sym_contacts)
 
 
+def ion_site_selections(ion_sites):
+    """Return parsed ion sites with YASARA selection strings for comparison
+    with the json files."""
+    return dict((ion.res_selection,
+                 [site.name,
+                  [r.selection for r in site.ligands],
+                  dict((a.selection, d)
+                       for a, d in site.distances.iteritems())])
+                for ion, site in ion_sites.iteritems())
+
+
 @raises(TypeError)
 def test_check_iod_line_regex_none():
     """Test that line cannot be None."""
@@ -175,67 +186,78 @@ def test_parse_iod_line_ok():
     line = '   93 HIS (  94 )A       NE2 -   262  ZN ( 262 )A      ' +\
            'ZN       2.191'
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 262 mol A', ion)
+    eq_('res 262 mol A', ion.res_selection)
     eq_('ZN', ion_name)
-    eq_('94 mol A', residue)
-    eq_('NE2 res 94 mol A', atom)
+    eq_('94 mol A', residue.selection)
+    eq_('NE2 res 94 mol A', atom.selection)
     eq_(2.191, dist)
 
     line = '  136 PRO ( 138 )A       N   -   263  HG ( 495 )A      ' +\
            'HG       4.063'
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 495 mol A', ion)
+    eq_('res 495 mol A', ion.res_selection)
     eq_('HG', ion_name)
-    eq_('138 mol A', residue)
-    eq_('N res 138 mol A', atom)
+    eq_('138 mol A', residue.selection)
+    eq_('N res 138 mol A', atom.selection)
     eq_(4.063, dist)
 
     line = "  251 SAM ( 501 )A       O3' -   259  NA ( 820 )A      " +\
            "NA       4.221"
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 820 mol A', ion)
+    eq_('res 820 mol A', ion.res_selection)
     eq_('NA', ion_name)
-    eq_('501 mol A', residue)
-    eq_("O3' res 501 mol A", atom)
+    eq_('501 mol A', residue.selection)
+    eq_("O3' res 501 mol A", atom.selection)
     eq_(4.221, dist)
 
     line = '  307 ASN ( 309 )A       O   -   832 K   (1419 )A       ' +\
            'K       2.757'
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 1419 mol A', ion)
+    eq_('res 1419 mol A', ion.res_selection)
     eq_('K', ion_name)
-    eq_('309 mol A', residue)
-    eq_('O res 309 mol A', atom)
+    eq_('309 mol A', residue.selection)
+    eq_('O res 309 mol A', atom.selection)
     eq_(2.757, dist)
 
     line = '    6 CGU (   6 )L      OE11 -   594  CA ( 505 )L      ' +\
            'CA       2.941'
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 505 mol L', ion)
+    eq_('res 505 mol L', ion.res_selection)
     eq_('CA', ion_name)
-    eq_('6 mol L', residue)
-    eq_('OE11 res 6 mol L', atom)
+    eq_('6 mol L', residue.selection)
+    eq_('OE11 res 6 mol L', atom.selection)
     eq_(2.941, dist)
 
     line = '  330 MSE ( 352 )A      SE   -  1844  MG ( 501 )A      ' +\
            'MG       4.268'
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 501 mol A', ion)
+    eq_('res 501 mol A', ion.res_selection)
     eq_('MG', ion_name)
-    eq_('352 mol A', residue)
-    eq_('SE res 352 mol A', atom)
+    eq_('352 mol A', residue.selection)
+    eq_('SE res 352 mol A', atom.selection)
     eq_(4.268, dist)
 
     line = '  363 GLU ( 326 )A       OE2 -   500  MN ( 478 )B   A  ' +\
            'MN       2.080'
     ion, ion_name, residue, atom, dist = parse_iod_line(line)
-    eq_('res 478 mol A', ion)
+    eq_('res 478 mol A', ion.res_selection)
     eq_('MN', ion_name)
-    eq_('326 mol A', residue)
-    eq_('OE2 res 326 mol A', atom)
+    eq_('326 mol A', residue.selection)
+    eq_('OE2 res 326 mol A', atom.selection)
     eq_(2.080, dist)
 
 
+def test_parse_iod_line_fields():
+    """Test that the structured fields of the iod line are kept."""
+    line = '  134 ASP (  97B)A       OD1 -   500  MN ( 478 )B   A  ' +\
+           'MN       3.494'
+    ion, ion_name, residue, atom, dist = parse_iod_line(line)
+    eq_(Residue(478, '', 'A'), ion)
+    eq_(Residue(97, 'B', 'A'), residue)
+    eq_(Atom('OD1', Residue(97, 'B', 'A')), atom)
+    eq_('97B mol A', residue.selection)
+
+
 @raises(IOError)
 def test_parse_ion_sites_ioerr_file_not_found():
     """Test that IOError is raised if file path is incorrect."""
@@ -276,11 +298,12 @@ def test_parse_ion_sites_1cra():
 
     result = parse_ion_sites(os.path.join('yas_scenes', 'tests', 'files',
                                           '1cra.iod.bz2'))
+    selections = ion_site_selections(result)
 
     eq_(len(ion_sites), len(result))
     for k, v in ion_sites.iteritems():
         ion = v
-        result_ion = result[k]
+        result_ion = selections[k]
         eq_(len(ion), len(result_ion))
         eq_(ion[0], result_ion[0])
         eq_(len(ion[1]), len(result_ion[1]))
@@ -305,11 +328,12 @@ def test_parse_ion_sites_1mus():
 
     result = parse_ion_sites(os.path.join('yas_scenes', 'tests', 'files',
                                           '1mus.iod.bz2'))
+    selections = ion_site_selections(result)
 
     eq_(len(ion_sites), len(result))
     for k, v in ion_sites.iteritems():
         ion = v
-        result_ion = result[k]
+        result_ion = selections[k]
         eq_(len(ion), len(result_ion))
         eq_(ion[0], result_ion[0])
         eq_(len(ion[1]), len(result_ion[1]))
@@ -464,37 +488,37 @@ def test_parse_ss2_line_ok():
     """Test that selection string and n_contacts are correctly returned."""
     line = '    1 MET (   1 )A              3       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('1 mol A', selection)
+    eq_('1 mol A', selection.selection)
     eq_(3, n_contacts)
 
     line = '   35 SER (  40A)A              0       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('40A mol A', selection)
+    eq_('40A mol A', selection.selection)
     eq_(0, n_contacts)
 
     line = '  160  CL ( 173 )A              2       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('173 mol A', selection)
+    eq_('173 mol A', selection.selection)
     eq_(2, n_contacts)
 
     line = '    1 DTHY(4001 )A              4       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('4001 mol A', selection)
+    eq_('4001 mol A', selection.selection)
     eq_(4, n_contacts)
 
     line = '  152 OADE(   5 )B             10       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('5 mol B', selection)
+    eq_('5 mol B', selection.selection)
     eq_(10, n_contacts)
 
     line = '    1 GLY (  -1 )A              0       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('-1 mol A', selection)
+    eq_('-1 mol A', selection.selection)
     eq_(0, n_contacts)
 
     line = '  805 FAR (2010 )P   B          0       '
     selection, n_contacts = parse_ss2_line(line)
-    eq_('2010 mol B', selection)
+    eq_('2010 mol B', selection.selection)
     eq_(0, n_contacts)
 
 
@@ -539,8 +563,9 @@ def test_parse_symm_contacts_103l():
     result = parse_sym_contacts(os.path.join('yas_scenes', 'tests', 'files',
                                              '103l.ss2.bz2'))
     eq_(len(symm_contacts), len(result))
+    selections = dict((r.selection, n) for r, n in result.iteritems())
     for k, v in symm_contacts.iteritems():
-        eq_(result[k], v)
+        eq_(selections[k], v)
 
 
 def test_parse_symm_contacts_1a02():
@@ -558,8 +583,9 @@ def test_parse_symm_contacts_1a02():
     result = parse_sym_contacts(os.path.join('yas_scenes', 'tests', 'files',
                                              '1a02.ss2.bz2'))
     eq_(len(symm_contacts), len(result))
+    selections = dict((r.selection, n) for r, n in result.iteritems())
     for k, v in symm_contacts.iteritems():
-        eq_(result[k], v)
+        eq_(selections[k], v)
 
 
 def test_parse_symm_contacts_1a34():
@@ -577,5 +603,6 @@ def test_parse_symm_contacts_1a34():
     result = parse_sym_contacts(os.path.join('yas_scenes', 'tests', 'files',
                                              '1a34.ss2.bz2'))
     eq_(len(symm_contacts), len(result))
+    selections = dict((r.selection, n) for r, n in result.iteritems())
     for k, v in symm_contacts.iteritems():
-        eq_(result[k], v)
+        eq_(selections[k], v)
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.parser import Atom, IonSite, Residue
+from yas_scenes.preflight import preflight, scan_residues, scan_structure
+
+
+PDB = """\
+ATOM      1  N   HIS A  94      10.000  10.000  10.000  1.00 20.00           N
+ATOM      2  NE2 HIS A  94      10.000  10.000  10.000  1.00 20.00           N
+ATOM      3  ND1 HIS A  96A     10.000  10.000  10.000  1.00 20.00           N
+HETATM    4 ZN    ZN A 262      10.000  10.000  10.000  1.00 20.00          ZN
+END
+"""
+
+CIF = """\
+data_1CRA
+#
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.label_atom_id
+_atom_site.auth_seq_id
+_atom_site.pdbx_PDB_ins_code
+_atom_site.auth_asym_id
+ATOM   1 N   94  ? A
+ATOM   2 "O3'" 96 A A
+HETATM 3 ZN  262 ? A
+#
+"""
+
+HIS94 = Residue(94, '', 'A')
+HIS96A = Residue(96, 'A', 'A')
+ZN262 = Residue(262, '', 'A')
+
+
+class TestPreflight(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.pdb = os.path.join(self.path, '1cra.pdb')
+        with open(self.pdb, 'w') as f:
+            f.write(PDB)
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_scan_pdb(self):
+        """Test that residues are found in PDB files."""
+        eq_(set([HIS94, HIS96A, ZN262]), scan_residues(self.pdb))
+        eq_(4, scan_structure(self.pdb)[1])
+
+    def test_scan_cif(self):
+        """Test that residues are found in mmCIF files."""
+        cif = os.path.join(self.path, '1cra.cif')
+        with open(cif, 'w') as f:
+            f.write(CIF)
+        eq_(set([HIS94, HIS96A, ZN262]), scan_residues(cif))
+        eq_(3, scan_structure(cif)[1])
+
+    def test_empty_list(self):
+        """Test that a job with an empty list is doomed."""
+        parsed, doomed, n_atoms = preflight('iod', {}, self.pdb)
+        ok_(doomed)
+
+    def test_drop_missing(self):
+        """Test that missing ligands and ions are dropped."""
+        missing = Residue(100, '', 'B')
+        ion_sites = {
+            ZN262: IonSite('ZN', [HIS94, missing],
+                           {Atom('NE2', HIS94): 2.1,
+                            Atom('OD1', missing): 2.0}),
+            Residue(263, '', 'A'): IonSite('ZN', [HIS94],
+                                           {Atom('NE2', HIS94): 2.2})}
+        parsed, doomed, n_atoms = preflight('iod', ion_sites, self.pdb)
+        eq_(None, doomed)
+        eq_(4, n_atoms)
+        eq_([ZN262], parsed.keys())
+        eq_([HIS94], parsed[ZN262].ligands)
+        eq_({Atom('NE2', HIS94): 2.1}, parsed[ZN262].distances)
+
+    def test_nothing_left(self):
+        """Test that a job without residues in the structure is doomed."""
+        parsed, doomed, n_atoms = preflight('ss2', {Residue(1, '', 'B'): 3},
+                                            self.pdb)
+        eq_({}, parsed)
+        ok_(doomed)
@@ -0,0 +1,31 @@
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from nose.tools import ok_
+
+from yas_scenes import profiling
+from yas_scenes.parser import parse_ion_sites
+
+
+class TestProfiling(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        profiling._profile_dir = None
+
+    def test_report(self):
+        """Test that profiles are merged into one report per module."""
+        profiling.enable(self.path)
+        for i in range(2):
+            with profiling.profiled('1cra_iod_prepare'):
+                parse_ion_sites('yas_scenes/tests/files/1cra.iod.bz2')
+        out = StringIO()
+        profiling.report(self.path, out)
+        report = out.getvalue()
+        ok_('Merged 2 profiles' in report)
+        ok_('parse_iod_line' in report)
+        ok_('Top 0 functions in scenes' in report)
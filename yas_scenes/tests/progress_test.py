@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from argparse import Namespace
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.progress import Progress
+
+
+def _job(ypid, cost, threads=1):
+    return Namespace(ypid=ypid, cost=cost, threads=threads)
+
+
+class TestProgress(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.status_path = os.path.join(self.path, 'status.json')
+        self.progress = Progress(4, self.status_path, 30, [60])
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_status(self):
+        """Test that jobs are counted and the ETA follows the cost."""
+        jobs = [_job(1, 300), _job(2, 100), _job(3, 600)]
+        self.progress.add(jobs)
+        self.progress.start_time = time.time() - 10
+        for job in jobs:
+            self.progress.preparing(job)
+        for job in jobs[:2]:
+            self.progress.started(job)
+        self.progress.rendered(jobs[0])
+        self.progress.finished(jobs[0], True)
+
+        status = self.progress.status()
+        eq_(3, status['jobs'])
+        eq_(1, status['done'])
+        eq_(2, status['in_flight'])
+        eq_(1, status['rendering'])
+        eq_(2, status['remaining'])
+        eq_(700, status['remaining_cost'])
+        # 300 cost in 10 s: 700 cost takes about 23 s
+        ok_(20 <= status['eta'] <= 24, status['eta'])
+        ok_(5 <= status['scenes_per_minute']['60'] <= 6)
+        eq_(['1', '2'], sorted(status['worker_utilisation']))
+
+    def test_not_rendered(self):
+        """Test that jobs finished without rendering don't speed up the
+        ETA."""
+        jobs = [_job(1, 300), _job(2, 100), _job(3, 600)]
+        self.progress.add(jobs)
+        self.progress.start_time = time.time() - 10
+        self.progress.started(jobs[0])
+        self.progress.rendered(jobs[0])
+        self.progress.finished(jobs[0], True)
+        self.progress.finished(jobs[2], True)
+
+        status = self.progress.status()
+        eq_(2, status['done'])
+        eq_(100, status['remaining_cost'])
+        ok_(3 <= status['eta'] <= 4, status['eta'])
+        ok_(5 <= status['scenes_per_minute']['60'] <= 6)
+
+    def test_write(self):
+        """Test that the status file is written on report."""
+        self.progress.add([_job(1, 300)])
+        self.progress.report(force=True)
+        with open(self.status_path, 'r') as f:
+            status = json.load(f)
+        eq_(1, status['remaining'])
+        eq_(None, status['eta'])
+        eq_(['status.json'], os.listdir(self.path))
@@ -0,0 +1,60 @@
+import os
+
+from nose.tools import eq_, ok_, raises
+
+from yas_scenes.index import to_row
+from yas_scenes.parser import parse_iod_line, parse_ss2_line, read_list
+from yas_scenes.query import Predicate, summarize
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+def _summary(mode, name):
+    parse_line = parse_iod_line if mode == 'iod' else parse_ss2_line
+    path = os.path.join(FILES, '{}.{}.bz2'.format(name, mode))
+    return summarize(mode, [to_row(mode, p)
+                            for p in read_list(path, parse_line)])
+
+
+def test_summarize_iod():
+    """Test the summary of 1cra: a ZN and a HG site in chain A."""
+    summary = _summary('iod', '1cra')
+    eq_(set(['ZN', 'HG']), summary['ion'])
+    eq_(set(['A']), summary['chain'])
+    eq_(2, summary['sites'])
+
+
+def test_predicate_names():
+    """Test conditions on names."""
+    summary = _summary('iod', '1cra')
+    ok_(Predicate('iod', 'ion=hg,cd').matches(summary))
+    ok_(not Predicate('iod', 'ion=CD').matches(summary))
+    ok_(Predicate('iod', 'ion!=CD').matches(summary))
+
+
+def test_predicate_chains():
+    """Test that chain IDs are case-sensitive."""
+    summary = {'chain': set(['A', 'a'])}
+    ok_(Predicate('ss2', 'chain=a').matches(summary))
+    ok_(not Predicate('ss2', 'chain=b').matches(summary))
+    ok_(Predicate('ss2', 'chain!=B').matches(summary))
+
+
+def test_predicate_counts():
+    """Test conditions on counts."""
+    summary = _summary('ss2', '103l')
+    ok_(Predicate('ss2', 'contacts>10').matches(summary))
+    ok_(not Predicate('ss2', 'contacts > 1000').matches(summary))
+
+
+@raises(ValueError)
+def test_predicate_unknown_field():
+    """Test that fields of the other list type are refused."""
+    Predicate('ss2', 'ion=ZN')
+
+
+@raises(ValueError)
+def test_predicate_name_comparison():
+    """Test that names can't be compared by order."""
+    Predicate('iod', 'ion>ZN')
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.scenestore import (evict_scenes, put, remove_orphans,
+                                   restore, scene_key)
+from yas_scenes.settings import settings
+from yas_scenes.utils import Evictor, content_hash
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+class TestSceneStore(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.scene = os.path.join(self.path, '1cra_ion-sites.sce')
+        with open(self.scene, 'w') as f:
+            f.write('scene')
+        self.iod = os.path.join(FILES, '1cra.iod.bz2')
+        self.key = scene_key(content_hash(os.path.join(FILES, '1cra.iod')),
+                             self.iod, 'iod')
+        settings['SCENE_STORE'] = {'DIR': os.path.join(self.path, 'store')}
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        settings['SCENE_STORE'] = {}
+
+    def test_scene_key(self):
+        """Test that keys differ by inputs and scene options."""
+        structure_hash = content_hash(os.path.join(FILES, '1cra.iod'))
+        eq_(self.key, scene_key(structure_hash, self.iod, 'iod'))
+        ok_(self.key != scene_key(structure_hash, self.iod, 'iod', True))
+        ok_(self.key != scene_key(structure_hash, self.iod, 'ss2'))
+        ok_(self.key != scene_key(structure_hash,
+                                  os.path.join(FILES, '1mus.iod.bz2'), 'iod'))
+
+    def test_put_restore(self):
+        """Test that stored scenes are restored as hard links."""
+        restored = os.path.join(self.path, 'restored.sce')
+        ok_(not restore(self.key, restored))
+        ok_(put(self.key, self.scene))
+        ok_(not put(self.key, self.scene))
+        ok_(restore(self.key, restored))
+        eq_(os.stat(self.scene).st_ino, os.stat(restored).st_ino)
+
+    def test_disabled(self):
+        """Test that nothing is stored without a store dir."""
+        settings['SCENE_STORE'] = {}
+        ok_(not put(self.key, self.scene))
+        ok_(not restore(self.key, self.scene))
+
+    def test_gc(self):
+        """Test that orphaned scenes are evicted first."""
+        put(self.key, self.scene)
+        orphan = os.path.join(self.path, 'orphan.sce')
+        with open(orphan, 'w') as f:
+            f.write('scene')
+        put('0' * 40, orphan)
+        os.remove(orphan)
+        eq_(1, evict_scenes(5))
+        ok_(restore(self.key, orphan))
+        eq_(0, remove_orphans())
+        os.remove(orphan)
+        os.remove(self.scene)
+        eq_(1, remove_orphans())
+
+    def test_evictor(self):
+        """Test that files are evicted, down to 90%, once the maximum is
+        exceeded."""
+        evictor = Evictor(self.path, '.sce')
+        eq_(0, evictor.added(5, 100))
+        eq_(5, evictor.total)
+        for i in xrange(3):
+            path = os.path.join(self.path, '{}.sce'.format(i))
+            with open(path, 'w') as f:
+                f.write('x' * 40)
+            os.utime(path, (i, i))
+            evictor.added(40, 100)
+        eq_(['1.sce', '2.sce'], sorted(name for name in os.listdir(self.path)
+                                       if name.endswith('.sce')
+                                       and name != '1cra_ion-sites.sce'))
+        eq_(85, evictor.total)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from argparse import Namespace
+
+from nose.tools import eq_
+
+from yas_scenes.batch import BatchRunner
+from yas_scenes import index
+from yas_scenes.scheduler import (BZ2_LINE_BYTES, LIST_LINE_COST,
+                                  estimate_cost, estimate_lines, order_jobs,
+                                  threads_for)
+
+
+FILES = os.path.join('yas_scenes', 'tests', 'files')
+
+
+def _job(pdb_file, iod_file):
+    return Namespace(pdb_file_path=os.path.join(FILES, pdb_file),
+                     pdb_id=pdb_file[:4], mode='iod',
+                     iod=os.path.join(FILES, iod_file))
+
+
+class FakePipeline(object):
+    """Pipeline that renders 1cra only, fails to prepare 1bad and dooms
+    1dud."""
+
+    @staticmethod
+    def prepare(job):
+        if job.pdb_id == '1bad':
+            raise IOError('Cannot stage 1bad')
+        if job.pdb_id == '1dud':
+            return False, 'Nothing to show'
+
+    @staticmethod
+    def render(job):
+        assert job.pdb_id != '1dud'
+        return job.pdb_id == '1cra', 'Rendered'
+
+    @staticmethod
+    def finish(job, success, msg, finished=None):
+        if finished:
+            finished(job, success)
+        return success
+
+    @staticmethod
+    def publish():
+        pass
+
+
+def test_estimate_cost():
+    """Test that the cost combines structure size and list lines."""
+    job = _job('1cra.iod', '1cra.iod.bz2')
+    lines = os.path.getsize(job.iod) // BZ2_LINE_BYTES
+    eq_(lines, estimate_lines('iod', job.iod))
+    eq_(os.path.getsize(job.pdb_file_path) + lines * LIST_LINE_COST,
+        estimate_cost(job))
+
+
+def test_estimate_lines_indexed():
+    """Test that the number of lines is taken from the list index."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        list_dir = os.path.join(tmp_dir, 'iod')
+        os.makedirs(list_dir)
+        path = os.path.join(list_dir, '1cra.iod.bz2')
+        shutil.copy(os.path.join(FILES, '1cra.iod.bz2'), path)
+        index._index = index.ListIndex(os.path.join(tmp_dir, 'index'))
+        index._index.update({'iod': list_dir}, 1)
+        eq_(7, estimate_lines('iod', path))
+    finally:
+        index._index = None
+        shutil.rmtree(tmp_dir)
+
+
+def test_threads_for():
+    """Test that expensive jobs get more threads, up to the maximum."""
+    eq_(1, threads_for(0, 16))
+    eq_(2, threads_for(20000000, 16))
+    eq_(4, threads_for(10 ** 10, 16))
+    eq_(2, threads_for(10 ** 10, 2))
+    eq_(2, threads_for(0, 16, 2))
+    eq_(2, threads_for(10 ** 10, 2, 4))
+
+
+def test_order_jobs():
+    """Test that the most expensive job comes first."""
+    small = _job('1cra.iod', '1cra.iod.bz2')
+    large = _job('1mus.iod', '1mus.iod.bz2')
+    eq_([large, small], order_jobs([small, large]))
+
+
+def test_batch_runner():
+    """Test that all jobs are run and failures are counted."""
+    jobs = [_job('1cra.iod', '1cra.iod.bz2'), _job('1mus.iod', '1mus.iod.bz2')]
+    for pdb_id in ('1bad', '1dud'):
+        job = _job('1cra.iod', '1cra.iod.bz2')
+        job.pdb_id = pdb_id
+        jobs.append(job)
+    eq_((1, 3), BatchRunner(FakePipeline, n_cores=2, first_ypid=1).run(jobs))
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+from argparse import Namespace
+
+from nose.tools import assert_raises, eq_, ok_
+
+from yas_scenes.scratch import (Publisher, enter_scratch, publish,
+                                published_path)
+from yas_scenes.settings import settings
+
+
+class TestScratch(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.scene_dir = os.path.join(self.path, 'scenes', 'iod', '1cra')
+        settings['SCRATCH'] = {'DIR': os.path.join(self.path, 'scratch')}
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        settings['SCRATCH'] = {}
+
+    def _job(self):
+        paths = [os.path.join(self.scene_dir, name) for name in (
+            '1cra_ion-sites.sce', 'scenes_1cra_ion-sites.log',
+            '1cra_ion-sites', '1cra_ion-sites.whynot')]
+        job = Namespace(mode='iod', pdb_id='1cra', scene_path=paths[0],
+                        log_path=paths[1], yas_log_path=paths[2],
+                        wn_file=paths[3])
+        ok_(enter_scratch(job))
+        for path in (job.scene_path, job.log_path, job.yas_log_path + '.log'):
+            with open(path, 'w') as f:
+                f.write('output')
+        return job
+
+    def test_disabled(self):
+        """Test that jobs write to their scene dir without scratch dir."""
+        settings['SCRATCH'] = {}
+        scene_path = os.path.join(self.scene_dir, '1cra_ion-sites.sce')
+        job = Namespace(mode='iod', pdb_id='1cra', scene_path=scene_path)
+        ok_(not enter_scratch(job))
+        eq_(scene_path, job.scene_path)
+        eq_(scene_path, published_path(job))
+
+    def test_publish(self):
+        """Test that all output files are moved to the scene dir."""
+        job = self._job()
+        ok_(not job.scene_path.startswith(self.scene_dir))
+        eq_(os.path.join(self.scene_dir, '1cra_ion-sites.sce'),
+            published_path(job))
+        publish(job)
+        eq_(['1cra_ion-sites.log', '1cra_ion-sites.sce',
+             'scenes_1cra_ion-sites.log'], sorted(os.listdir(self.scene_dir)))
+        ok_(not os.path.exists(job.scratch_dir))
+
+    def test_publish_lost(self):
+        """Test that a file that can't be published leaves no temporary
+        file, and the other files are still published."""
+        job = self._job()
+        os.makedirs(os.path.join(self.scene_dir, '1cra_ion-sites.sce'))
+        with assert_raises(IOError) as cm:
+            publish(job)
+        ok_('1cra_ion-sites.sce' in str(cm.exception))
+        eq_(['1cra_ion-sites.log', '1cra_ion-sites.sce',
+             'scenes_1cra_ion-sites.log'], sorted(os.listdir(self.scene_dir)))
+        ok_(not os.path.exists(job.scratch_dir))
+
+    def test_publisher(self):
+        """Test that jobs are published in batches."""
+        published = []
+        publisher = Publisher(batch_size=10, interval=60)
+        for pdb_id in ('1cra', '1mus'):
+            job = self._job()
+            job.pdb_id = pdb_id
+            publisher.add(job, lambda job, success: published.append(
+                (job.pdb_id, success)))
+        eq_([], published)
+        eq_(2, publisher.flush())
+        eq_([('1cra', True), ('1mus', True)], published)
+
+    def test_publish_failed(self):
+        """Test that jobs whose files could not be published fail."""
+        published = []
+        publisher = Publisher(batch_size=10, interval=60)
+        job = self._job()
+        shutil.rmtree(job.scratch_dir)
+        publisher.add(job, lambda job, success: published.append(success))
+        publisher.flush()
+        eq_([False], published)
@@ -0,0 +1,41 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.structure import staged_structure, structure_format
+
+
+def test_structure_format():
+    """Test that the format is derived from the file name extension."""
+    eq_('pdb', structure_format('pdb1crn.ent'))
+    eq_('pdb', structure_format('pdb1crn.ent.gz'))
+    eq_('pdb', structure_format('1crn'))
+    eq_('cif', structure_format('1crn.cif'))
+    eq_('cif', structure_format('1CRN.CIF.GZ'))
+
+
+def test_staged_structure_uncompressed():
+    """Test that uncompressed files are used as is."""
+    with staged_structure('1crn.pdb') as path:
+        eq_('1crn.pdb', path)
+
+
+def test_staged_structure_gzipped():
+    """Test that gzipped files are staged and removed afterwards."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        gz_path = os.path.join(tmp_dir, '1crn.cif.gz')
+        f = gzip.open(gz_path, 'wb')
+        f.write('data_1CRN\n')
+        f.close()
+
+        with staged_structure(gz_path, staging_dir=tmp_dir) as path:
+            ok_(path.endswith('.cif'))
+            with open(path, 'r') as staged:
+                eq_('data_1CRN\n', staged.read())
+        ok_(not os.path.exists(path))
+    finally:
+        shutil.rmtree(tmp_dir)
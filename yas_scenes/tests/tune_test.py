@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.listcache import get_cache
+from yas_scenes.settings import settings
+from yas_scenes.tests.scheduler_test import FakePipeline, _job
+from yas_scenes.tune import (doubling, grid, sample_jobs, trial_settings,
+                             tune, write_settings)
+
+
+def test_doubling():
+    eq_([1], doubling(1))
+    eq_([1, 2, 4], doubling(4))
+    eq_([1, 2, 4, 6], doubling(6))
+
+
+def test_grid():
+    """Test that configurations never use more threads than cpus."""
+    eq_([(1, 1), (2, 1), (4, 1), (1, 2), (2, 2), (1, 4)], grid(4))
+    eq_([(2, 1), (2, 2)], grid(4, [2, 8], [1, 2]))
+    eq_([], grid(4, [8], [1]))
+
+
+def test_sample_jobs():
+    """Test that the sample spreads over cheap and expensive jobs."""
+    jobs = [_job('1mus.iod', '1mus.iod.bz2')] + \
+        [_job('1cra.iod', '1cra.iod.bz2') for _ in xrange(3)]
+    eq_(['1mus', '1cra'], [job.pdb_id for job in sample_jobs(jobs, 2)])
+    eq_(4, len(sample_jobs(jobs, 10)))
+
+
+def test_tune():
+    """Test that every configuration is tried and the settings restored."""
+    root = settings['PDB_SCENES_ROOT']
+    best, rates = tune(FakePipeline,
+                       lambda: [_job('1cra.iod', '1cra.iod.bz2')],
+                       [(1, 1), (2, 1)], first_ypid=1)
+    ok_(best in rates)
+    eq_([(1, 1), (2, 1)], sorted(rates))
+    eq_(root, settings['PDB_SCENES_ROOT'])
+
+
+def test_trial_settings():
+    """Test that settings are restored, and missing ones stay missing."""
+    store = settings.pop('SCENE_STORE')
+    try:
+        get_cache().entries['list'] = (None, 1, {})
+        with trial_settings('/tmp/scenes'):
+            eq_({}, settings['SCENE_STORE'])
+            eq_(0, len(get_cache().entries))
+        ok_('SCENE_STORE' not in settings)
+        eq_('scenes', settings['PDB_SCENES_ROOT'])
+    finally:
+        settings['SCENE_STORE'] = store
+
+
+class TestWriteSettings(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.settings_path = os.path.join(self.path, 'settings.json')
+        with open(self.settings_path, 'w') as f:
+            f.write('{"YASARA_DIR": "/yasara", "BATCH": {"CORES": null, '
+                    '"FIRST_YPID": 1000}, "RETRIES": 2}')
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_write_settings(self):
+        """Test that CORES and THREADS are set and other settings kept."""
+        write_settings(self.settings_path, 4, 2)
+        with open(self.settings_path) as f:
+            text = f.read()
+        eq_({'YASARA_DIR': '/yasara', 'RETRIES': 2,
+             'BATCH': {'CORES': 8, 'FIRST_YPID': 1000, 'THREADS': 2}},
+            json.loads(text))
+        ok_(text.index('YASARA_DIR') < text.index('BATCH') <
+            text.index('RETRIES'))
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import time
+from argparse import Namespace
+
+from nose.tools import assert_raises, eq_
+
+from yas_scenes.settings import settings
+from yas_scenes.watch import ChangeFeed, ListPoller, Watcher
+
+
+FILES = os.path.abspath(os.path.join('yas_scenes', 'tests', 'files'))
+
+
+def _parse_job(job_args):
+    structure, pdb_id, source, command, path = job_args
+    return Namespace(pdb_file_path=path, pdb_id=pdb_id, source=source,
+                     mode='iod' if command == 'ion' else 'ss2', iod=path,
+                     ss2=path, job_args=job_args)
+
+
+class TestWatch(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.feed = os.path.join(self.path, 'changes')
+        self.list_files = settings.get('LIST_FILES')
+        settings['LIST_FILES'] = {
+            'iod': os.path.join(FILES, '{pdb_id}.iod.bz2'),
+            'ss2': os.path.join(FILES, '{pdb_id}.ss2.bz2')}
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        settings['LIST_FILES'] = self.list_files
+
+    def _append(self, text):
+        with open(self.feed, 'a') as f:
+            f.write(text)
+
+    def test_feed(self):
+        """Test that every complete line of the feed is read once."""
+        self._append('added 1crn\nbogus\nmodified 1CRA\nadded 1m')
+        feed = ChangeFeed(self.feed)
+        changes, offset = feed.read()
+        eq_([('added', '1crn'), ('modified', '1cra')], changes)
+        eq_(changes, ChangeFeed(self.feed).read()[0])
+        feed.save(offset)
+        self._append('us\n')
+        changes, offset = feed.read()
+        eq_([('added', '1mus')], changes)
+        feed.save(offset)
+        eq_([], ChangeFeed(self.feed).read()[0])
+
+    def test_poller(self):
+        """Test that new list files are found after the first poll."""
+        list_dir = os.path.join(self.path, 'iod')
+        os.makedirs(list_dir)
+        poller = ListPoller({'iod': list_dir})
+
+        def read():
+            changes, snapshot = poller.read()
+            poller.save(snapshot)
+            return changes
+
+        eq_([], read())
+        shutil.copy(os.path.join(FILES, '1cra.iod.bz2'), list_dir)
+        eq_([('added', '1cra')], read())
+        os.remove(os.path.join(list_dir, '1cra.iod.bz2'))
+        eq_([('obsoleted', '1cra')], read())
+
+    def test_submit(self):
+        """Test that jobs are submitted for existing lists, once."""
+        self._append('added 1cra\nmodified 103l\nadded 1cra\n')
+        watcher = Watcher(os.path.join(self.path, 'work'), 'PDB', _parse_job,
+                          [ChangeFeed(self.feed)])
+        eq_(2, watcher.check())
+        eq_(['iod_PDB_1cra', 'ss2_PDB_103l'],
+            sorted(n.split('_', 1)[1] for n in watcher.work_dir.pending()))
+        self._append('modified 1cra\n')
+        eq_(0, watcher.check())
+
+    def test_submit_failed(self):
+        """Test that changes are read again if submitting failed."""
+        self._append('added 1cra\n')
+        watcher = Watcher(os.path.join(self.path, 'work'), 'PDB', _parse_job,
+                          [ChangeFeed(self.feed)])
+
+        def submit(jobs):
+            raise IOError('Cannot submit')
+
+        watcher.work_dir.submit = submit
+        assert_raises(IOError, watcher.check)
+        watcher = Watcher(os.path.join(self.path, 'work'), 'PDB', _parse_job,
+                          [ChangeFeed(self.feed)])
+        eq_(1, watcher.check())
+
+    def test_wait_for_list(self):
+        """Test that an added entry waits for its list file, also after a
+        restart."""
+        list_dir = os.path.join(self.path, 'iod')
+        os.makedirs(list_dir)
+        settings['LIST_FILES'] = {
+            'iod': os.path.join(list_dir, '{pdb_id}.iod.bz2')}
+        self._append('added 1cra\n')
+        work_dir = os.path.join(self.path, 'work')
+        eq_(0, Watcher(work_dir, 'PDB', _parse_job,
+                       [ChangeFeed(self.feed)]).check())
+
+        shutil.copy(os.path.join(FILES, '1cra.iod.bz2'), list_dir)
+        watcher = Watcher(work_dir, 'PDB', _parse_job,
+                          [ChangeFeed(self.feed)])
+        eq_(1, watcher.check())
+        eq_(['iod_PDB_1cra'],
+            [n.split('_', 1)[1] for n in watcher.work_dir.pending()])
+        eq_([('ss2', '1cra')], watcher.waiting.keys())
+
+        watcher.list_wait = 0
+        time.sleep(0.01)
+        eq_(0, watcher.check())
+        eq_({}, watcher.waiting)
@@ -0,0 +1,41 @@
+import time
+
+from nose.tools import eq_, raises
+
+from yas_scenes.settings import settings
+from yas_scenes.watchdog import (JobTimeout, StageTimeout, run_with_timeout,
+                                 stage_timeout)
+
+
+def _add(a, b):
+    return a + b
+
+
+def _hang(stage):
+    with stage_timeout(stage):
+        time.sleep(5)
+
+
+def test_run_with_timeout_ok():
+    """Test that the result of the child process is returned."""
+    eq_(3, run_with_timeout(5, _add, 1, 2))
+
+
+@raises(JobTimeout)
+def test_run_with_timeout_job():
+    """Test that JobTimeout is raised if the child takes too long."""
+    run_with_timeout(0.2, time.sleep, 5)
+
+
+@raises(StageTimeout)
+def test_run_with_timeout_stage():
+    """Test that StageTimeout is raised if a stage takes too long."""
+    timeouts = settings.get('TIMEOUTS')
+    settings['TIMEOUTS'] = {'load': 0.2}
+    try:
+        run_with_timeout(5, _hang, 'load')
+    finally:
+        if timeouts is None:
+            del settings['TIMEOUTS']
+        else:
+            settings['TIMEOUTS'] = timeouts
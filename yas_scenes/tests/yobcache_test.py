@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.settings import settings
+from yas_scenes.utils import content_hash, evict
+from yas_scenes.yobcache import cached, lookup
+
+
+class TestStructureCache(object):
+
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.pdb = os.path.join(self.path, '1crn.pdb')
+        with open(self.pdb, 'w') as f:
+            f.write('HEADER    PLANT PROTEIN\n')
+        settings['STRUCTURE_CACHE'] = {'DIR': os.path.join(self.path, 'yob')}
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+        settings['STRUCTURE_CACHE'] = {}
+
+    def test_lookup(self):
+        """Test that objects are keyed by content and found once saved."""
+        yob_path, cached = lookup(content_hash(self.pdb))
+        ok_(not cached)
+        ok_(yob_path.endswith('{}.yob'.format(content_hash(self.pdb))))
+        os.makedirs(os.path.dirname(yob_path))
+        open(yob_path, 'w').close()
+        eq_((yob_path, True), lookup(content_hash(self.pdb)))
+
+    def test_disabled(self):
+        """Test that nothing is cached without a cache dir."""
+        settings['STRUCTURE_CACHE'] = {}
+        eq_((None, False), lookup(content_hash(self.pdb)))
+
+    def test_evict(self):
+        """Test that the least recently used files are evicted first."""
+        for i, name in enumerate(['old.yob', 'new.yob', 'other.txt']):
+            path = os.path.join(self.path, name)
+            with open(path, 'w') as f:
+                f.write('x' * 100)
+            os.utime(path, (i, i))
+        eq_(1, evict(self.path, 150, '.yob'))
+        eq_(['1crn.pdb', 'new.yob', 'other.txt'],
+            sorted(os.listdir(self.path)))
+
+    def test_cached(self):
+        """Test that new objects are counted until the cache is full."""
+        settings['STRUCTURE_CACHE']['MAX_BYTES'] = 150
+        yob_dir = os.path.join(self.path, 'yob')
+        os.makedirs(yob_dir)
+        for i in xrange(3):
+            path = os.path.join(yob_dir, '{}.yob'.format(i))
+            with open(path, 'w') as f:
+                f.write('x' * 60)
+            os.utime(path, (i, i))
+            eq_(1 if i == 2 else 0, cached(path))
+        eq_(['1.yob', '2.yob'], sorted(os.listdir(yob_dir)))
+        eq_(0, cached(os.path.join(yob_dir, 'missing.yob')))
@@ -0,0 +1,104 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from nose.tools import eq_, ok_
+
+from yas_scenes.zygote import EXIT_STATUS, FRAME, Zygote
+
+
+def fake_main(argv):
+    os.write(1, 'out {}\n'.format(' '.join(argv)))
+    os.system('echo err >&2')
+    sys.exit(3)
+
+
+def hanging_main(argv):
+    """Start a process in a process group of its own, as the watchdog does,
+    and hang."""
+    p = subprocess.Popen(['sleep', '60'], preexec_fn=os.setpgrp)
+    os.write(1, '{}\n'.format(p.pid))
+    time.sleep(60)
+
+
+def _fork(main, env, argv):
+    """Let a fork of a zygote handle a request with main, return its pid and
+    the client connection."""
+    client, server = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        client.close()
+        code = 1
+        try:
+            code = Zygote('unused', main).handle(server)
+        finally:
+            os._exit(code)
+    server.close()
+    client.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd(),
+                               'env': env}) + '\n')
+    return pid, client
+
+
+def _run(env, argv):
+    """Let a fork of a zygote handle a request, return its output and exit
+    status."""
+    pid, client = _fork(fake_main, env, argv)
+    f = client.makefile('rb', 0)
+    output = {'o': '', 'e': ''}
+    while True:
+        channel, length = FRAME.unpack(f.read(FRAME.size))
+        data = f.read(length)
+        if channel == 'x':
+            break
+        output[channel] = output[channel] + data
+    client.close()
+    os.waitpid(pid, 0)
+    return output, EXIT_STATUS.unpack(data)[0]
+
+
+def _alive(pid):
+    """Return True if a process is running; zombies are not."""
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as f:
+            stat = f.read()
+    except IOError:
+        return False
+    return stat[stat.rindex(')') + 2] != 'Z'
+
+
+def test_handle():
+    """Test that output and exit status of the command reach the client."""
+    env = dict(os.environ)
+    output, code = _run(env, ['batch', 'jobs.txt'])
+    eq_({'o': 'out batch jobs.txt\n', 'e': 'err\n'}, output)
+    eq_(3, code)
+
+
+def test_other_settings():
+    """Test that clients with other settings are refused."""
+    env = dict(os.environ)
+    env['SCENES_SETTINGS'] = 'other_settings.json'
+    output, code = _run(env, ['batch', 'jobs.txt'])
+    eq_('', output['o'])
+    eq_(2, code)
+
+
+def test_hang_up():
+    """Test that processes of the command are killed when the client hangs
+    up, also in other process groups."""
+    pid, client = _fork(hanging_main, dict(os.environ), ['batch'])
+    f = client.makefile('rb', 0)
+    channel, length = FRAME.unpack(f.read(FRAME.size))
+    grandchild = int(f.read(length))
+    ok_(_alive(grandchild))
+    f.close()
+    client.close()
+    os.waitpid(pid, 0)
+    for _ in xrange(50):
+        if not _alive(grandchild):
+            break
+        time.sleep(0.1)
+    ok_(not _alive(grandchild))
@@ -0,0 +1,135 @@
+from __future__ import division
+
+import logging
+_log = logging.getLogger(__name__)
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from yas_scenes.batch import BatchRunner
+from yas_scenes.listcache import get_cache
+from yas_scenes.scheduler import get_batch_setting, order_jobs
+from yas_scenes.settings import settings
+
+
+def doubling(limit):
+    """Return 1, 2, 4, ... up to and including limit, and limit itself."""
+    values = []
+    value = 1
+    while value < limit:
+        values.append(value)
+        value = value * 2
+    return values + [limit]
+
+
+def grid(n_cpus, workers=None, threads=None):
+    """Return the configurations to try: (workers, threads per worker).
+
+    By default threads per worker doubles up to MAX_THREADS and workers
+    doubles up to the number that keeps all cpus busy. Configurations using
+    more threads than cpus are left out.
+    """
+    threads = threads or doubling(min(get_batch_setting('MAX_THREADS', 4),
+                                      n_cpus))
+    configs = []
+    for n_threads in sorted(set(threads)):
+        for n_workers in sorted(set(workers or
+                                    doubling(max(1, n_cpus // n_threads)))):
+            if n_workers * n_threads <= n_cpus:
+                configs.append((n_workers, n_threads))
+    return configs
+
+
+def sample_jobs(jobs, n):
+    """Return n jobs spread evenly over the jobs ordered by estimated cost,
+    so cheap and expensive jobs are represented as in the whole set."""
+    jobs = order_jobs(jobs)
+    if n >= len(jobs):
+        return jobs
+    return [jobs[i * len(jobs) // n] for i in xrange(n)]
+
+
+@contextmanager
+def trial_settings(scenes_root):
+    """Write scenes below scenes_root, and render every scene: the scene
+    store and structure cache are disabled, and the parsed list cache is
+    cleared, so all trials do the same work.
+    """
+    keys = ('PDB_SCENES_ROOT', 'REDO_SCENES_ROOT', 'SCENE_STORE',
+            'STRUCTURE_CACHE')
+    saved = dict((key, settings[key]) for key in keys if key in settings)
+    settings['PDB_SCENES_ROOT'] = os.path.join(scenes_root, 'PDB')
+    settings['REDO_SCENES_ROOT'] = os.path.join(scenes_root, 'REDO')
+    settings['SCENE_STORE'] = {}
+    settings['STRUCTURE_CACHE'] = {}
+    get_cache().clear()
+    try:
+        yield
+    finally:
+        for key in keys:
+            settings.pop(key, None)
+        settings.update(saved)
+
+
+def measure(pipeline, make_jobs, n_workers, n_threads, first_ypid=None):
+    """Run the jobs of make_jobs with n_workers YASARA processes of
+    n_threads threads each.
+
+    Return the number of scenes created per hour.
+    """
+    scenes_root = tempfile.mkdtemp(prefix='scenes-tune-')
+    try:
+        with trial_settings(scenes_root):
+            start = time.time()
+            done, failed = BatchRunner(pipeline, n_workers * n_threads,
+                                       first_ypid,
+                                       n_threads=n_threads).run(make_jobs())
+            elapsed = time.time() - start
+    finally:
+        shutil.rmtree(scenes_root, ignore_errors=True)
+    if failed:
+        _log.warning('{} of {} jobs failed with {} workers x {} threads'
+                     .format(failed, done + failed, n_workers, n_threads))
+    return 3600 * done / max(elapsed, 1e-6)
+
+
+def tune(pipeline, make_jobs, configs, first_ypid=None):
+    """Measure the throughput of each configuration, see measure.
+
+    make_jobs must return fresh jobs for every trial.
+    Return the best configuration, (workers, threads), and the throughput of
+    each configuration.
+    """
+    rates = {}
+    for n_workers, n_threads in configs:
+        _log.info('Trying {} workers x {} threads'.format(n_workers,
+                                                          n_threads))
+        rates[(n_workers, n_threads)] = measure(pipeline, make_jobs,
+                                                n_workers, n_threads,
+                                                first_ypid)
+        _log.info('{} workers x {} threads: {:.1f} scenes/hour'.format(
+            n_workers, n_threads, rates[(n_workers, n_threads)]))
+    # Ties go to the configuration using fewest cpus
+    best = max(configs, key=lambda c: (rates[c], -c[0] * c[1]))
+    return best, rates
+
+
+def write_settings(path, n_workers, n_threads):
+    """Store a configuration as BATCH CORES and THREADS in a settings file.
+
+    The file is replaced atomically; the order of the settings is kept.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f, object_pairs_hook=OrderedDict)
+    batch = data.setdefault('BATCH', OrderedDict())
+    batch['CORES'] = n_workers * n_threads
+    batch['THREADS'] = n_threads
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2, separators=(',', ': '))
+        f.write('\n')
+    os.rename(path + '.tmp', path)
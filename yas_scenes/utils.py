@@ -2,21 +2,21 @@ import logging
 _log = logging.getLogger(__name__)
 
 import errno
+import hashlib
 import os
 import re
+import threading
 
+from yas_scenes.joblog import DEBUG_FORMATTER
 from yas_scenes.settings import settings
+from yas_scenes.structure import GZIP_MAGIC, is_gzipped
 
 
 PDB_ID_PAT = re.compile(r"^[0-9a-zA-Z]{4}$")
 
-
-def create_file_logger(log_path):
-    """Create a log file."""
-    # root logger
-    _root = logging.getLogger()
-    _file = logging.FileHandler(log_path, 'w')
-    _root.addHandler(_file)
+# Evictor evicts down to this fraction of the maximum size, so the next walk
+# is only needed after the dir has grown by the rest
+EVICT_TO = 0.9
 
 
 def delete_scene(scene_path):
@@ -27,7 +27,7 @@ def delete_scene(scene_path):
     """
     try:
         os.remove(scene_path)
-        _log.debug('Deleted {}'.format(scene_path))
+        _log.debug('Deleted %s', scene_path)
         return True
     except OSError as e:
         if e.errno != errno.ENOENT:
@@ -37,6 +37,119 @@ def delete_scene(scene_path):
             False
 
 
+def content_hash(path):
+    """Return the SHA-1 hex digest of the contents of the file at path.
+
+    Raise IOError if the file cannot be read.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict(root, max_bytes, suffix='', orphans_first=False):
+    """Remove the least recently used files under root until the files
+    ending with suffix take no more than max_bytes.
+
+    Files are ordered by modification time, so touch files when they are
+    used. If orphans_first, files without other hard links are removed
+    before files with other links.
+
+    Return the number of removed files.
+    """
+    return evict_files(root, max_bytes, suffix, orphans_first)[0]
+
+
+def evict_files(root, max_bytes, suffix='', orphans_first=False):
+    """Evict files as evict does.
+
+    Return the number of removed files and the size of the remaining ones.
+    """
+    files = []
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            if not file_name.endswith(suffix):
+                continue
+            path = os.path.join(dir_path, file_name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            linked = orphans_first and st.st_nlink > 1
+            files.append((linked, st.st_mtime, st.st_size, path))
+            total = total + st.st_size
+
+    removed = 0
+    for linked, mtime, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError as e:
+            _log.error('Could not evict {}: {}'.format(path, e))
+            continue
+        total = total - size
+        removed = removed + 1
+    if removed:
+        _log.info('Evicted {} files from {}'.format(removed, root))
+    return removed, total
+
+
+class Evictor(object):
+    """Keeps the files ending with suffix under root below a maximum size,
+    without walking root for every added file.
+
+    The size of the files is found by walking root once, and is then kept
+    up to date with the sizes of added files. Only when it exceeds the
+    maximum are files evicted (see evict), down to EVICT_TO of the maximum,
+    which walks root again and corrects the size for files added by other
+    processes.
+    """
+
+    def __init__(self, root, suffix='', orphans_first=False):
+        self.root = root
+        self.suffix = suffix
+        self.orphans_first = orphans_first
+        self.total = None
+        self.lock = threading.Lock()
+
+    def added(self, size, max_bytes):
+        """Account for a file of size bytes added under root, and evict
+        files if the files take more than max_bytes.
+
+        Return the number of removed files.
+        """
+        with self.lock:
+            if self.total is None:
+                # Evicting to the maximum walks root and finds its size
+                removed, self.total = evict_files(
+                    self.root, max_bytes, self.suffix, self.orphans_first)
+                return removed
+            self.total = self.total + size
+            if self.total <= max_bytes:
+                return 0
+            removed, self.total = evict_files(
+                self.root, int(max_bytes * EVICT_TO), self.suffix,
+                self.orphans_first)
+            return removed
+
+
+_evictors = {}
+_evictors_lock = threading.Lock()
+
+
+def get_evictor(root, suffix='', orphans_first=False):
+    """Return the Evictor of root for this process."""
+    with _evictors_lock:
+        key = (root, suffix, orphans_first)
+        if key not in _evictors:
+            _evictors[key] = Evictor(root, suffix, orphans_first)
+        return _evictors[key]
+
+
 def ensure_dir_existence(scene_dir):
     """Create scene_dir if it does not exists.
 
@@ -60,6 +173,20 @@ def is_valid_file(parser, arg):
         return arg
 
 
+def is_valid_structure(parser, arg):
+    """Check if the structure file exists, is not empty and can be read.
+
+    PDB and mmCIF files may be gzipped, in which case the file should start
+    with the gzip magic number.
+    """
+    arg = is_valid_file(parser, arg)
+    if is_gzipped(arg):
+        with open(arg, 'rb') as f:
+            if f.read(2) != GZIP_MAGIC:
+                parser.error('The file {} is not gzipped!'.format(arg))
+    return arg
+
+
 def is_valid_pdbid(parser, arg):
     """Check if this is a valid PDB identifier (anno 2014)."""
     if not re.search(PDB_ID_PAT, arg):
@@ -72,26 +199,27 @@ def set_debug_loggers():
     """Set the loglevel of all loggers to DEBUG."""
     # root logger
     logging.getLogger().setLevel(logging.DEBUG)
-    formatter = logging.Formatter("%(asctime)s | %(levelname)-7s | %(message)s"
-                                  " [in %(pathname)s:%(lineno)d]")
     for handler in logging.getLogger().handlers:
-        handler.setFormatter(formatter)
+        handler.setFormatter(DEBUG_FORMATTER)
     _log.debug('Set verbose logging')
 
 
-def set_dir_log_wn(args, mode):
-    """Scene dir, scene path, log, verbose log, yasara log, why_not.
+def get_scene_dir(source, mode, pdb_id):
+    """Return the dir with the scene of this PDB ID, source and mode."""
+    if source == 'PDB':
+        return os.path.join(settings['PDB_SCENES_ROOT'], mode, pdb_id)
+    elif source == 'REDO':
+        return os.path.join(settings['REDO_SCENES_ROOT'], mode, pdb_id)
+
+
+def scene_paths(args, mode):
+    """Scene dir, scene path, log, yasara log, why_not.
 
-    Return scene path and yasara log, why_not path and db
+    Return scene path, log path, yasara log, why_not path and db
 
     Raise an OSError if the dir could not be created or is not writable, etc.
     """
-    if args.source == 'PDB':
-        scene_dir = os.path.join(settings['PDB_SCENES_ROOT'],
-                                 mode, args.pdb_id)
-    elif args.source == 'REDO':
-        scene_dir = os.path.join(settings['REDO_SCENES_ROOT'],
-                                 mode, args.pdb_id)
+    scene_dir = get_scene_dir(args.source, mode, args.pdb_id)
     ensure_dir_existence(scene_dir)
     scene_name = settings['SCENES_NAME']
     scene_nam = scene_name[mode][0]
@@ -100,9 +228,6 @@ def set_dir_log_wn(args, mode):
 
     log = 'scenes_{}_{}.log'.format(args.pdb_id, scene_nam)
     log_path = os.path.join(scene_dir, log)
-    create_file_logger(log_path)
-    if args.verbose:
-        set_debug_loggers()
 
     yas_log = '{}_{}'.format(args.pdb_id, scene_nam)
     yas_log_path = os.path.join(scene_dir, yas_log)
@@ -111,7 +236,7 @@ def set_dir_log_wn(args, mode):
         args.pdb_id, scene_nam))
     wn_db = '{}_SCENES_{}'.format(args.source, scene_name[mode][1])
 
-    return scene_path, yas_log_path, wn_file_path, wn_db
+    return scene_path, log_path, yas_log_path, wn_file_path, wn_db
 
 
 def write_whynot(pdb_id, reason, db, why_not_file_path=None):
@@ -0,0 +1,280 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import glob
+import os
+import time
+
+from yas_scenes.index import find_list_files
+from yas_scenes.lease import WorkDir
+from yas_scenes.settings import settings
+from yas_scenes.utils import (PDB_ID_PAT, delete_scene, get_scene_dir,
+                              write_whynot)
+
+
+# Changes in a change feed
+FEED_ACTIONS = ('added', 'modified', 'obsoleted')
+
+# Scene types and the subcommand that creates them
+MODES = (('iod', 'ion'), ('ss2', 'symm'))
+
+
+class ChangeFeed(object):
+    """A change feed written by the PDB mirror job.
+
+    Every line of the feed has an action and a PDB ID, e.g.
+        added 1crn
+        modified 1cra
+        obsoleted 2mus
+    The mirror job appends lines. The offset up to which the feed was read is
+    kept in <feed>.offset, so every change is read once, also after a
+    restart. If the feed is shorter than the offset, it was rotated and is
+    read from the start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + '.offset'
+
+    def _offset(self):
+        try:
+            with open(self.offset_path, 'r') as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 0
+
+    def read(self):
+        """Return the new changes, (action, pdb_id) tuples in order, and the
+        offset up to which the feed was read.
+
+        Only complete lines are read; invalid lines are logged and skipped.
+        The offset is only kept once it is saved, see save, so changes that
+        were not handled are read again after a restart.
+        """
+        offset = self._offset()
+        try:
+            if os.path.getsize(self.path) < offset:
+                _log.info('{} was rotated'.format(self.path))
+                offset = 0
+            with open(self.path, 'r') as f:
+                f.seek(offset)
+                data = f.read()
+        except (IOError, OSError) as e:
+            _log.error(e)
+            return [], None
+
+        end = data.rfind('\n') + 1
+        changes = []
+        for line in data[:end].splitlines():
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) != 2 or fields[0] not in FEED_ACTIONS or \
+                    not PDB_ID_PAT.match(fields[1]):
+                _log.error("Invalid change: '{}'".format(line))
+                continue
+            changes.append((fields[0], fields[1].lower()))
+        return changes, offset + end
+
+    def save(self, offset):
+        """Keep the offset up to which the changes were handled."""
+        if offset is None:
+            return
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.rename(tmp_path, self.offset_path)
+
+
+class ListPoller(object):
+    """Find added, modified and removed list files by polling.
+
+    The list databank dirs are stat-polled. The first poll only takes a
+    snapshot: changes are found relative to the previous poll.
+    """
+
+    def __init__(self, list_dirs):
+        self.list_dirs = list_dirs
+        self.snapshot = None
+
+    def take_snapshot(self):
+        snapshot = {}
+        for mode, list_dir in self.list_dirs.iteritems():
+            for pdb_id, path in find_list_files(list_dir, mode):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[pdb_id] = snapshot.get(pdb_id, ()) + \
+                    ((mode, st.st_size, st.st_mtime),)
+        return snapshot
+
+    def read(self):
+        """Return the changes since the previous poll, (action, pdb_id)
+        tuples sorted by PDB ID, and the snapshot of this poll.
+
+        The next poll compares with the snapshot once it is saved, see save.
+        """
+        snapshot = self.take_snapshot()
+        previous = self.snapshot
+        if previous is None:
+            _log.info('Watching {} entries'.format(len(snapshot)))
+            return [], snapshot
+
+        changes = []
+        for pdb_id in sorted(set(snapshot) | set(previous)):
+            if pdb_id not in previous:
+                changes.append(('added', pdb_id))
+            elif pdb_id not in snapshot:
+                changes.append(('obsoleted', pdb_id))
+            elif sorted(snapshot[pdb_id]) != sorted(previous[pdb_id]):
+                changes.append(('modified', pdb_id))
+        return changes, snapshot
+
+    def save(self, snapshot):
+        """Find the changes of the next poll relative to snapshot."""
+        self.snapshot = snapshot
+
+
+def list_file(mode, pdb_id):
+    """Return the path to the list file of this PDB ID, or None if there is
+    none.
+
+    LIST_FILES is configured in scenes_settings, with a path template per
+    list type, e.g. {"iod": "/data/wi-lists/iod/{pdb_id}.iod.bz2"}.
+    """
+    path = settings.get('LIST_FILES', {}).get(mode, '').format(pdb_id=pdb_id)
+    return path if path and os.path.isfile(path) else None
+
+
+def withdraw(pdb_id, source):
+    """Delete the scenes of an obsoleted entry and explain why in a WHY NOT
+    file."""
+    for mode, command in MODES:
+        scene_dir = get_scene_dir(source, mode, pdb_id)
+        scenes = glob.glob(os.path.join(scene_dir, '*.sce'))
+        for scene_path in scenes:
+            delete_scene(scene_path)
+            write_whynot(pdb_id, 'PDB entry obsoleted', '{}_SCENES_{}'.format(
+                source, settings['SCENES_NAME'][mode][1]),
+                os.path.splitext(scene_path)[0] + '.whynot')
+
+
+class Watcher(object):
+    """Submit jobs for changed entries to a WorkDir served by workers.
+
+    Changes are read from feeds, a ChangeFeed and/or a ListPoller, every
+    interval seconds (WATCH.INTERVAL in scenes_settings by default). For
+    added and modified entries a job is submitted for every scene type with a
+    list file (see list_file), unless the same job is still pending in the
+    work dir. Scenes of obsoleted entries are withdrawn.
+
+    Scene types of an entry without a list file yet wait for it for
+    WATCH.LIST_WAIT seconds (default: a day), and are checked again at every
+    interval. They are kept in the file waiting in the work dir, with a line
+    per scene type: the mode, PDB ID and the time it started waiting.
+
+    Start the workers with 'scenes work --follow', so they are warm when
+    jobs arrive.
+    """
+
+    def __init__(self, work_dir, source, parse_job, feeds, interval=None):
+        self.work_dir = WorkDir(work_dir)
+        self.source = source
+        self.parse_job = parse_job
+        self.feeds = feeds
+        self.interval = interval or \
+            settings.get('WATCH', {}).get('INTERVAL', 60)
+        self.list_wait = settings.get('WATCH', {}).get('LIST_WAIT', 86400)
+        self.waiting_path = os.path.join(work_dir, 'waiting')
+        self.waiting = self.load_waiting()
+
+    def load_waiting(self):
+        """Return the scene types waiting for a list file: a dict of
+        (mode, pdb_id) and the time they started waiting."""
+        waiting = {}
+        try:
+            with open(self.waiting_path, 'r') as f:
+                for line in f:
+                    mode, pdb_id, since = line.split()
+                    waiting[(mode, pdb_id)] = float(since)
+        except IOError:
+            pass
+        except ValueError as e:
+            _log.error('Invalid {}: {}'.format(self.waiting_path, e))
+        return waiting
+
+    def save_waiting(self, waiting):
+        """Keep the scene types waiting for a list file."""
+        tmp_path = self.waiting_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for (mode, pdb_id), since in sorted(waiting.items()):
+                f.write('{} {} {!r}\n'.format(mode, pdb_id, since))
+        os.rename(tmp_path, self.waiting_path)
+        self.waiting = waiting
+
+    def jobs_for(self, changes):
+        """Return the jobs for these changes and the scene types waiting for
+        a list file. Obsoleted entries are withdrawn."""
+        now = time.time()
+        waiting = dict(self.waiting)
+        for action, pdb_id in changes:
+            for mode, command in MODES:
+                if action == 'obsoleted':
+                    waiting.pop((mode, pdb_id), None)
+                else:
+                    waiting.setdefault((mode, pdb_id), now)
+            if action == 'obsoleted':
+                withdraw(pdb_id, self.source)
+
+        pending = set(name.split('_', 1)[1]
+                      for name in self.work_dir.pending())
+        commands = dict(MODES)
+        jobs = []
+        for (mode, pdb_id), since in sorted(waiting.items()):
+            path = list_file(mode, pdb_id)
+            if not path:
+                if now - since > self.list_wait:
+                    _log.info('{}: no {} list, gave up waiting'.format(
+                        pdb_id, mode))
+                    del waiting[(mode, pdb_id)]
+                continue
+            del waiting[(mode, pdb_id)]
+            if '{}_{}_{}'.format(mode, self.source, pdb_id) in pending:
+                continue
+            structure = settings['STRUCTURE_FILES'][self.source].format(
+                pdb_id=pdb_id)
+            job = self.parse_job([structure, pdb_id, self.source,
+                                  commands[mode], path])
+            if job:
+                jobs.append(job)
+        return jobs, waiting
+
+    def check(self):
+        """Read all feeds once and submit jobs for the changes.
+
+        The feeds only move on once the jobs are submitted, so changes are
+        not lost if submitting fails.
+        Return the number of submitted jobs.
+        """
+        changes = []
+        positions = []
+        for feed in self.feeds:
+            feed_changes, position = feed.read()
+            changes.extend(feed_changes)
+            positions.append(position)
+        jobs, waiting = self.jobs_for(changes)
+        if jobs:
+            self.work_dir.submit(jobs)
+        self.save_waiting(waiting)
+        for feed, position in zip(self.feeds, positions):
+            feed.save(position)
+        return len(jobs)
+
+    def run(self, once=False):
+        """Check for changes every interval seconds, or only once."""
+        while True:
+            self.check()
+            if once:
+                return
+            time.sleep(self.interval)
@@ -0,0 +1,163 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import errno
+import multiprocessing
+import os
+import signal
+import time
+from contextlib import contextmanager
+
+from yas_scenes.profiling import profiled
+from yas_scenes.settings import settings
+from yas_scenes.utils import delete_scene
+
+
+class StageTimeout(Exception):
+    """Raised when a YASARA command takes longer than its stage timeout."""
+
+
+class JobTimeout(Exception):
+    """Raised when a job takes longer than the job timeout."""
+
+
+def get_timeout(stage):
+    """Return the timeout in seconds for this stage, or None.
+
+    Stages are 'load', 'save', 'exit' and 'job'. TIMEOUTS is configured in
+    scenes_settings, e.g. {"load": 600, "save": 600, "job": 1800}.
+    Stages without a timeout may take forever.
+    """
+    return settings.get('TIMEOUTS', {}).get(stage)
+
+
+@contextmanager
+def stage_timeout(stage):
+    """Raise StageTimeout if the block takes longer than the stage timeout.
+
+    The timeout is implemented with SIGALRM, so it can only be used in the main
+    thread of a process. Blocking calls to YASARA are interrupted by the
+    signal.
+    """
+    seconds = get_timeout(stage)
+    if not seconds:
+        yield
+        return
+
+    def handler(signum, frame):
+        raise StageTimeout('{} took longer than {} s'.format(stage, seconds))
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def kill_process_group(pgid):
+    """Kill all processes in this process group, e.g. a job and its YASARA.
+
+    Return True if any process was killed.
+    """
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+        _log.debug('Killed process group %s', pgid)
+        return True
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+        return False
+
+
+def _run_child(conn, func, args):
+    """Run func in a new process group and send its result through conn.
+
+    YASARA is started by this process and therefore killed together with it.
+    The YASARA work is profiled if profiling is enabled, see profiling.
+    """
+    os.setpgid(0, 0)
+    try:
+        with profiled(func.__name__):
+            result = func(*args)
+        conn.send(('done', result))
+    except StageTimeout as e:
+        conn.send(('timeout', str(e)))
+    finally:
+        conn.close()
+
+
+def run_with_timeout(timeout, func, *args):
+    """Run func(*args) in a child process and return its result.
+
+    The child process and its YASARA are killed if func does not finish in
+    timeout seconds (wait forever if timeout is None) or if a stage timed out.
+
+    Raise JobTimeout or StageTimeout if so.
+    Raise RuntimeError if the child process died without a result.
+    """
+    recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+    p = multiprocessing.Process(target=_run_child,
+                                args=(send_conn, func, args))
+    p.start()
+    send_conn.close()
+    try:
+        os.setpgid(p.pid, p.pid)
+    except OSError:
+        # The child did this itself already
+        pass
+
+    try:
+        if not recv_conn.poll(timeout):
+            kill_process_group(p.pid)
+            raise JobTimeout('job took longer than {} s'.format(timeout))
+        status, result = recv_conn.recv()
+    except EOFError:
+        kill_process_group(p.pid)
+        raise RuntimeError('Job process died with exit code {}'.format(
+            p.exitcode))
+    finally:
+        recv_conn.close()
+        p.join()
+
+    if status == 'timeout':
+        # YASARA may still hang around
+        kill_process_group(p.pid)
+        raise StageTimeout(result)
+    return result
+
+
+def run_with_retries(task, scene_path, *args):
+    """Run task(*args) with a watchdog, retrying it if it times out.
+
+    The task is run by run_with_timeout, with the 'job' timeout. After a
+    timeout the scene is deleted and the task is retried up to RETRIES times,
+    waiting RETRY_BACKOFF seconds before the first retry and twice as long
+    before every next one. RETRIES and RETRY_BACKOFF are configured in
+    scenes_settings.
+
+    Return a boolean indicating whether everything went succesful
+    Return also a string reporting the most important reason why things went
+        ok or went wrong.
+    """
+    retries = settings.get('RETRIES', 0)
+    backoff = settings.get('RETRY_BACKOFF', 10)
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            wait = backoff * 2 ** (attempt - 1)
+            _log.info('Retrying {} in {} s ({}/{})'.format(scene_path, wait,
+                                                          attempt, retries))
+            time.sleep(wait)
+        try:
+            return run_with_timeout(get_timeout('job'), task, *args)
+        except (JobTimeout, StageTimeout) as e:
+            _log.error('Timeout creating {}: {}'.format(scene_path, e))
+            delete_scene(scene_path)
+            reason = e
+        except RuntimeError as e:
+            _log.error(e)
+            delete_scene(scene_path)
+            return False, 'Error creating YASARA scene'
+
+    return False, 'Timeout creating YASARA scene: {}'.format(reason)
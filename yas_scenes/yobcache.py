@@ -0,0 +1,69 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import os
+
+from yas_scenes.settings import settings
+from yas_scenes.utils import evict, get_evictor
+
+
+def get_cache_setting(key, default=None):
+    """Return this structure cache setting.
+
+    STRUCTURE_CACHE is configured in scenes_settings, e.g.
+        {"DIR": "/data/scenes/yob", "MAX_BYTES": 10737418240}
+    The cache is disabled if there is no DIR.
+    """
+    value = settings.get('STRUCTURE_CACHE', {}).get(key)
+    return default if value is None else value
+
+
+def object_path(cache_dir, key):
+    """Return the path of the YASARA object file with this key."""
+    return os.path.join(cache_dir, key[:2], '{}.yob'.format(key))
+
+
+def lookup(structure_hash):
+    """Return the path of the cached YASARA object of a structure file, and
+    whether it is present.
+
+    The object file is keyed by the content hash of the structure file (see
+    utils.content_hash), so a changed structure is loaded and cached again.
+    Hits are touched, so the least recently used objects are evicted first.
+
+    Return None and False if the cache is disabled.
+    """
+    cache_dir = get_cache_setting('DIR')
+    if not cache_dir:
+        return None, False
+    path = object_path(cache_dir, structure_hash)
+    try:
+        os.utime(path, None)
+        return path, True
+    except OSError:
+        return path, False
+
+
+def evict_objects():
+    """Evict cached YASARA objects above MAX_BYTES (default 10 GB)."""
+    cache_dir = get_cache_setting('DIR')
+    if cache_dir and os.path.isdir(cache_dir):
+        evict(cache_dir, get_cache_setting('MAX_BYTES', 10 * 1024 ** 3),
+              '.yob')
+
+
+def cached(yob_path):
+    """Account for a newly cached YASARA object, and evict objects once the
+    cache exceeds MAX_BYTES, see utils.Evictor.
+
+    Return the number of evicted objects.
+    """
+    cache_dir = get_cache_setting('DIR')
+    if not cache_dir:
+        return 0
+    try:
+        size = os.path.getsize(yob_path)
+    except OSError:
+        return 0
+    return get_evictor(cache_dir, '.yob').added(
+        size, get_cache_setting('MAX_BYTES', 10 * 1024 ** 3))
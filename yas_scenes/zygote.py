@@ -0,0 +1,184 @@
+import logging
+_log = logging.getLogger(__name__)
+
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from yas_scenes.health import kill_tree
+from yas_scenes.settings import settings_file
+
+
+# A frame sent to the client: channel and length, followed by the data.
+# The exit frame has the exit status as data, see EXIT_STATUS.
+FRAME = struct.Struct('!cI')
+EXIT_STATUS = struct.Struct('!i')
+STDOUT, STDERR, EXIT = 'o', 'e', 'x'
+
+
+def send_frame(conn, lock, channel, data):
+    with lock:
+        conn.sendall(FRAME.pack(channel, len(data)) + data)
+
+
+def read_request(conn):
+    """Read a request: a JSON line with argv, cwd and env of the client."""
+    data = ''
+    while not data.endswith('\n'):
+        chunk = conn.recv(4096)
+        if not chunk:
+            raise IOError('Incomplete request')
+        data = data + chunk
+    return json.loads(data)
+
+
+def exit_status(e):
+    """Return the exit status of a SystemExit, as the interpreter would."""
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    sys.stderr.write('{}\n'.format(e.code))
+    return 1
+
+
+class Zygote(object):
+    """Server that runs scenes commands in forks of a warm interpreter.
+
+    The server imports yas_scenes, its settings and YASARA's python module
+    once. Every connection is handled by a fork of the server, which runs
+    the command line of the client (see scripts/scenes-client) in the cwd
+    and environment of the client. Output written to stdout and stderr, by
+    the fork and by the processes it starts, is sent to the client in
+    frames, followed by the exit status. If the client goes away, the fork
+    and all its descendants are killed.
+
+    The settings are read once, so clients must use the same settings file.
+    """
+
+    def __init__(self, path, main=None):
+        self.path = path
+        self.main = main
+        self.settings_path = os.path.realpath(settings_file)
+
+    def preload(self):
+        """Import everything a command needs."""
+        if self.main is None:
+            # pipeline imports YASARA's python module
+            from yas_scenes import pipeline
+            from yas_scenes.application import main
+            self.main = main
+
+    def serve(self):
+        """Accept connections and fork a child for each, forever."""
+        self.preload()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(64)
+        # Children are not waited for
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        _log.info('Zygote listening on {}'.format(self.path))
+        while True:
+            try:
+                conn, address = server.accept()
+            except socket.error as e:
+                _log.error(e)
+                continue
+            if os.fork() == 0:
+                server.close()
+                code = 1
+                try:
+                    code = self.handle(conn)
+                finally:
+                    os._exit(code)
+            conn.close()
+
+    def handle(self, conn):
+        """Run the request on conn. This runs in a fork of the server.
+
+        Return the exit status of the command; it is also sent to the client.
+        """
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+        request = read_request(conn)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+
+        lock = threading.Lock()
+        forwarders = []
+        for fd, channel in ((1, STDOUT), (2, STDERR)):
+            r, w = os.pipe()
+            os.dup2(w, fd)
+            os.close(w)
+            forwarder = threading.Thread(target=self._forward,
+                                         args=(conn, lock, r, channel))
+            forwarder.start()
+            forwarders.append(forwarder)
+        done = threading.Event()
+        watcher = threading.Thread(target=self._watch, args=(conn, done))
+        watcher.daemon = True
+        watcher.start()
+
+        code = 0
+        try:
+            client_settings = os.path.realpath(
+                request['env'].get('SCENES_SETTINGS', ''))
+            if client_settings != self.settings_path:
+                sys.stderr.write('The zygote uses settings {}, not {}\n'
+                                 .format(self.settings_path, client_settings))
+                code = 2
+            else:
+                self.main(request['argv'])
+        except SystemExit as e:
+            code = exit_status(e)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+
+        # Close the pipes, so the forwarders send the last output and stop
+        sys.stdout.flush()
+        sys.stderr.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        for forwarder in forwarders:
+            forwarder.join()
+        done.set()
+        send_frame(conn, lock, EXIT, EXIT_STATUS.pack(code))
+        conn.close()
+        return code
+
+    @staticmethod
+    def _forward(conn, lock, fd, channel):
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            try:
+                send_frame(conn, lock, channel, data)
+            except socket.error:
+                pass
+        os.close(fd)
+
+    @staticmethod
+    def _watch(conn, done):
+        """Kill this fork and all its descendants when the client hangs up
+        before the command is done.
+
+        Job processes run in process groups of their own (see watchdog), so
+        the whole process tree is killed rather than the process group.
+        """
+        try:
+            conn.recv(1)
+        except socket.error:
+            pass
+        if not done.is_set():
+            kill_tree(os.getpid())